@@ -1,10 +1,26 @@
-from utils import get_engine, logger
+from utils import get_connection, logger
+from instrumentation import pipeline_run, capture_plan
+from snapshot_cache import cache_enabled, read_frame
 from sqlalchemy import text 
 
+CASH_BY_SOURCE_SQL = """
+    SELECT 
+        source_table,
+        SUM(amount)
+    FROM gl_entries
+    WHERE account = 'Cash' AND year = 2021
+    GROUP BY source_table
+"""
+
+VIEW_CASH_SQL = """
+    SELECT 
+        cash
+    FROM dashboard_flux_analysis 
+    WHERE year = 2021
+"""
+
 def audit_2021_cashflow():
     """Audits the cash for the year 2021."""
-    engine = get_engine()
-
     results = {
     "sales_cash_in": 0.0,
     "loan_in": 0.0,
@@ -13,74 +29,52 @@ def audit_2021_cashflow():
             }
 
     try:
-        with engine.connect() as conn: # Connection opens here
-            logger.info("Connection established. Querying 2021 data...")
-            
-            # 1. Get the credit sales
-            results["sales_cash_in"] = conn.execute(text("""  
-                SELECT 
-                    SUM(quantity * price) 
-                FROM sales
-                WHERE EXTRACT(
-                    YEAR FROM (CASE WHEN payment_method = 'cash' THEN sale_at ELSE sale_at + INTERVAL '1 month' END)) = 2021
-            """)
-            ).scalar() or 0.0
-            
-            # 2. Get the loan inflow
-            results["loan_in"] = conn.execute(text("""  
-                SELECT 
-                    SUM(value) 
-                FROM loans
-                WHERE EXTRACT(YEAR FROM loan_at) = 2021
-            """)
-            ).scalar() or 0.0
+        if cache_enabled():
+            # 1-5. Cash per source and the view's cash from the local snapshot
+            ledger = read_frame('gl_entries', columns=['source_table', 'amount'],
+                                filters={'account': ['Cash'], 'year': [2021]})
+            cash_by_source = ledger.groupby('source_table')['amount'].sum().to_dict()
+            view = read_frame('dashboard_flux_analysis', columns=['cash'], filters={'year': [2021]})
+            view_cash = float(view['cash'].sum())
+        else:
+            with get_connection() as conn: # Connection opens here (shared pool)
+                logger.info("Connection established. Querying 2021 data...")
 
-            # 3. Get the purchase outflow
-            results["purchase_out"] = conn.execute(text("""
-                SELECT 
-                    SUM(quantity * amount)
-                FROM purchases 
-                WHERE EXTRACT(
-                    YEAR FROM (CASE WHEN payment_method = 'cash' THEN purchase_at ELSE purchase_at + INTERVAL '1 month' END)) = 2021
-            """)
-            ).scalar() or 0.0
+                # 1-4. Cash movement per source (sales, loans, purchases, payments)
+                #      from the general ledger in one grouped query
+                #      (plans are captured first when PIPELINE_EXPLAIN=1)
+                capture_plan(conn, "audit_cash_by_source", CASH_BY_SOURCE_SQL)
+                cash_by_source = dict(conn.execute(text(CASH_BY_SOURCE_SQL)).fetchall())
 
-            # 4. Get the expense outflow
-            results["expense_out"] = conn.execute(text("""
-                SELECT 
-                    SUM(amount)
-                    FROM payments
-                    WHERE EXTRACT(YEAR FROM payment_date) = 2021
-            """)
-            ).scalar() or 0.0
+                # 5. Get the Dashboard View's reported cash
+                capture_plan(conn, "audit_cash_view", VIEW_CASH_SQL)
+                view_cash = conn.execute(text(VIEW_CASH_SQL)).scalar() or 0.0
+                view_cash = float(view_cash)
 
-            # 5. Get the Dashboard View's reported cash
-            view_cash = conn.execute(text("""
-                SELECT 
-                    cash
-                FROM dashboard_flux_analysis 
-                WHERE year = 2021
-            """)
-            ).scalar() or 0.0
+        results["sales_cash_in"] = float(cash_by_source.get("sales") or 0.0)
+        results["loan_in"] = float(cash_by_source.get("loans") or 0.0)
+        results["purchase_out"] = -float(cash_by_source.get("purchases") or 0.0)
+        results["expense_out"] = -float(cash_by_source.get("payments") or 0.0)
 
-            net_cash_calculated = results["sales_cash_in"] + results["loan_in"] - results["purchase_out"] - results["expense_out"]
+        net_cash_calculated = results["sales_cash_in"] + results["loan_in"] - results["purchase_out"] - results["expense_out"]
 
-            # 3. Log the results
-            logger.info("2021 Cash Audit:")
-            for key, value in results.items():
-                logger.info(f"{key.replace('_', ' ').title()}: ${value:,.2f}")
+        # 3. Log the results
+        logger.info("2021 Cash Audit:")
+        for key, value in results.items():
+            logger.info(f"{key.replace('_', ' ').title()}: ${value:,.2f}")
 
-            logger.info(f"calculated Ending Cash (2021): ${net_cash_calculated:,.2f}")
-            logger.info(f"View Reported Cash (2021): ${view_cash:,.2f}")
+        logger.info(f"calculated Ending Cash (2021): ${net_cash_calculated:,.2f}")
+        logger.info(f"View Reported Cash (2021): ${view_cash:,.2f}")
 
-            if abs(net_cash_calculated - view_cash) < 0.01:
-                logger.info("✅ SUCCESS: Cash reconciliation matches!")
-            else:
-                diff = net_cash_calculated - view_cash
-                logger.warning(f"⚠️ Discrepancy of {diff:,.2f} found.")
+        if abs(net_cash_calculated - view_cash) < 0.01:
+            logger.info("✅ SUCCESS: Cash reconciliation matches!")
+        else:
+            diff = net_cash_calculated - view_cash
+            logger.warning(f"⚠️ Discrepancy of {diff:,.2f} found.")
 
     except Exception as e:
         logger.error(f"An error occurred during the cash audit: {e}")
             
 if __name__ == "__main__":
-    audit_2021_cashflow()
+    with pipeline_run("audit_cash"):
+        audit_2021_cashflow()
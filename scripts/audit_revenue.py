@@ -1,47 +1,58 @@
-from utils import get_engine, logger
+from utils import get_connection, logger
+from instrumentation import pipeline_run, capture_plan
+from snapshot_cache import cache_enabled, read_frame
 from sqlalchemy import text 
 
 def audit_2021_revenue():
     """Audits the revenue for the year 2021."""
-    engine = get_engine()
-
     # Initialize variables to 0.0 in case the queries fail
     view_revenue = 0.0
     raw_revenue = 0.0
 
     try:
-        with engine.connect() as conn: # Connection opens here
-            logger.info("Connection established. Querying 2021 data...")
-            
-            # 1. Get the number from your View
-            view_query = text("SELECT revenue FROM dashboard_flux_analysis WHERE year = 2021")
-            view_revenue = conn.execute(view_query).scalar() or 0.0
-    
-            # 2. Get the number from Raw Data (MOVED INSIDE THE WITH BLOCK)
-            raw_query = text("""
-                SELECT 
-                    SUM(quantity * price) 
-                FROM sales 
-                WHERE EXTRACT(YEAR FROM sale_at) = 2021
-            """)
-            # Also fixed: use raw_query directly as it is already wrapped in text()
-            raw_revenue = conn.execute(raw_query).scalar() or 0.0
+        if cache_enabled():
+            # 1-2. Both figures from the local snapshot of the current data version
+            view = read_frame('dashboard_flux_analysis', columns=['revenue'], filters={'year': [2021]})
+            view_revenue = float(view['revenue'].sum())
+            ledger = read_frame('gl_entries', columns=['amount'], filters={'account': ['Revenue'], 'year': [2021]})
+            raw_revenue = float(ledger['amount'].sum())
+        else:
+            with get_connection() as conn: # Connection opens here (shared pool)
+                logger.info("Connection established. Querying 2021 data...")
+
+                # 1. Get the number from your View
+                view_sql = "SELECT revenue FROM dashboard_flux_analysis WHERE year = 2021"
+                capture_plan(conn, "audit_revenue_view", view_sql)
+                view_query = text(view_sql)
+                view_revenue = conn.execute(view_query).scalar() or 0.0
 
-            # 3. Compare and Report (MOVED INSIDE THE WITH BLOCK)
-            logger.info("2021 Revenue Audit:")
-            logger.info(f"View Revenue (2021): {view_revenue:,.2f}")
-            logger.info(f"Raw Revenue (2021): {raw_revenue:,.2f}")
+                # 2. Get the number from the ledger's Revenue postings
+                raw_sql = """
+                    SELECT 
+                        SUM(amount) 
+                    FROM gl_entries 
+                    WHERE account = 'Revenue' AND year = 2021
+                """
+                capture_plan(conn, "audit_revenue_ledger", raw_sql)
+                raw_query = text(raw_sql)
+                # Also fixed: use raw_query directly as it is already wrapped in text()
+                raw_revenue = conn.execute(raw_query).scalar() or 0.0
+            # Connection automatically closes here once we exit the 'with' block
 
-            if abs(view_revenue - raw_revenue) < 0.01:
-                logger.info("The revenue figures match!")
-            else:
-                diff = view_revenue - raw_revenue
-                logger.warning(f"Discrepancy of {diff:,.2f} found between the view and raw data.")
+        # 3. Compare and Report
+        logger.info("2021 Revenue Audit:")
+        logger.info(f"View Revenue (2021): {view_revenue:,.2f}")
+        logger.info(f"Raw Revenue (2021): {raw_revenue:,.2f}")
 
-        # Connection automatically closes here once we exit the 'with' block
+        if abs(view_revenue - raw_revenue) < 0.01:
+            logger.info("The revenue figures match!")
+        else:
+            diff = view_revenue - raw_revenue
+            logger.warning(f"Discrepancy of {diff:,.2f} found between the view and raw data.")
 
     except Exception as e:
         logger.error(f"An error occurred during the revenue audit: {e}")
             
 if __name__ == "__main__":
-    audit_2021_revenue()
\ No newline at end of file
+    with pipeline_run("audit_revenue"):
+        audit_2021_revenue()
\ No newline at end of file
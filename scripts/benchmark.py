@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import text
+from utils import get_connection, logger
+from synthetic import write_setup_script
+from main import run_pipeline
+from audit_cash import CASH_BY_SOURCE_SQL
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# The reads the dashboard and the audits issue after every refresh
+READ_QUERIES = {
+    'dashboard_all_years': "SELECT * FROM dashboard_flux_analysis ORDER BY year",
+    'dashboard_one_year': "SELECT * FROM dashboard_flux_analysis WHERE year = 2022",
+    'audit_cash_by_source': CASH_BY_SOURCE_SQL,
+    'audit_revenue_ledger': "SELECT SUM(amount) FROM gl_entries WHERE account = 'Revenue' AND year = 2021",
+    'ledger_account_year': "SELECT account, year, SUM(amount) FROM gl_entries GROUP BY 1, 2",
+}
+
+
+def time_reads(repeat):
+    """Median wall time of each read query over repeat runs (after one warm-up)."""
+    timings = {}
+    with get_connection() as conn:
+        for name, sql in READ_QUERIES.items():
+            conn.execute(text(sql)).fetchall()
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.execute(text(sql)).fetchall()
+                samples.append(time.perf_counter() - started)
+            timings[name] = statistics.median(samples)
+    return timings
+
+
+def run_scale(sales_rows, seed, repeat):
+    """Generates (or reuses) the script for one scale, runs the whole pipeline on it and times the reads."""
+    path = os.path.join(BENCH_DIR, 'data', f"synthetic_{sales_rows}_{seed}.sql")
+    if not os.path.exists(path):
+        write_setup_script(path, sales_rows, seed=seed)
+
+    run = run_pipeline(full_refresh=True, sql_file_path=path)
+    failed = [stage.name for stage in run.stages if stage.status != 'ok']
+    return {
+        "run_id": run.run_id,
+        "failed_stages": failed,
+        "stages": {stage.name: round(stage.seconds, 4) for stage in run.stages},
+        "reads": {name: round(seconds, 6) for name, seconds in time_reads(repeat).items()},
+    }
+
+
+def find_regressions(results, baseline, threshold, min_seconds):
+    """Timings more than threshold (a fraction) and min_seconds slower than the baseline."""
+    regressions = []
+    for scale, result in results.items():
+        base = baseline.get(scale)
+        if not base:
+            continue
+        for kind in ('stages', 'reads'):
+            for name, seconds in result[kind].items():
+                before = base.get(kind, {}).get(name)
+                if before is None:
+                    continue
+                if seconds > before * (1 + threshold) and seconds - before > min_seconds:
+                    regressions.append((scale, name, before, seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data at several scales.")
+    parser.add_argument("--scales", type=int, nargs='+', default=[1_000_000],
+                        help="sales rows per scale factor, e.g. 1000000 10000000 100000000")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per read query (median is kept)")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a fraction (default: %(default)s)")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="ignore slowdowns smaller than this many seconds (timer noise)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store these results as the new baseline instead of comparing")
+    args = parser.parse_args()
+
+    results = {}
+    for sales_rows in args.scales:
+        logger.info(f"--- Benchmark: {sales_rows:,} sales rows ---")
+        results[str(sales_rows)] = run_scale(sales_rows, args.seed, args.repeat)
+
+    os.makedirs(os.path.join(BENCH_DIR, 'results'), exist_ok=True)
+    path = os.path.join(BENCH_DIR, 'results', f"{datetime.now():%Y%m%dT%H%M%S}.json")
+    with open(path, 'w') as f:
+        json.dump({"seed": args.seed, "results": results}, f, indent=2)
+    logger.info(f"Benchmark results written to {path}")
+
+    failed = [(scale, stage) for scale, result in results.items() for stage in result["failed_stages"]]
+    for scale, stage in failed:
+        logger.error(f"Stage {stage} failed at {scale} rows.")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Baseline updated: {args.baseline}")
+        return 1 if failed else 0
+
+    if not os.path.exists(args.baseline):
+        logger.warning(f"No baseline at {args.baseline}; rerun with --update-baseline to create one.")
+        return 1 if failed else 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.threshold, args.min_seconds)
+    for scale, name, before, seconds in regressions:
+        logger.error(f"REGRESSION at {scale} rows: {name} {before:.3f}s -> {seconds:.3f}s "
+                     f"(+{(seconds / before - 1) * 100:.0f}%)")
+    if not regressions:
+        logger.info(f"No regressions beyond {args.threshold:.0%} against {args.baseline}.")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
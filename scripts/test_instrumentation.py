@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import instrumentation
+from instrumentation import pipeline_run, stage
+from utils import dispose_engine, get_connection
+
+
+def test_concurrent_stages_count_only_their_own_checkouts(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'runs.db'}")
+    monkeypatch.setattr(instrumentation, 'RUNS_DIR', str(tmp_path / 'runs'))
+    dispose_engine()
+    # Both stages hold their stage open until the other has finished its checkouts
+    barrier = threading.Barrier(2)
+
+    def work(name, checkouts):
+        with stage(name):
+            for _ in range(checkouts):
+                with get_connection() as conn:
+                    conn.execute(text("SELECT 1"))
+            barrier.wait()
+
+    try:
+        with pipeline_run("concurrent") as run:
+            threads = [threading.Thread(target=work, args=(name, n)) for name, n in (('a', 3), ('b', 5))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    finally:
+        dispose_engine()
+
+    stages = {record.name: record for record in run.stages}
+    assert stages['concurrent.a'].checkouts == 3
+    assert stages['concurrent.b'].checkouts == 5
+    assert stages['concurrent'].checkouts == 8
+    # Connections are created in the threads that check them out
+    assert stages['concurrent'].connections_created == \
+        stages['concurrent.a'].connections_created + stages['concurrent.b'].connections_created >= 1
@@ -0,0 +1,19 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from main import focus_since_year
+
+
+def test_focus_view_rebuilds_all_years_when_a_schedule_ran():
+    recent = {'payments': datetime(2023, 6, 1)}
+    # Incremental load alone: the touched years, with a year of slack for accruals
+    assert focus_since_year({'load': recent}) == 2022
+    assert focus_since_year({'load': {}}) == 9999
+    # A schedule rebuilt in the same run can change postings of earlier years
+    assert focus_since_year({'load': recent, 'depreciation_schedule': True}) is None
+    assert focus_since_year({'load': {}, 'accrual_schedule': True}) is None
+    # Skipped or full load
+    assert focus_since_year({}) is None
+    assert focus_since_year({'load': None}) is None
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from read_service import ReadService, _statement_params
+
+
+def counting_service(version):
+    """A service over one slow query that counts how often the database would be hit."""
+    calls = []
+    lock = threading.Lock()
+
+    def statement(start_year, end_year):
+        with lock:
+            calls.append((start_year, end_year))
+        time.sleep(0.05)
+        return pd.DataFrame({'year': range(start_year, end_year + 1), 'net_income': 1.5})
+
+    service = ReadService(queries={'/flux': (statement, _statement_params)}, workers=4,
+                          version=lambda: version[0])
+    return service, calls
+
+
+def test_identical_requests_share_one_query_and_the_cache():
+    version = ['v1']
+    service, calls = counting_service(version)
+
+    async def scenario():
+        first = await asyncio.gather(*(service.respond('GET', '/flux?start_year=2021&end_year=2022')
+                                       for _ in range(20)))
+        again = await service.respond('GET', '/flux?end_year=2022&start_year=2021')
+        other = await service.respond('GET', '/flux?start_year=2022&end_year=2022')
+        # A new pipeline run stamps a new version: the old entries no longer match
+        version[0] = 'v2'
+        service.version_checked = 0.0
+        rerun = await service.respond('GET', '/flux?start_year=2021&end_year=2022')
+        bad = await service.respond('GET', '/flux?start_year=soon')
+        return first, again, other, rerun, bad
+
+    first, again, other, rerun, bad = asyncio.run(scenario())
+    assert sorted(headers['X-Cache'] for _, _, headers in first) == ['coalesced'] * 19 + ['miss']
+    assert json.loads(first[0][1]) == [{'year': 2021, 'net_income': 1.5}, {'year': 2022, 'net_income': 1.5}]
+    assert again[2]['X-Cache'] == 'hit'
+    assert other[2]['X-Cache'] == 'miss'
+    assert rerun[2] == {'X-Cache': 'miss', 'X-Data-Version': 'v2'}
+    assert bad[0] == 400
+    assert calls == [(2021, 2022), (2022, 2022), (2021, 2022)]
+
+
+def test_http_round_trip():
+    service, calls = counting_service(['v1'])
+
+    async def scenario():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b"GET /flux?start_year=2023&end_year=2023 HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        return response
+
+    head, body = asyncio.run(scenario()).split(b"\r\n\r\n", 1)
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert b"X-Data-Version: v1" in head
+    assert json.loads(body) == [{'year': 2023, 'net_income': 1.5}]
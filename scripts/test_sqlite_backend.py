@@ -0,0 +1,59 @@
+import os
+import sys
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from pipeline import extract_load, create_custom_financial_tables, create_focus_view
+from statements import compute_flux_statement, load_snapshot, STATEMENT_COLUMNS
+from synthetic import write_setup_script
+from utils import dispose_engine, get_backend, get_connection
+
+
+@pytest.fixture(scope="module")
+def sqlite_db(tmp_path_factory):
+    """A synthetic setup script loaded into a file-backed SQLite database."""
+    directory = tmp_path_factory.mktemp("sqlite_backend")
+    script = str(directory / "setup.sql")
+    write_setup_script(script, 3000, seed=7)
+
+    patch = pytest.MonkeyPatch()
+    patch.setenv("DATABASE_URL", f"sqlite:///{directory / 'pipeline.db'}")
+    dispose_engine()
+    try:
+        assert get_backend() == 'sqlite'
+        extract_load(sql_file_path=script)
+        assert create_custom_financial_tables()
+        yield directory
+    finally:
+        dispose_engine()
+        patch.undo()
+
+
+@pytest.mark.parametrize("method", ['weighted_average', 'latest', 'fifo'])
+def test_sqlite_statement_matches_statement_engine(sqlite_db, method):
+    """The SQLite statement equals the offline engine's, which test_statements.py ties to the PostgreSQL view."""
+    assert create_focus_view(costing_method=method)
+    with get_connection() as conn:
+        view = pd.read_sql_query(text("SELECT * FROM dashboard_flux_analysis ORDER BY year"), conn)
+        snapshot = load_snapshot(conn)
+
+    offline = compute_flux_statement(snapshot, costing_method=method)
+    assert list(view['year']) == list(offline['year'])
+    pd.testing.assert_frame_equal(
+        view[STATEMENT_COLUMNS].astype(float).fillna(0), offline[STATEMENT_COLUMNS].astype(float).fillna(0),
+        atol=0.011, rtol=0,
+    )
+
+
+def test_sqlite_rollup_adds_up_to_yearly_movements(sqlite_db):
+    assert create_focus_view()
+    with get_connection() as conn:
+        rollup = pd.read_sql_query(text("SELECT account, grain, year, movement FROM flux_rollup"), conn)
+        yearly = pd.read_sql_query(text("SELECT year, account, annual_movement FROM flux_yearly_movements"), conn)
+
+    expected = yearly.set_index(['account', 'year'])['annual_movement'].sort_index()
+    for grain in ('month', 'quarter', 'year'):
+        totals = rollup[rollup['grain'] == grain].groupby(['account', 'year'])['movement'].sum().sort_index()
+        pd.testing.assert_series_equal(totals, expected, check_names=False, atol=0.01, rtol=0)
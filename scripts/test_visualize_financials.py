@@ -0,0 +1,38 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from visualize_financials import CHART_COLUMNS, chart_pack, render_charts
+
+
+def statement_frame():
+    frame = pd.DataFrame({column: [1.0e6, 2.0e6, 3.0e6] for column in CHART_COLUMNS})
+    frame['year'] = [2021, 2022, 2023]
+    frame.insert(0, 'entity_id', '')
+    return frame
+
+
+def test_chart_pack_renders_once_and_redraws_only_changed_inputs(tmp_path):
+    frame = statement_frame()
+    specs = chart_pack([2021, 2022, 2023], formats=('png', 'svg'), dpi=40)
+    assert len(specs) == 2 * 3 * 2
+
+    first = render_charts(specs, frame, output_folder=str(tmp_path), workers=2)
+    assert {result['status'] for result in first.values()} == {'rendered'}
+    assert all(os.path.getsize(tmp_path / name) > 0 for name in first)
+
+    again = render_charts(specs, frame, output_folder=str(tmp_path), workers=2)
+    assert {result['status'] for result in again.values()} == {'skipped'}
+
+    frame.loc[frame['year'] == 2023, 'cash'] = 5.0e6
+    changed = render_charts(specs, frame, output_folder=str(tmp_path), workers=2)
+    redrawn = sorted(name for name, result in changed.items() if result['status'] == 'rendered')
+    # Only the figure drawing cash for 2023 changes; working capital and PP&E don't show cash
+    assert redrawn == ['overview_2022_2023.png', 'overview_2022_2023.svg']
+
+
+def test_missing_years_are_reported_not_drawn(tmp_path):
+    specs = chart_pack([2023, 2024], dpi=40)
+    results = render_charts(specs, statement_frame(), output_folder=str(tmp_path), workers=1)
+    assert {result['status'] for result in results.values()} == {'empty'}
@@ -1,74 +1,285 @@
+import argparse
+import hashlib
+import json
 import os
-import psycopg2
+import time
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+# Non-interactive backend: charts are only ever written to files, also from worker processes
+matplotlib.use('Agg')
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
 import numpy as np
+from sqlalchemy import bindparam, text
+from utils import get_connection, logger
+from snapshot_cache import cache_enabled, read_frame
 
-def create_financial_plots():
-    # 1. Clear memory to fix the wide green bar issue
-    plt.close('all') 
-    
-    # 2. PATH LOGIC: Move UP one level to create 'Images' in the root
-    script_dir = os.path.dirname(os.path.abspath(__file__)) # current folder: /scripts
-    project_root = os.path.dirname(script_dir)             # root folder: /workspace
-    output_folder = os.path.join(project_root, 'Images')
-    
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    
-    output_path = os.path.join(output_folder, 'p_and_l_chart_fixed.png')
+OUTPUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Images')
+# Input hash of every chart written, to skip the ones whose data hasn't changed
+MANIFEST_NAME = '.chart_manifest.json'
+# Bump when the drawing code changes, so every chart is redrawn once
+RENDER_VERSION = 1
+DEFAULT_CHART_WORKERS = min(4, os.cpu_count() or 1)
 
-    try:
-        # 3. Connection & Query
-        conn = psycopg2.connect(
-            host="db", database="postgres", user="postgres", password="postgres", port="5432"
-        )
-        query = "SELECT * FROM dashboard_flux_analysis WHERE year IN (2021, 2022) ORDER BY year"
-        df = pd.read_sql_query(sql=query, con=conn)
-        conn.close()
-        
-        # 4. Data Setup
-        years = df['year'].astype(str).tolist()
+CHART_COLUMNS = ['year', 'revenue', 'net_income', 'cash', 'accounts_receivable', 'accounts_payable',
+                 'debt_remaining', 'inventory', 'gross_ppe', 'net_ppe']
+
+# Metric group -> panel. 'by_year' puts years on the x axis with a bar per
+# metric; 'by_metric' puts metrics on the x axis with a bar per year.
+METRIC_GROUPS = {
+    'p_and_l': {
+        'title': 'P&L Overview: Revenue, Expenses, & Profit',
+        'layout': 'by_year',
+        'metrics': [('revenue', 'Total Revenue', '#2ecc71'),
+                    ('total_expenses', 'Total Expenses', '#e74c3c'),
+                    ('net_income', 'Net Income', '#3498db')],
+    },
+    'balance_sheet': {
+        'title': 'Balance Sheet Comparison',
+        'layout': 'by_metric',
+        'metrics': [('cash', 'Cash on Hand', None),
+                    ('debt_remaining', 'Debt Remaining', None),
+                    ('inventory', 'Inventory Value', None)],
+    },
+    'working_capital': {
+        'title': 'Working Capital',
+        'layout': 'by_metric',
+        'metrics': [('accounts_receivable', 'Accounts Receivable', None),
+                    ('accounts_payable', 'Accounts Payable', None),
+                    ('inventory', 'Inventory Value', None)],
+    },
+    'fixed_assets': {
+        'title': 'Property, Plant & Equipment',
+        'layout': 'by_metric',
+        'metrics': [('gross_ppe', 'Gross PP&E', None), ('net_ppe', 'Net PP&E', None)],
+    },
+}
+YEAR_COLORS = ['#9b59b6', '#e67e22', '#1abc9c', '#34495e']
+
+# The original figure: 2021 vs 2022 P&L and balance sheet
+DEFAULT_CHART = {'name': 'p_and_l_chart_fixed', 'years': [2021, 2022],
+                 'groups': ['p_and_l', 'balance_sheet'], 'format': 'png', 'dpi': 300, 'entity': None}
+
+
+def chart_pack(years, entities=(None,), formats=('png',), dpi=150):
+    """Chart specs for every consecutive year pair: the overview figure plus one per remaining metric group.
+
+    entity None is the pipeline's own statement (dashboard_flux_analysis);
+    an entity id charts that entity's rows of entity_flux_analysis.
+    """
+    years = sorted({int(year) for year in years})
+    figures = [('overview', ['p_and_l', 'balance_sheet']), ('working_capital', ['working_capital']),
+               ('fixed_assets', ['fixed_assets'])]
+    specs = []
+    for entity in entities:
+        for first, second in zip(years, years[1:]):
+            for name, groups in figures:
+                for fmt in formats:
+                    prefix = f"{entity}_" if entity else ''
+                    specs.append({'name': f"{prefix}{name}_{first}_{second}", 'years': [first, second],
+                                  'groups': groups, 'format': fmt, 'dpi': dpi, 'entity': entity})
+    return specs
+
+
+def fetch_chart_rows(years=None, entities=()):
+    """All statement rows the charts need, in one read; entity_id is '' for the pipeline's own statement.
+
+    Without entities the rows come from the snapshot cache when it is
+    enabled, like the other readers of the view.
+    """
+    columns = ', '.join(CHART_COLUMNS)
+    entities = [entity for entity in entities if entity]
+    if cache_enabled() and not entities:
+        frame = read_frame('dashboard_flux_analysis', columns=CHART_COLUMNS,
+                           filters={'year': years} if years else None, sort_by='year')
+        frame.insert(0, 'entity_id', '')
+        return frame
+
+    year_filter = " WHERE year IN :years" if years else ""
+    sql = f"SELECT '' AS entity_id, {columns} FROM dashboard_flux_analysis{year_filter}"
+    params = {"years": list(years)} if years else {}
+    if entities:
+        sql += (f" UNION ALL SELECT entity_id, {columns} FROM entity_flux_analysis "
+                f"WHERE entity_id IN :entities{year_filter.replace(' WHERE', ' AND')}")
+        params["entities"] = entities
+    query = text(sql + " ORDER BY entity_id, year")
+    for name in params:
+        query = query.bindparams(bindparam(name, expanding=True))
+    with get_connection() as conn:
+        return pd.read_sql_query(sql=query, con=conn, params=params)
+
+
+# Drawn columns computed from others
+DERIVED_COLUMNS = {'total_expenses': ['revenue', 'net_income']}
+
+
+def spec_columns(spec):
+    """The statement columns a spec draws, so charts of other metrics don't change its hash."""
+    columns = ['year']
+    for group in spec['groups']:
+        for column, _, _ in METRIC_GROUPS[group]['metrics']:
+            for source in DERIVED_COLUMNS.get(column, [column]):
+                if source not in columns:
+                    columns.append(source)
+    return columns
+
+
+def chart_rows(frame, spec):
+    """The rows and columns one spec draws, in year order, as plain floats."""
+    rows = frame[(frame['entity_id'] == (spec['entity'] or '')) & frame['year'].isin(spec['years'])]
+    rows = rows.sort_values('year')[spec_columns(spec)].astype(float).fillna(0.0)
+    return rows.reset_index(drop=True)
+
+
+def input_hash(spec, rows):
+    """Hash of everything a chart's pixels depend on."""
+    payload = json.dumps({'spec': spec, 'rows': rows.to_dict('list'), 'render_version': RENDER_VERSION},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _money(axis):
+    axis.yaxis.set_major_formatter(mtick.FuncFormatter(lambda x, p: f'${x*1e-6:.1f}M'))
+
+
+def draw_panel(ax, group, rows):
+    width = 0.15 # Skinny bars
+    years = rows['year'].astype(int).astype(str).tolist()
+    metrics = group['metrics']
+    if any(column == 'total_expenses' for column, _, _ in metrics):
+        rows = rows.assign(total_expenses=rows['revenue'] - rows['net_income'])
+
+    if group['layout'] == 'by_year':
         x = np.arange(len(years))
-        width = 0.15 # Skinny bars
-        df['total_expenses'] = df['revenue'] - df['net_income']
-            
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 12))
-
-        # --- Chart 1: P&L Overview ---
-        # Plotting each only ONCE to fix the legend and width
-        ax1.bar(x - width, df['revenue'], width, label='Total Revenue', color='#2ecc71')
-        ax1.bar(x, df['total_expenses'], width, label='Total Expenses', color='#e74c3c') 
-        ax1.bar(x + width, df['net_income'], width, label='Net Income', color='#3498db')
-
-        ax1.set_title('P&L Overview: Revenue, Expenses, & Profit', fontsize=14, pad=15)
-        ax1.set_ylabel('Amount ($)')
-        ax1.yaxis.set_major_formatter(mtick.FuncFormatter(lambda x, p: f'${x*1e-6:.1f}M'))
-        ax1.set_xticks(x)
-        ax1.set_xticklabels(years)
-        ax1.legend()
-        ax1.grid(True, linestyle='--', alpha=0.6)
-
-        # --- Chart 2: Balance Sheet Comparison ---
-        metrics = ['cash', 'debt_remaining', 'inventory']
-        x_bs = np.arange(len(metrics))
-        ax2.bar(x_bs - width/2, df.iloc[0][metrics], width, label='2021', color='#9b59b6')
-        ax2.bar(x_bs + width/2, df.iloc[1][metrics], width, label='2022', color='#e67e22')
-        ax2.set_title('Balance Sheet Comparison (2021 vs 2022)', fontsize=14, pad=15)
-        ax2.yaxis.set_major_formatter(mtick.FuncFormatter(lambda x, p: f'${x*1e-6:.1f}M'))
-        ax2.set_xticks(x_bs)
-        ax2.set_xticklabels(['Cash on Hand', 'Debt Remaining', 'Inventory Value'])
-        ax2.legend()
-        ax2.grid(axis='y', linestyle='--', alpha=0.7)
-
-        # 5. Save and Print
-        plt.tight_layout()
-        plt.savefig(output_path, dpi=300) 
-        print(f"✅ Success! File saved in ROOT Images folder: {output_path}")
-            
+        for i, (column, label, color) in enumerate(metrics):
+            ax.bar(x + (i - (len(metrics) - 1) / 2) * width, rows[column], width, label=label, color=color)
+        ax.set_title(group['title'], fontsize=14, pad=15)
+        ax.set_ylabel('Amount ($)')
+        ax.set_xticks(x)
+        ax.set_xticklabels(years)
+        ax.grid(True, linestyle='--', alpha=0.6)
+    else:
+        x = np.arange(len(metrics))
+        columns = [column for column, _, _ in metrics]
+        for i, year in enumerate(years):
+            ax.bar(x + (i - (len(years) - 1) / 2) * width, rows.iloc[i][columns], width,
+                   label=year, color=YEAR_COLORS[i % len(YEAR_COLORS)])
+        ax.set_title(f"{group['title']} ({' vs '.join(years)})", fontsize=14, pad=15)
+        ax.set_xticks(x)
+        ax.set_xticklabels([label for _, label, _ in metrics])
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+    _money(ax)
+    ax.legend()
+
+
+def render_chart(job):
+    """Draws one chart to its file; runs in a worker process. Returns the seconds it took."""
+    spec, rows, path = job
+    started = time.perf_counter()
+    groups = spec['groups']
+    fig, axes = plt.subplots(len(groups), 1, figsize=(10, 6 * len(groups)), squeeze=False)
+    try:
+        for ax, group in zip(axes[:, 0], groups):
+            draw_panel(ax, METRIC_GROUPS[group], rows)
+        if spec['entity']:
+            fig.suptitle(f"Entity: {spec['entity']}", fontsize=16)
+        fig.tight_layout()
+        fig.savefig(path, dpi=spec['dpi'], format=spec['format'])
+    finally:
+        plt.close(fig)
+    return time.perf_counter() - started
+
+
+def render_charts(specs, frame, output_folder=None, workers=DEFAULT_CHART_WORKERS, force=False):
+    """Renders the specs from the rows in frame; charts whose input hash is unchanged are skipped.
+
+    output_folder defaults to Images/. Charts are drawn in a process pool
+    (matplotlib is single-threaded).
+    Returns {chart file: {'status': 'rendered' | 'skipped' | 'empty' | 'failed', 'seconds': ...}}.
+    """
+    output_folder = output_folder or OUTPUT_FOLDER
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    results, jobs, hashes = {}, {}, {}
+    for spec in specs:
+        file_name = f"{spec['name']}.{spec['format']}"
+        rows = chart_rows(frame, spec)
+        if len(rows) != len(spec['years']):
+            logger.warning(f"[charts] {file_name}: no rows for some of {spec['years']}; not drawn.")
+            results[file_name] = {'status': 'empty', 'seconds': 0.0}
+            continue
+        hashes[file_name] = input_hash(spec, rows)
+        path = os.path.join(output_folder, file_name)
+        if not force and manifest.get(file_name) == hashes[file_name] and os.path.exists(path):
+            results[file_name] = {'status': 'skipped', 'seconds': 0.0}
+        else:
+            jobs[file_name] = (spec, rows, path)
+
+    started = time.perf_counter()
+    if len(jobs) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            futures = {file_name: pool.submit(render_chart, job) for file_name, job in jobs.items()}
+    else:
+        futures = None
+    for file_name, job in jobs.items():
+        try:
+            seconds = futures[file_name].result() if futures else render_chart(job)
+            results[file_name] = {'status': 'rendered', 'seconds': round(seconds, 3)}
+            manifest[file_name] = hashes[file_name]
+        except Exception as e:
+            logger.error(f"[charts] {file_name} failed: {e}")
+            results[file_name] = {'status': 'failed', 'seconds': 0.0}
+            manifest.pop(file_name, None)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    for file_name, result in sorted(results.items()):
+        logger.info(f"[charts] {file_name}: {result['status']} ({result['seconds']:.2f}s)")
+    rendered = sum(result['status'] == 'rendered' for result in results.values())
+    logger.info(f"[charts] {rendered} rendered, {len(results) - rendered} not redrawn, "
+                f"in {time.perf_counter() - started:.2f}s.")
+    return results
+
+
+def create_financial_plots():
+    """The original 2021 vs 2022 P&L and balance sheet figure, Images/p_and_l_chart_fixed.png."""
+    try:
+        frame = fetch_chart_rows(DEFAULT_CHART['years'])
+        results = render_charts([DEFAULT_CHART], frame, workers=1)
+        output_path = os.path.join(OUTPUT_FOLDER, f"{DEFAULT_CHART['name']}.{DEFAULT_CHART['format']}")
+        if results[os.path.basename(output_path)]['status'] in ('rendered', 'skipped'):
+            print(f"✅ Success! File saved in ROOT Images folder: {output_path}")
+        else:
+            print(f"❌ Error: {output_path} was not drawn")
     except Exception as e:
         print(f"❌ Error: {e}")
 
+
+def render_chart_pack(years=None, entities=(None,), formats=('png',), workers=DEFAULT_CHART_WORKERS, force=False):
+    """Every chart of chart_pack() for the given years (default: all years in the statement), from one read."""
+    frame = fetch_chart_rows(years, entities)
+    available = sorted(frame['year'].astype(int).unique())
+    return render_charts(chart_pack(years or available, entities, formats), frame, workers=workers, force=force)
+
+
 if __name__ == "__main__":
-    create_financial_plots()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Draw the financial charts into Images/.")
+    parser.add_argument("--pack", action="store_true", help="render every year pair and metric group")
+    parser.add_argument("--years", type=int, nargs="*", help="years to chart (default: all)")
+    parser.add_argument("--entity", action="append", default=[],
+                        help="also chart this entity from entity_flux_analysis (repeatable)")
+    parser.add_argument("--formats", nargs="*", default=['png'], help="file formats, e.g. png svg pdf")
+    parser.add_argument("--workers", type=int, default=DEFAULT_CHART_WORKERS)
+    parser.add_argument("--force", action="store_true", help="redraw charts whose data is unchanged")
+    args = parser.parse_args()
+
+    if args.pack:
+        render_chart_pack(args.years, [None] + args.entity, args.formats, args.workers, args.force)
+    else:
+        create_financial_plots()
@@ -12,4 +12,4 @@ CREATE TABLE expense_accrual_schedule AS
     FROM payments
     WHERE 
         payment_type IN ('wage', 'utility', 'tax')
-        AND EXTRACT(YEAR FROM payment_date) IN (2021, 2022, 2023);  
\ No newline at end of file
+        AND payment_date >= '2021-01-01' AND payment_date < '2024-01-01';  
\ No newline at end of file
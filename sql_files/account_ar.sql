@@ -1,8 +1,10 @@
+-- unique: year
 CREATE MATERIALIZED VIEW account_ar AS
+-- Year-end unpaid sales, posted to gl_entries by ledger.build_gl_entries()
 SELECT 
-    DATE_PART('year', payment_at) AS year,
+    year,
     'Accounts_Receivable' AS accont,
-    SUM(price * quantity) AS total_amount
-FROM sales
-WHERE payment_method <> 'cash' AND DATE_PART('month', payment_at) = 12
-GROUP BY DATE_PART('year', payment_at)      
\ No newline at end of file
+    SUM(amount) AS total_amount
+FROM gl_entries
+WHERE account = 'Accounts_Receivable'
+GROUP BY year
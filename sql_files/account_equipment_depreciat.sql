@@ -1,3 +1,5 @@
+-- Straight-line, half-year convention, 10-year life. The pipeline builds this
+-- table with depreciation.py (other methods and lives); this is the SQL form.
 DROP TABLE IF EXISTS equipment_depreciation_schedule;
 
 CREATE TABLE equipment_depreciation_schedule AS
@@ -11,14 +13,12 @@ WITH ppe_base AS (
 )
 SELECT 
     p.id,
-    c.year,
+    p.start_year + i AS year,
     p.cost AS gross_val,
     CASE 
-        WHEN c.year = p.start_year THEN (p.cost / 10.0) * 0.5
-        WHEN c.year = p.start_year + 10 THEN (p.cost / 10.0) * 0.5
-        WHEN c.year > p.start_year AND c.year < p.start_year + 10 THEN (p.cost / 10.0)
-        ELSE 0 
+        WHEN i IN (0, 10) THEN (p.cost / 10.0) * 0.5
+        ELSE (p.cost / 10.0)
     END AS annual_depreciation_expense
 FROM ppe_base p
-CROSS JOIN (SELECT DISTINCT EXTRACT(YEAR FROM calendar_at)::INT AS year FROM calendar) c
-WHERE c.year BETWEEN p.start_year AND p.start_year + 10;
\ No newline at end of file
+-- One row per year of life, however far it runs (no calendar table to cut it off)
+CROSS JOIN generate_series(0, 10) AS i;
\ No newline at end of file
@@ -1,27 +1,14 @@
-WITH combined_data AS (
-    -- Collect all inflows (Loans)
-    SELECT 
-        EXTRACT(YEAR FROM loan_at)::INT AS year, 
-        value AS amount
-    FROM loans
-    
-    UNION ALL
-    
-    -- Collect all outflows (Payments)
-    SELECT 
-        EXTRACT(YEAR FROM payment_date)::INT AS year, 
-        -amount AS amount
-    FROM payments
-    WHERE payment_type = 'loan'
-)
+-- Loan inflows and principal payments are both Loan_Principal postings in gl_entries
 SELECT
     year,
     'Loan' AS account,
     -- Sum the yearly amounts and then calculate the running total
     SUM(SUM(amount)) OVER (ORDER BY year) AS cumulative_loan_amount
 FROM 
-    combined_data
+    gl_entries
+WHERE
+    account = 'Loan_Principal'
 GROUP BY 
     year
 ORDER BY 
-    year;
\ No newline at end of file
+    year;
@@ -1,52 +1,24 @@
-WITH depreciation_date AS (
-    SELECT 
-        pa.id,
-        ca.calendar_at,
-        ca.year,
-        CASE 
-            WHEN ca.year = DATE_PART('year', pa.payment_date + interval '10 years') 
-            AND ca.month = DATE_PART('month', pa.payment_date)
-            THEN 1 
-            WHEN ca.month = 12 
-            THEN 1
-            ELSE 0 END AS flag_1_year,
-        pa.amount/COUNT(*) OVER (PARTITION BY pa.id) AS monthly_depreciation
-    FROM calendar AS ca
-    CROSS JOIN payments AS pa
-    WHERE 
-        ca.calendar_at >= pa.payment_date AND ca.calendar_at < pa.payment_date + INTERVAL '10 years'
-        AND pa.payment_type = 'equipment'
-),
-depreciation_sum AS (
-    SELECT 
-        *,  
-        SUM(monthly_depreciation) OVER (PARTITION BY id ORDER BY calendar_at)AS accumulated_depreciation
-    FROM depreciation_date
-),
-depreciation AS (
+WITH ppe_events AS (
+    -- Purchases add their full cost
     SELECT
-        year,
-        SUM(accumulated_depreciation) AS total_amount
-    FROM
-        depreciation_sum 
-    GROUP BY year   
-),
-ppe_purchase AS (
-    SELECT
-        DATE_PART('year', payment_date) AS year,
-        SUM(amount) AS total_amount
-    FROM payments 
+        EXTRACT(YEAR FROM payment_date)::INT AS year,
+        amount AS amount_change
+    FROM payments
     WHERE payment_type = 'equipment'
-    GROUP BY DATE_PART('year', payment_date)
-),
-ppe_union AS (  
-    SELECT * FROM depreciation
+
     UNION ALL
-    SELECT * FROM ppe_purchase
-)
+
+    -- Depreciation from the precomputed schedule (depreciation.py), which
+    -- covers every asset's full life
     SELECT
         year,
-        'Property, Plant & Equipment' AS account,
-        SUM(total_amount) OVER (ORDER BY year)AS total_amount
-    FROM ppe_union
-
+        -annual_depreciation_expense AS amount_change
+    FROM equipment_depreciation_schedule
+)
+SELECT
+    year,
+    'Property, Plant & Equipment' AS account,
+    SUM(SUM(amount_change)) OVER (ORDER BY year) AS total_amount
+FROM ppe_events
+GROUP BY year
+ORDER BY year
@@ -7,21 +7,16 @@ WITH revenue AS (
     FROM sales
     GROUP BY EXTRACT(YEAR FROM sale_at):: INT
 ),
-product_costS AS (
-    SELECT 
-       DISTINCT product_name,
-       amount
-    FROM purchases
-),
 Cogs AS (
+    -- Cost of sales at the product_cost unit cost, from the ledger
     SELECT 
-        EXTRACT(YEAR FROM s.sale_at):: INT AS year,
+        year,
         'Cost of Goods Sold' AS transaction_type,
         2 AS order_process,
-        -SUM(pc.amount * s.quantity) AS total_amount
-    FROM sales AS s
-    LEFT JOIN product_costs AS pc ON s.product_name = pc.product_name
-    GROUP BY EXTRACT(YEAR FROM s.sale_at):: INT
+        SUM(amount) AS total_amount
+    FROM gl_entries
+    WHERE account = 'COGS'
+    GROUP BY year
 ),
 depreciation_date AS (
     SELECT 
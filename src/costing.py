@@ -0,0 +1,165 @@
+from utils import logger
+from sqlalchemy import text
+
+COSTING_METHODS = ('latest', 'weighted_average', 'fifo')
+DEFAULT_COSTING_METHOD = 'weighted_average'
+
+# One row per product and effective range. Date-based methods use
+# [valid_from, valid_to) with the quantity range open; FIFO layers use the
+# cumulative purchased quantity [qty_from, qty_to) with the date range open.
+# Either way a sale matches exactly one row.
+PRODUCT_COST_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS product_cost (
+    product_name VARCHAR NOT NULL,
+    method VARCHAR NOT NULL,
+    valid_from DATE NOT NULL,
+    valid_to DATE NOT NULL,
+    qty_from NUMERIC NOT NULL,
+    qty_to NUMERIC NOT NULL,
+    unit_cost NUMERIC
+);
+CREATE INDEX IF NOT EXISTS product_cost_lookup_idx ON product_cost (product_name, valid_from, qty_from);
+"""
+
+# Cost as of each purchase day: the last price paid ('latest') or the
+# cumulative weighted average up to that day ('weighted_average'). The first
+# range reaches back to -infinity so earlier sales get the first known cost.
+DATED_COST_SQL = """
+INSERT INTO product_cost (product_name, method, valid_from, valid_to, qty_from, qty_to, unit_cost)
+WITH daily AS (
+    SELECT
+        product_name,
+        purchase_at::DATE AS day,
+        (ARRAY_AGG(amount ORDER BY purchase_at DESC, id DESC))[1] AS last_price,
+        SUM(quantity) AS qty,
+        SUM(quantity * amount) AS value
+    FROM purchases
+    {product_filter}
+    GROUP BY 1, 2
+),
+priced AS (
+    SELECT
+        product_name,
+        day,
+        CASE WHEN :method = 'latest' THEN last_price
+             ELSE SUM(value) OVER w / NULLIF(SUM(qty) OVER w, 0)
+        END AS unit_cost,
+        ROW_NUMBER() OVER w AS rn,
+        LEAD(day) OVER w AS next_day
+    FROM daily
+    WINDOW w AS (PARTITION BY product_name ORDER BY day)
+)
+SELECT
+    product_name,
+    :method,
+    CASE WHEN rn = 1 THEN '-infinity'::DATE ELSE day END,
+    COALESCE(next_day, 'infinity'::DATE),
+    0,
+    'Infinity'::NUMERIC,
+    unit_cost
+FROM priced
+"""
+
+# One layer per purchase in purchase order; the last layer stays open so
+# sales beyond the purchased quantity are costed at the latest layer.
+FIFO_COST_SQL = """
+INSERT INTO product_cost (product_name, method, valid_from, valid_to, qty_from, qty_to, unit_cost)
+WITH layers AS (
+    SELECT
+        product_name,
+        amount AS unit_cost,
+        SUM(quantity) OVER w - quantity AS qty_from,
+        SUM(quantity) OVER w AS qty_to,
+        ROW_NUMBER() OVER (PARTITION BY product_name ORDER BY purchase_at DESC, id DESC) AS rev_rn
+    FROM purchases
+    {product_filter}
+    WINDOW w AS (PARTITION BY product_name ORDER BY purchase_at, id ROWS UNBOUNDED PRECEDING)
+)
+SELECT
+    product_name,
+    'fifo',
+    '-infinity'::DATE,
+    'infinity'::DATE,
+    qty_from,
+    CASE WHEN rev_rn = 1 THEN 'Infinity'::NUMERIC ELSE qty_to END,
+    unit_cost
+FROM layers
+"""
+
+TOUCHED_PRODUCTS_SQL = """
+    product_name IN (
+        SELECT DISTINCT product_name FROM purchases WHERE purchase_at >= MAKE_DATE(:since_year, 1, 1)
+    )
+"""
+
+
+# Fingerprint of the touched products' FIFO layers. Layers are positions in
+# cumulative quantity, not dates, so any change to them (a new purchase cuts
+# the open last layer) can re-cost sales of any year.
+FIFO_LAYERS_DIGEST_SQL = f"""
+    SELECT md5(string_agg(concat_ws('|', product_name, qty_from, qty_to, unit_cost), ','
+                          ORDER BY product_name, qty_from))
+    FROM product_cost
+    WHERE {TOUCHED_PRODUCTS_SQL}
+"""
+
+
+def sales_cost_source(method):
+    """FROM-clause fragment giving each sale the position its FIFO layer is looked up by."""
+    if method == 'fifo':
+        # Quantity sold of the product before this sale, in sale order
+        return """(
+            SELECT sales.*,
+                SUM(quantity) OVER (PARTITION BY product_name ORDER BY sale_at, id ROWS UNBOUNDED PRECEDING)
+                    - quantity AS fifo_position
+            FROM sales
+        )"""
+    return "(SELECT sales.*, 0 AS fifo_position FROM sales)"
+
+
+# Join condition from a sale (alias s) to its single product_cost row (alias pc)
+SALES_COST_JOIN = """
+    pc.product_name = s.product_name
+    AND s.sale_at >= pc.valid_from AND s.sale_at < pc.valid_to
+    AND s.fifo_position >= pc.qty_from AND s.fifo_position < pc.qty_to
+"""
+
+
+def refresh_product_cost(conn, method=DEFAULT_COSTING_METHOD, since_year=None):
+    """Maintains product_cost for the given costing method.
+
+    With since_year only products purchased in years >= since_year are
+    recomputed. Returns True when every sale's cost may have moved: the
+    whole table was rebuilt (first build, method change or since_year=None),
+    or FIFO layers of a product changed, which also re-costs sales of years
+    before since_year.
+    """
+    if method not in COSTING_METHODS:
+        raise ValueError(f"Unknown costing method {method!r}; expected one of {COSTING_METHODS}")
+
+    conn.execute(text(PRODUCT_COST_TABLE_SQL))
+    stored = conn.execute(text("SELECT DISTINCT method FROM product_cost")).scalars().all()
+    if stored != [method]:
+        since_year = None
+
+    params = {"method": method, "since_year": since_year}
+    layers_before = None
+    if since_year is None:
+        conn.execute(text("TRUNCATE TABLE product_cost;"))
+        product_filter = ""
+    else:
+        if method == 'fifo':
+            layers_before = conn.execute(text(FIFO_LAYERS_DIGEST_SQL), params).scalar()
+        conn.execute(text(f"DELETE FROM product_cost WHERE {TOUCHED_PRODUCTS_SQL}"), params)
+        product_filter = f"WHERE {TOUCHED_PRODUCTS_SQL}"
+
+    cost_sql = FIFO_COST_SQL if method == 'fifo' else DATED_COST_SQL
+    rows = conn.execute(text(cost_sql.format(product_filter=product_filter)), params).rowcount
+    logger.info(
+        f"product_cost ({method}) refreshed: {rows:,} cost rows "
+        f"for {'all products' if since_year is None else f'products purchased since {since_year}'}."
+    )
+    if layers_before is not None and conn.execute(text(FIFO_LAYERS_DIGEST_SQL), params).scalar() != layers_before:
+        logger.info("FIFO layers changed; sales of every year are re-costed.")
+        return True
+    return since_year is None
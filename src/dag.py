@@ -0,0 +1,183 @@
+import hashlib
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from sqlalchemy import text
+from utils import get_connection, logger, table_exists
+from instrumentation import stage
+
+DAG_STATE_SQL = """
+CREATE TABLE IF NOT EXISTS dag_node_state (
+    node VARCHAR PRIMARY KEY,
+    input_hash VARCHAR NOT NULL,
+    finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+DEFAULT_WORKERS = 4
+
+
+class Node:
+    """One pipeline stage: the tables it reads and writes, and how to build them.
+
+    func(results) receives the return values of the nodes that ran so far
+    (a skipped node has no entry) and must return something other than
+    False on success. fingerprint is any text that changes when the node's
+    logic or parameters change, typically its SQL and arguments; it is
+    hashed together with the contents of the input tables.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), fingerprint=''):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.fingerprint = fingerprint
+
+
+def dependencies(nodes):
+    """Maps each node name to the names of the nodes producing one of its inputs."""
+    producers = {}
+    for node in nodes:
+        for table in node.outputs:
+            producers.setdefault(table, set()).add(node.name)
+    return {
+        node.name: {producer for table in node.inputs for producer in producers.get(table, ())} - {node.name}
+        for node in nodes
+    }
+
+
+def source_fingerprint(*objects):
+    """Source text of the functions/modules a node runs, so editing its SQL or logic invalidates it."""
+    return "\n".join(inspect.getsource(obj) for obj in objects)
+
+
+def table_fingerprint(conn, table):
+    """Order-independent content hash of a table: row count plus the sum of row hashes (one scan, no sort)."""
+    if not table_exists(conn, table):
+        return f"{table}:missing"
+    if conn.dialect.name == 'sqlite':
+        # No hashtext(): rows are hashed client-side, fine at embedded sizes
+        count, total = 0, 0
+        for row in conn.execute(text(f"SELECT * FROM {table}")):
+            count += 1
+            total += int.from_bytes(hashlib.blake2b(repr(tuple(row)).encode('utf-8'), digest_size=8).digest(), 'little')
+        return f"{table}:{count}:{total % 2 ** 64}"
+    count, total = conn.execute(
+        text(f"SELECT COUNT(*), COALESCE(SUM(hashtext(t::text)::BIGINT), 0) FROM {table} t")
+    ).one()
+    return f"{table}:{count}:{total}"
+
+
+def input_hash(node):
+    with get_connection() as conn:
+        parts = [node.fingerprint] + [table_fingerprint(conn, table) for table in sorted(node.inputs)]
+    return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+
+
+def read_state():
+    with get_connection() as conn:
+        conn.execute(text(DAG_STATE_SQL))
+        conn.commit()
+        return dict(conn.execute(text("SELECT node, input_hash FROM dag_node_state")).fetchall())
+
+
+def outputs_exist(node):
+    with get_connection() as conn:
+        return all(table_exists(conn, table) for table in node.outputs)
+
+
+def save_state(node, digest):
+    with get_connection() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO dag_node_state (node, input_hash, finished_at)
+                VALUES (:node, :digest, CURRENT_TIMESTAMP)
+                ON CONFLICT (node) DO UPDATE
+                SET input_hash = EXCLUDED.input_hash, finished_at = EXCLUDED.finished_at
+            """),
+            {"node": node.name, "digest": digest},
+        )
+        conn.commit()
+
+
+def forget_state(node):
+    with get_connection() as conn:
+        conn.execute(text("DELETE FROM dag_node_state WHERE node = :node"), {"node": node.name})
+        conn.commit()
+
+
+def run_dag(nodes, max_workers=DEFAULT_WORKERS, force=False):
+    """Runs the nodes on a thread pool as soon as the nodes they depend on are done.
+
+    Each node works on its own pooled connection(s). A node is skipped when
+    its input hash matches the one stored after its last successful run and
+    its outputs still exist; force=True runs everything. Nodes downstream of
+    a failed node are not run. Returns {node name: 'ran' | 'skipped' |
+    'failed' | 'blocked'} and the results of the nodes that ran.
+    """
+    by_name = {node.name: node for node in nodes}
+    deps = dependencies(nodes)
+    state = {} if force else read_state()
+    status = {}
+    results = {}
+    lock = threading.Lock()
+
+    def execute(node):
+        digest = input_hash(node)
+        if not force and state.get(node.name) == digest and outputs_exist(node):
+            logger.info(f"[dag] {node.name}: inputs unchanged, skipped.")
+            return 'skipped', None
+        with lock:
+            upstream = dict(results)
+        try:
+            with stage(node.name) as record:
+                result = node.func(upstream)
+        except Exception:
+            # Outputs may be half-written: never skip this node on the old hash
+            forget_state(node)
+            raise
+        if result is False:
+            if record is not None:
+                record.status = 'failed'
+            forget_state(node)
+            return 'failed', None
+        save_state(node, digest)
+        return 'ran', result
+
+    pending = set(by_name)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dag') as pool:
+        while pending or running:
+            # Blocking cascades, so rescan until nothing else can be settled
+            progressed = True
+            while progressed:
+                progressed = False
+                for name in sorted(pending):
+                    if any(status.get(dep) in ('failed', 'blocked') for dep in deps[name]):
+                        status[name] = 'blocked'
+                        logger.warning(f"[dag] {name}: not run, an upstream node failed.")
+                    elif all(dep in status for dep in deps[name]):
+                        running[pool.submit(execute, by_name[name])] = name
+                    else:
+                        continue
+                    pending.discard(name)
+                    progressed = True
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle among nodes {sorted(pending)}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    status[name], result = future.result()
+                except Exception as e:
+                    logger.error(f"[dag] {name} failed: {e}")
+                    status[name], result = 'failed', None
+                if status[name] == 'ran':
+                    with lock:
+                        results[name] = result
+
+    logger.info("[dag] " + ", ".join(f"{name} {status[name]}" for name in by_name))
+    return status, results
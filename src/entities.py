@@ -0,0 +1,208 @@
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import text
+from utils import get_connection, logger
+from costing import COSTING_METHODS, DEFAULT_COSTING_METHOD
+from depreciation import DEPRECIATION_METHODS, DEFAULT_DEPRECIATION_METHOD, DEFAULT_USEFUL_LIFE
+from statements import STATEMENT_COLUMNS
+
+DEFAULT_ENTITY_WORKERS = 4
+# Stage threads inside each entity's run; entities already run side by side
+DEFAULT_STAGE_WORKERS = 2
+
+# Tables each entity schema holds that the consolidated entity_<table> views expose
+ENTITY_TABLES = ('sales', 'purchases', 'payments', 'loans',
+                 'equipment_depreciation_schedule', 'expense_accrual_schedule')
+
+ENTITY_FLUX_SQL = """
+CREATE TABLE IF NOT EXISTS entity_flux_analysis (
+    entity_id VARCHAR NOT NULL,
+    year INT NOT NULL,
+    revenue NUMERIC,
+    net_income NUMERIC,
+    cash NUMERIC,
+    accounts_receivable NUMERIC,
+    accounts_payable NUMERIC,
+    debt_remaining NUMERIC,
+    inventory NUMERIC,
+    gross_ppe NUMERIC,
+    net_ppe NUMERIC,
+    refreshed_at TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (entity_id, year)
+);
+"""
+
+# Every statement line is additive across entities
+CONSOLIDATED_FLUX_SQL = """
+CREATE OR REPLACE VIEW public.consolidated_flux_analysis AS
+SELECT
+    year,
+    COUNT(*) AS entities,
+    {sums}
+FROM public.entity_flux_analysis
+GROUP BY year
+ORDER BY year
+"""
+
+ENTITY_ID_PATTERN = re.compile(r'^[a-z][a-z0-9_]{0,40}$')
+
+# Entity processes and the final consolidation rebuild the same public views
+CONSOLIDATION_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('consolidated_views'))"
+
+
+def entity_schema(entity_id):
+    """The schema holding one entity's tables; every pipeline table is created there."""
+    if not ENTITY_ID_PATTERN.match(entity_id):
+        raise ValueError(f"Invalid entity id {entity_id!r}: use lowercase letters, digits and underscores")
+    return f"entity_{entity_id}"
+
+
+def _run_entity(entity_id, sql_file_path, options):
+    """Runs the whole pipeline for one entity, in its own process and schema.
+
+    DB_SCHEMA points this process's engine (search_path) at the entity's
+    schema, so the unqualified SQL of every stage reads and writes that
+    entity only. The entity's statement is then published to the shared
+    entity_flux_analysis table.
+    """
+    os.environ["DB_SCHEMA"] = entity_schema(entity_id)
+    from main import run_pipeline
+
+    started = time.perf_counter()
+    run = run_pipeline(sql_file_path=sql_file_path, **options)
+    failed = [node for node, status in run.node_status.items() if status in ('failed', 'blocked')]
+    published = 0
+    # A skipped focus_view still holds the current statement; a failed one keeps the last published
+    if run.node_status.get('focus_view') in ('ran', 'skipped'):
+        columns = ', '.join(STATEMENT_COLUMNS)
+        with get_connection() as conn:
+            # Replaced in one transaction: readers see the old or the new statement
+            conn.execute(text("DELETE FROM public.entity_flux_analysis WHERE entity_id = :entity_id"),
+                         {"entity_id": entity_id})
+            published = conn.execute(text(f"""
+                INSERT INTO public.entity_flux_analysis (entity_id, {columns})
+                SELECT :entity_id, {columns} FROM dashboard_flux_analysis
+            """), {"entity_id": entity_id}).rowcount
+            conn.commit()
+    return {
+        "entity_id": entity_id,
+        "run_id": run.run_id,
+        "failed_nodes": failed,
+        "years_published": published,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def lock_consolidated_views(conn):
+    """Serializes rebuilds of the consolidated views until conn's transaction ends."""
+    conn.execute(text(CONSOLIDATION_LOCK_SQL))
+
+
+def create_consolidated_views(conn, entity_ids):
+    """entity_<table> views (entity_id + the entity's rows) over every entity schema, and the consolidated statement."""
+    lock_consolidated_views(conn)
+    for table in ENTITY_TABLES:
+        parts = [
+            f"SELECT '{entity_id}'::VARCHAR AS entity_id, t.* FROM {entity_schema(entity_id)}.{table} t"
+            for entity_id in entity_ids
+            if conn.execute(text("SELECT to_regclass(:name)"),
+                            {"name": f"{entity_schema(entity_id)}.{table}"}).scalar() is not None
+        ]
+        conn.execute(text(f"DROP VIEW IF EXISTS public.entity_{table}"))
+        if parts:
+            conn.execute(text(f"CREATE VIEW public.entity_{table} AS " + "\nUNION ALL\n".join(parts)))
+    sums = ",\n    ".join(f"SUM({column}) AS {column}" for column in STATEMENT_COLUMNS if column != 'year')
+    conn.execute(text(CONSOLIDATED_FLUX_SQL.format(sums=sums)))
+
+
+def rebuild_consolidated_views(conn):
+    """Recreates the consolidated views over the entity schemas that still have tables, in conn's transaction.
+
+    An entity's full load drops its raw tables with CASCADE, which also
+    drops the public entity_<table> views built on them. Called in the same
+    transaction as those drops, so readers never see the views missing;
+    the reloading entity is left out until run_entities() consolidates
+    again at the end.
+    """
+    if conn.execute(text("SELECT to_regclass('public.entity_flux_analysis')")).scalar() is None:
+        return
+    schemas = conn.execute(text(
+        r"SELECT nspname FROM pg_namespace WHERE nspname LIKE 'entity\_%' ORDER BY nspname"
+    )).scalars().all()
+    create_consolidated_views(conn, [schema[len('entity_'):] for schema in schemas])
+
+
+def run_entities(entities, max_workers=DEFAULT_ENTITY_WORKERS, **options):
+    """Runs run_pipeline() for every entity in parallel, one process per entity.
+
+    entities maps entity_id -> setup script. Each entity has its own schema
+    (entity_<id>), DAG state and run record, so a failing entity affects no
+    other: its last published statement stays in entity_flux_analysis.
+    options go to run_pipeline() (costing_method, full_refresh, ...).
+    Returns {entity_id: result or None when the entity's process failed}.
+    """
+    with get_connection() as conn:
+        for entity_id in entities:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {entity_schema(entity_id)}"))
+        conn.execute(text(ENTITY_FLUX_SQL))
+        conn.commit()
+
+    started = time.perf_counter()
+    options.setdefault("workers", DEFAULT_STAGE_WORKERS)
+    results = {}
+    # A fresh process per entity: its engine, instrumentation and caches start clean
+    with ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1) as pool:
+        futures = {
+            pool.submit(_run_entity, entity_id, sql_file_path, options): entity_id
+            for entity_id, sql_file_path in entities.items()
+        }
+        for future in as_completed(futures):
+            entity_id = futures[future]
+            try:
+                results[entity_id] = future.result()
+            except Exception as e:
+                logger.error(f"[entities] {entity_id} failed: {e}")
+                results[entity_id] = None
+                continue
+            result = results[entity_id]
+            if result["failed_nodes"]:
+                logger.warning(f"[entities] {entity_id}: not completed: {', '.join(result['failed_nodes'])}")
+            logger.info(f"[entities] {entity_id}: {result['years_published']} years published "
+                        f"in {result['seconds']:.1f}s.")
+
+    with get_connection() as conn:
+        create_consolidated_views(conn, list(entities))
+        conn.commit()
+    ok = sum(1 for result in results.values() if result and not result["failed_nodes"])
+    logger.info(f"[entities] {ok}/{len(entities)} entities succeeded in {time.perf_counter() - started:.1f}s "
+                f"with {max_workers} workers.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline for several entities in parallel.")
+    parser.add_argument("--entity", action="append", required=True, metavar="ID=SQL_FILE",
+                        help="an entity and its setup script; repeat for each entity")
+    parser.add_argument("--workers", type=int, default=DEFAULT_ENTITY_WORKERS,
+                        help="entities processed at once (default: %(default)s)")
+    parser.add_argument("--stage-workers", type=int, default=DEFAULT_STAGE_WORKERS,
+                        help="concurrent stages within each entity (default: %(default)s)")
+    parser.add_argument("--full-refresh", action="store_true")
+    parser.add_argument("--costing", choices=COSTING_METHODS, default=DEFAULT_COSTING_METHOD)
+    parser.add_argument("--depreciation", choices=DEPRECIATION_METHODS, default=DEFAULT_DEPRECIATION_METHOD)
+    parser.add_argument("--useful-life", type=int, default=DEFAULT_USEFUL_LIFE)
+    args = parser.parse_args()
+
+    entities = {}
+    for spec in args.entity:
+        entity_id, _, path = spec.partition('=')
+        if not path:
+            parser.error(f"--entity expects ID=SQL_FILE, got {spec!r}")
+        entity_schema(entity_id)
+        entities[entity_id] = path
+    run_entities(entities, max_workers=args.workers, workers=args.stage_workers,
+                 full_refresh=args.full_refresh, costing_method=args.costing,
+                 depreciation_method=args.depreciation, useful_life=args.useful_life)
@@ -0,0 +1,153 @@
+import argparse
+import os
+import time
+import pandas as pd
+from sqlalchemy import text
+from utils import get_connection, logger
+from instrumentation import pipeline_run, stage
+from snapshot_cache import column_types
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # CSV exports only
+    pa = pq = None
+
+DEFAULT_CHUNK_ROWS = 100_000
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exports')
+EXPORT_FORMATS = ('csv', 'parquet')
+
+# Export name -> (relation, ORDER BY); bulk tables are streamed in storage order
+EXPORTS = {
+    'sales': ('sales', None),
+    'purchases': ('purchases', None),
+    'payments': ('payments', None),
+    'loans': ('loans', None),
+    'flux_analysis': ('dashboard_flux_analysis', 'year'),
+    # One row per account posting of every source transaction (source_table, source_id)
+    'postings': ('gl_entries', None),
+}
+
+
+def _arrow_type(pg_type):
+    if pg_type.startswith('timestamp'):
+        return pa.timestamp('us', tz='UTC' if 'with time zone' in pg_type else None)
+    if pg_type == 'date':
+        return pa.date32()
+    if pg_type.startswith(('numeric', 'double', 'real')):
+        return pa.float64()
+    if pg_type in ('integer', 'bigint', 'smallint'):
+        return pa.int64()
+    if pg_type == 'boolean':
+        return pa.bool_()
+    return pa.string()
+
+
+def stream_chunks(conn, sql, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yields the rows of a query as DataFrames of at most chunk_rows rows.
+
+    stream_results makes SQLAlchemy run the query on a named (server-side)
+    cursor, so only one chunk is held in memory at a time.
+    """
+    result = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(text(sql))
+    columns = list(result.keys())
+    for rows in result.partitions(chunk_rows):
+        yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+
+class _CsvSink:
+    def __init__(self, path, types):
+        self.handle = open(path, 'w', newline='')
+        self.header = True
+
+    def write(self, chunk):
+        chunk.to_csv(self.handle, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.handle.close()
+
+
+class _ParquetSink:
+    # One row group per chunk; the schema comes from the table, not the first
+    # chunk, so a column that is NULL throughout one chunk keeps its type
+    def __init__(self, path, types):
+        self.schema = pa.schema([(column, _arrow_type(pg_type)) for column, pg_type in types.items()])
+        self.numeric = [column for column, pg_type in types.items() if pa.types.is_floating(_arrow_type(pg_type))]
+        self.writer = pq.ParquetWriter(path, self.schema, compression='snappy')
+
+    def write(self, chunk):
+        for column in self.numeric:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce').astype(float)
+        self.writer.write_table(pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self.writer.close()
+
+
+def export_relation(name, fmt='csv', out_dir=EXPORT_DIR, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Streams one export to out_dir/<name>.<fmt>; memory is bounded by chunk_rows, not the table size.
+
+    Returns {rows, bytes, seconds, rows_per_second}.
+    """
+    if fmt == 'parquet' and pq is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    relation, order_by = EXPORTS[name]
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{name}.{fmt}")
+    # Written under a temporary name so a failed export never replaces a good file
+    tmp_path = f"{path}.partial"
+
+    started = time.perf_counter()
+    rows = 0
+    with stage(f"export.{name}") as record:
+        with get_connection() as conn:
+            types = column_types(conn, relation)
+            sql = f"SELECT {', '.join(types)} FROM {relation}" + (f" ORDER BY {order_by}" if order_by else "")
+            sink = (_ParquetSink if fmt == 'parquet' else _CsvSink)(tmp_path, types)
+            try:
+                for chunk in stream_chunks(conn, sql, chunk_rows):
+                    sink.write(chunk)
+                    rows += len(chunk)
+            finally:
+                sink.close()
+        os.replace(tmp_path, path)
+        if record is not None:
+            record.rows = rows
+
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(path)
+    stats = {
+        "rows": rows, "bytes": size, "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds) if seconds else rows,
+    }
+    logger.info(f"Exported {name}: {rows:,} rows, {size / 1024 ** 2:,.1f} MB to {path} in {seconds:.2f}s "
+                f"({stats['rows_per_second']:,} rows/s, {size / 1024 ** 2 / max(seconds, 1e-9):,.1f} MB/s).")
+    return stats
+
+
+def export_all(names=tuple(EXPORTS), fmt='csv', out_dir=EXPORT_DIR, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Exports each name in turn; a failed export is logged and the rest still run."""
+    results = {}
+    for name in names:
+        try:
+            results[name] = export_relation(name, fmt, out_dir, chunk_rows)
+        except Exception as e:
+            logger.error(f"Export of {name} failed: {e}")
+            results[name] = None
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream raw tables, postings and the flux analysis to files for BI tools.")
+    parser.add_argument("names", nargs='*', help=f"exports to write: {', '.join(EXPORTS)} (default: all)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument("--out-dir", default=EXPORT_DIR)
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="rows fetched and written per chunk (default: %(default)s)")
+    args = parser.parse_args()
+    unknown = sorted(set(args.names) - set(EXPORTS))
+    if unknown:
+        parser.error(f"unknown export(s): {', '.join(unknown)}")
+    with pipeline_run("export"):
+        export_all(args.names or list(EXPORTS), args.format, args.out_dir, args.chunk_rows)
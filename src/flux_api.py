@@ -0,0 +1,133 @@
+import hashlib
+import pandas as pd
+from sqlalchemy import text
+from utils import get_connection, logger
+
+# The flux logic as set-returning functions: readers pass their horizon as
+# bound parameters instead of the year being baked into view DDL. Running
+# balances are chained over every year up to p_end_year and then cut at
+# p_start_year, so a window starting mid-history still opens with the right
+# balance. dashboard_flux_analysis materializes flux_statement() for the
+# default horizon.
+FLUX_FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION flux_account_balances(p_start_year INT, p_end_year INT, p_accounts TEXT[] DEFAULT NULL)
+RETURNS TABLE (year INT, account VARCHAR, annual_movement NUMERIC, running_balance NUMERIC)
+LANGUAGE sql STABLE AS $$
+    SELECT b.year, b.account, b.annual_movement, b.running_balance
+    FROM (
+        SELECT
+            m.year,
+            m.account,
+            m.annual_movement,
+            SUM(m.annual_movement) OVER (PARTITION BY m.account ORDER BY m.year) AS running_balance
+        FROM flux_yearly_movements m
+        WHERE m.year <= p_end_year
+          AND (p_accounts IS NULL OR m.account = ANY(p_accounts))
+    ) b
+    WHERE b.year >= p_start_year
+$$;
+
+CREATE OR REPLACE FUNCTION flux_statement(p_start_year INT, p_end_year INT)
+RETURNS TABLE (
+    year INT, revenue NUMERIC, net_income NUMERIC, cash NUMERIC, accounts_receivable NUMERIC,
+    accounts_payable NUMERIC, debt_remaining NUMERIC, inventory NUMERIC, gross_ppe NUMERIC, net_ppe NUMERIC
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        y.year,
+        -- P&L: Includes Revenue, COGS, Depreciation, and Operating Accounts
+        ROUND(COALESCE(MAX(y.annual_movement) FILTER (WHERE y.account = 'Revenue'), 0)::numeric, 2),
+        ROUND(SUM(y.annual_movement) FILTER (
+            WHERE y.account IN ('Revenue', 'COGS', 'Depr_Exp', 'interest', 'wage', 'tax', 'rent', 'utility')
+        )::numeric, 2),
+
+        -- BALANCE SHEET: Current Assets & Liabilities
+        ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Cash'), 0)::numeric, 2),
+        ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Accounts_Receivable'), 0)::numeric, 2),
+        ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Accounts_Payable'), 0)::numeric, 2),
+
+        -- Long-Term Liabilities
+        ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Loan_Principal'), 0)::numeric, 2),
+
+        -- CURRENT ASSETS
+        ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Inventory'), 0)::numeric, 2),
+
+        -- FIXED ASSETS: Net PPE calculation
+        ROUND(COALESCE(MAX(y.annual_movement) FILTER (WHERE y.account = 'PPE_Snapshot'), 0)::numeric, 2),
+        ROUND(GREATEST(0,
+            COALESCE(MAX(y.annual_movement) FILTER (WHERE y.account = 'PPE_Snapshot'), 0) +
+            COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Depr_Exp'), 0)
+        )::numeric, 2)
+    FROM flux_account_balances(p_start_year, p_end_year) y
+    GROUP BY y.year
+    ORDER BY y.year
+$$;
+"""
+FLUX_FUNCTIONS_VERSION = hashlib.sha256(FLUX_FUNCTIONS_SQL.encode('utf-8')).hexdigest()[:16]
+
+# Statements prepared once per pooled connection: name -> (argument types, query)
+PREPARED_STATEMENTS = {
+    'flux_statement_q': ('int, int', "SELECT * FROM flux_statement($1, $2)"),
+    'flux_account_balances_q': ('int, int, text[]', "SELECT * FROM flux_account_balances($1, $2, $3)"),
+}
+
+
+def ensure_flux_functions(conn):
+    """Creates or updates the flux functions; a no-op (no DDL, no locks) when they are current.
+
+    Returns True when the functions were (re)created.
+    """
+    current = conn.execute(text("""
+        SELECT obj_description(to_regprocedure('flux_statement(integer, integer)'), 'pg_proc')
+    """)).scalar()
+    if current == FLUX_FUNCTIONS_VERSION:
+        return False
+    conn.execute(text(FLUX_FUNCTIONS_SQL))
+    conn.execute(text(f"COMMENT ON FUNCTION flux_statement(integer, integer) IS '{FLUX_FUNCTIONS_VERSION}'"))
+    logger.info(f"Flux functions created (version {FLUX_FUNCTIONS_VERSION}).")
+    return True
+
+
+def _execute_prepared(conn, name, params):
+    """Runs a PREPARED_STATEMENTS entry, preparing it on this DBAPI connection the first time.
+
+    Prepared statements live as long as the server session, so the pooled
+    connection remembers which ones it holds (SQLAlchemy clears .info when
+    the connection is discarded). The server then plans the query once per
+    connection rather than on every dashboard read.
+    """
+    prepared = conn.connection.info.setdefault('prepared_statements', set())
+    if name not in prepared:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM pg_prepared_statements WHERE name = %s", (name,)
+        ).scalar()
+        if not exists:
+            arg_types, query = PREPARED_STATEMENTS[name]
+            conn.exec_driver_sql(f"PREPARE {name} ({arg_types}) AS {query}")
+        prepared.add(name)
+    placeholders = ', '.join(['%s'] * len(params))
+    result = conn.exec_driver_sql(f"EXECUTE {name} ({placeholders})", tuple(params))
+    return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def _query(name, params, conn=None):
+    if conn is not None:
+        return _execute_prepared(conn, name, params)
+    with get_connection() as conn:
+        frame = _execute_prepared(conn, name, params)
+        conn.rollback()
+    return frame
+
+
+def flux_statement(start_year, end_year, conn=None):
+    """The dashboard_flux_analysis columns for any horizon, without DDL in the read path.
+
+    Uses conn if given, otherwise a pooled connection.
+    """
+    return _query('flux_statement_q', (int(start_year), int(end_year)), conn)
+
+
+def account_balances(start_year, end_year, accounts=None, conn=None):
+    """Yearly movement and running balance per account, optionally for a list of accounts only."""
+    return _query('flux_account_balances_q',
+                  (int(start_year), int(end_year), list(accounts) if accounts is not None else None), conn)
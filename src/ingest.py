@@ -0,0 +1,635 @@
+import io
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from utils import logger
+from partitions import RAW_DATE_COLUMNS, ensure_partitioned, ensure_year_partitions
+
+# Raw tables whose row-level INSERTs are rewritten into COPY batches
+COPY_TABLES = ('sales', 'purchases', 'payments', 'loans')
+BULK_BATCH_ROWS = 50000
+
+# Column that orders each raw table for incremental loads (ties broken by id);
+# the same column the tables are partitioned on
+WATERMARK_COLUMNS = RAW_DATE_COLUMNS
+# Rows this many days behind the watermark are re-checked for corrections
+LATE_ARRIVAL_DAYS = 35
+
+INSERT_RE = re.compile(
+    r'^\s*INSERT\s+INTO\s+(?:public\.)?"?(\w+)"?\s*(?:\(([^)]*)\))?\s*VALUES\s*(.*)$',
+    re.IGNORECASE | re.DOTALL,
+)
+CAST_RE = re.compile(r"::\s*[\w ]+(\(\d+(,\s*\d+)?\))?$")
+PLAIN_TOKEN_RE = re.compile(r"^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$|^(true|false)$", re.IGNORECASE)
+LEADING_COMMENT_RE = re.compile(r"^(\s*--[^\n]*\n|\s*/\*.*?\*/)*", re.DOTALL)
+CREATE_TABLE_RE = re.compile(
+    r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:public\.)?"?(\w+)"?',
+    re.IGNORECASE,
+)
+
+
+# Next token of interest for each tokenizer state
+NORMAL_RE = re.compile(r"'|\"|;|--|/\*|\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$")
+BLOCK_COMMENT_RE = re.compile(r"/\*|\*/")
+
+
+def iter_statements(handle, start_index=0):
+    """Yields (index, statement, end_offset) for each statement of a binary file handle.
+
+    The handle is read line by line, so memory is bounded by the largest
+    statement. Semicolons inside string literals, quoted identifiers,
+    dollar-quoted bodies and comments do not end a statement. end_offset is
+    the byte offset just past the terminating ';', which is where a resumed
+    load should seek to.
+    """
+    offset = handle.tell()
+    index = start_index
+    buffer = []
+    has_code = False
+    quote = None          # "'", '"' or a dollar tag such as '$body$'
+    comment_depth = 0
+
+    for raw_line in handle:
+        line = raw_line.decode('utf-8')
+        line_offset = offset
+        offset += len(raw_line)
+        pos = 0
+        start = 0
+        length = len(line)
+
+        while pos < length:
+            if comment_depth:
+                match = BLOCK_COMMENT_RE.search(line, pos)
+                if not match:
+                    break
+                comment_depth += 1 if match.group() == '/*' else -1
+                pos = match.end()
+            elif quote:
+                end = line.find(quote, pos)
+                if end < 0:
+                    break
+                quote = None
+                pos = end + 1
+            else:
+                match = NORMAL_RE.search(line, pos)
+                if not match:
+                    if line[pos:].strip():
+                        has_code = True
+                    break
+                token = match.group()
+                if line[pos:match.start()].strip():
+                    has_code = True
+                pos = match.end()
+                if token == '--':
+                    break
+                elif token == '/*':
+                    comment_depth = 1
+                elif token == ';':
+                    buffer.append(line[start:match.start()])
+                    if has_code:
+                        end_offset = line_offset + len(line[:pos].encode('utf-8'))
+                        yield index, ''.join(buffer).strip(), end_offset
+                        index += 1
+                    buffer = []
+                    has_code = False
+                    start = pos
+                else:
+                    quote = token
+                    has_code = True
+        buffer.append(line[start:])
+
+    if has_code:
+        yield index, ''.join(buffer).strip(), offset
+
+
+def parse_values(values_sql):
+    """Parses the VALUES list of an INSERT into tuples of text (None for NULL)."""
+    rows = []
+    row = None
+    token = []
+    literal = None
+    i = 0
+    n = len(values_sql)
+
+    def close_token():
+        raw = ''.join(token).strip()
+        token.clear()
+        if literal is not None:
+            return literal
+        raw = CAST_RE.sub('', raw).strip()
+        if raw.upper() == 'NULL':
+            return None
+        if not PLAIN_TOKEN_RE.match(raw):
+            # Expressions / function calls can't be expressed in COPY text format
+            raise ValueError(f"Unsupported literal in VALUES: {raw[:30]}")
+        return raw
+
+    while i < n:
+        char = values_sql[i]
+        if row is None:
+            if char == '(':
+                row = []
+                literal = None
+            elif not (char.isspace() or char == ','):
+                raise ValueError(f"Unexpected character in VALUES: {char!r}")
+        elif char == "'" and literal is None:
+            # Typed literals (DATE '2021-01-01') keep only the string part
+            prefix = ''.join(token).strip().upper()
+            if prefix not in ('', 'DATE', 'TIMESTAMP'):
+                raise ValueError(f"Unsupported string prefix in VALUES: {prefix[:30]}")
+            token.clear()
+            chars = []
+            i += 1
+            while i < n:
+                if values_sql[i] == "'":
+                    if i + 1 < n and values_sql[i + 1] == "'":
+                        chars.append("'")
+                        i += 1
+                    else:
+                        break
+                else:
+                    chars.append(values_sql[i])
+                i += 1
+            if i >= n:
+                raise ValueError("Unterminated string literal in VALUES")
+            literal = ''.join(chars)
+        elif char == ',':
+            row.append(close_token())
+            literal = None
+        elif char == ')':
+            row.append(close_token())
+            rows.append(tuple(row))
+            row = None
+        elif literal is None:
+            token.append(char)
+        elif not (char.isspace() or char == ':' or char.isalnum() or char in '_ ()'):
+            # After a quoted literal only a cast ('2021-01-01'::date) may follow
+            raise ValueError(f"Unexpected text after literal in VALUES: {char!r}")
+        i += 1
+
+    if row is not None:
+        raise ValueError("Unterminated row in VALUES")
+    return rows
+
+
+def to_copy_line(values):
+    """Formats one row in PostgreSQL COPY text format."""
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append('\\N')
+        else:
+            fields.append(
+                value.replace('\\', '\\\\').replace('\t', '\\t')
+                     .replace('\n', '\\n').replace('\r', '\\r')
+            )
+    return '\t'.join(fields) + '\n'
+
+
+LOAD_META_SQL = """
+CREATE TABLE IF NOT EXISTS load_checkpoints (
+    script_name VARCHAR PRIMARY KEY,
+    byte_offset BIGINT NOT NULL,
+    statement_index INT NOT NULL,
+    updated_at TIMESTAMP DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS load_quarantine (
+    id SERIAL PRIMARY KEY,
+    script_name VARCHAR,
+    statement_index INT,
+    byte_offset BIGINT,
+    statement TEXT,
+    error TEXT,
+    failed_at TIMESTAMP DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS load_watermarks (
+    table_name VARCHAR PRIMARY KEY,
+    watermark_at TIMESTAMP NOT NULL,
+    watermark_id BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT now()
+);
+"""
+
+
+def ensure_load_tables(raw_conn):
+    """Creates the checkpoint, quarantine and watermark tables used by the loaders."""
+    with raw_conn.cursor() as cur:
+        cur.execute(LOAD_META_SQL)
+    raw_conn.commit()
+
+
+def read_checkpoint(raw_conn, script_name):
+    """Returns (byte_offset, statement_index) of the last committed batch, or (0, 0)."""
+    with raw_conn.cursor() as cur:
+        cur.execute(
+            "SELECT byte_offset, statement_index FROM load_checkpoints WHERE script_name = %s",
+            (script_name,),
+        )
+        row = cur.fetchone()
+    raw_conn.commit()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def clear_checkpoint(raw_conn, script_name):
+    """Forgets the checkpoint so the next load starts from the top of the script."""
+    with raw_conn.cursor() as cur:
+        cur.execute("DELETE FROM load_checkpoints WHERE script_name = %s", (script_name,))
+    raw_conn.commit()
+
+
+class ScriptLoader:
+    """Runs a SQL script on one connection, committing and checkpointing per batch.
+
+    Row-level INSERTs into COPY_TABLES are buffered and sent with COPY FROM
+    STDIN when bulk is on. Every other statement (and every INSERT when bulk
+    is off) runs under its own savepoint, so a failure lands in
+    load_quarantine without aborting the batch. A batch is committed together
+    with its checkpoint once batch_rows rows/statements are pending.
+
+    Raw tables are switched to yearly range partitions as soon as the script
+    creates them, and the partitions a COPY batch needs are created just
+    before it is sent. Rows INSERTed as plain statements land in the DEFAULT
+    partition; when a later COPY batch needs their year, they are moved
+    into the new partition (partitions.split_year_from_default).
+    """
+
+    def __init__(self, raw_conn, script_name, batch_rows=BULK_BATCH_ROWS, bulk=True):
+        self.raw_conn = raw_conn
+        self.script_name = script_name
+        self.batch_rows = batch_rows
+        self.bulk = bulk
+        self.buffers = {}           # (table, columns) -> [StringIO, row count]
+        self.buffered = []          # (index, offset, statement) kept for replay if a COPY fails
+        self.pending = 0
+        self.position = None        # (byte_offset, next statement index) of the open batch
+        self.stats = {}             # table -> (rows, seconds)
+        self.executed = 0
+        self.quarantined = 0
+        self.columns = {}           # table -> all column names
+        self.years = {}             # table -> years in the pending COPY batch
+
+    def run(self, handle, start_index=0):
+        for index, statement, end_offset in iter_statements(handle, start_index):
+            self.position = (end_offset, index + 1)
+            if self.bulk and self._buffer(index, end_offset, statement):
+                continue
+            self._statement(index, end_offset, statement)
+
+        self.commit()
+        self.report()
+        return self.stats
+
+    def _statement(self, index, end_offset, statement):
+        # Pending rows must land before the next statement runs
+        self._flush_copy()
+        if self._execute(index, end_offset, statement):
+            # Quarantined statements are counted by _quarantine() only
+            self.executed += 1
+            match = CREATE_TABLE_RE.match(LEADING_COMMENT_RE.sub('', statement))
+            if match and match.group(1).lower() in RAW_DATE_COLUMNS:
+                with self.raw_conn.cursor() as cur:
+                    ensure_partitioned(cur, match.group(1).lower())
+        self.pending += 1
+        if self.pending >= self.batch_rows:
+            self.commit()
+
+    def _all_columns(self, table):
+        if table not in self.columns:
+            self.columns[table] = table_columns(self.raw_conn, table)
+        return self.columns[table]
+
+    def _keep_rows(self, table, columns, rows):
+        return rows
+
+    def _track_years(self, table, columns, rows):
+        names = columns.split(', ') if columns else self._all_columns(table)
+        if table not in RAW_DATE_COLUMNS or RAW_DATE_COLUMNS[table] not in names:
+            return
+        ts_pos = names.index(RAW_DATE_COLUMNS[table])
+        years = self.years.setdefault(table, set())
+        for row in rows:
+            at = parse_timestamp(row[ts_pos])
+            if at is not None:
+                years.add(at.year)
+
+    def _buffer(self, index, end_offset, statement):
+        match = INSERT_RE.match(LEADING_COMMENT_RE.sub('', statement))
+        if not match or match.group(1).lower() not in COPY_TABLES:
+            return False
+        table, columns, values_sql = match.groups()
+        try:
+            rows = parse_values(values_sql)
+        except ValueError as e:
+            logger.debug(f"Statement {index} not COPY-able ({e}); executing as-is.")
+            return False
+
+        table = table.lower()
+        columns = ', '.join(c.strip() for c in columns.split(',')) if columns else None
+        rows = self._keep_rows(table, columns, rows)
+        if not rows:
+            return True
+        self._track_years(table, columns, rows)
+
+        entry = self.buffers.setdefault((table, columns), [io.StringIO(), 0])
+        for values in rows:
+            entry[0].write(to_copy_line(values))
+        entry[1] += len(rows)
+        self.buffered.append((index, end_offset, statement))
+        self.pending += len(rows)
+        if self.pending >= self.batch_rows:
+            self.commit()
+        return True
+
+    def _copy(self, cur, table, columns, buf):
+        target = f"{table} ({columns})" if columns else table
+        cur.copy_expert(f"COPY {target} FROM STDIN", buf)
+
+    def _copy_failed(self, error):
+        logger.warning(
+            f"COPY batch failed ({str(error)[:200]}); replaying "
+            f"{len(self.buffered)} statements one by one."
+        )
+        for index, end_offset, statement in self.buffered:
+            self._execute(index, end_offset, statement)
+
+    def _flush_copy(self):
+        if not self.buffers:
+            return
+        timings = {}
+        with self.raw_conn.cursor() as cur:
+            cur.execute("SAVEPOINT copy_batch")
+            try:
+                for table, years in self.years.items():
+                    ensure_year_partitions(cur, table, years)
+                for (table, columns), (buf, count) in self.buffers.items():
+                    buf.seek(0)
+                    started = time.perf_counter()
+                    self._copy(cur, table, columns, buf)
+                    rows, seconds = timings.get(table, (0, 0.0))
+                    timings[table] = (rows + count, seconds + time.perf_counter() - started)
+                cur.execute("RELEASE SAVEPOINT copy_batch")
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT copy_batch")
+                timings = {}
+                self._copy_failed(e)
+
+        for table, (rows, seconds) in timings.items():
+            total_rows, total_seconds = self.stats.get(table, (0, 0.0))
+            self.stats[table] = (total_rows + rows, total_seconds + seconds)
+        self.buffers = {}
+        self.buffered = []
+        self.years = {}
+
+    def _execute(self, index, end_offset, statement):
+        with self.raw_conn.cursor() as cur:
+            cur.execute("SAVEPOINT stmt")
+            try:
+                cur.execute(statement)
+                cur.execute("RELEASE SAVEPOINT stmt")
+                return True
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT stmt")
+                self._quarantine(cur, index, end_offset, statement, e)
+                return False
+
+    def _quarantine(self, cur, index, end_offset, statement, error):
+        self.quarantined += 1
+        cur.execute(
+            """
+            INSERT INTO load_quarantine (script_name, statement_index, byte_offset, statement, error)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            (self.script_name, index, end_offset, statement, str(error)),
+        )
+        if "does not exist" not in str(error) and "already exists" not in str(error):
+            logger.warning(f"Quarantined statement {index}: {str(error).splitlines()[0]}")
+
+    def commit(self):
+        """Flushes pending rows and commits them together with the checkpoint."""
+        self._flush_copy()
+        if self.position is not None:
+            byte_offset, statement_index = self.position
+            with self.raw_conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO load_checkpoints (script_name, byte_offset, statement_index, updated_at)
+                    VALUES (%s, %s, %s, now())
+                    ON CONFLICT (script_name) DO UPDATE
+                    SET byte_offset = EXCLUDED.byte_offset,
+                        statement_index = EXCLUDED.statement_index,
+                        updated_at = EXCLUDED.updated_at
+                    """,
+                    (self.script_name, byte_offset, statement_index),
+                )
+        self.raw_conn.commit()
+        self.pending = 0
+
+    def report(self):
+        for table, (rows, seconds) in sorted(self.stats.items()):
+            rate = rows / seconds if seconds else float(rows)
+            logger.info(f"COPY {table}: {rows:,} rows in {seconds:.2f}s ({rate:,.0f} rows/s)")
+        logger.info(
+            f"Script load executed {self.executed} statements, "
+            f"quarantined {self.quarantined}."
+        )
+
+
+def table_columns(raw_conn, table):
+    """Returns the column names of a table in ordinal order."""
+    with raw_conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+            ORDER BY ordinal_position
+            """,
+            (table,),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
+def parse_timestamp(value):
+    """Parses a date/timestamp literal from the script; None when it can't be read."""
+    if value is None:
+        return None
+    try:
+        # Watermarks are stored as naive timestamps
+        return datetime.fromisoformat(value.strip()).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def read_watermarks(raw_conn):
+    """Returns {table: (watermark_at, watermark_id)} for the raw tables loaded so far."""
+    with raw_conn.cursor() as cur:
+        cur.execute("SELECT table_name, watermark_at, watermark_id FROM load_watermarks")
+        marks = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+    raw_conn.commit()
+    return marks
+
+
+def update_watermarks(raw_conn):
+    """Moves each raw table's high-water mark to its latest (timestamp, id)."""
+    with raw_conn.cursor() as cur:
+        for table, column in WATERMARK_COLUMNS.items():
+            cur.execute(
+                f"""
+                INSERT INTO load_watermarks (table_name, watermark_at, watermark_id, updated_at)
+                SELECT %s, {column}, id, now()
+                FROM {table}
+                ORDER BY {column} DESC, id DESC
+                LIMIT 1
+                ON CONFLICT (table_name) DO UPDATE
+                SET watermark_at = EXCLUDED.watermark_at,
+                    watermark_id = EXCLUDED.watermark_id,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                (table,),
+            )
+    raw_conn.commit()
+
+
+class IncrementalLoader(ScriptLoader):
+    """Loads only raw-table rows past each table's watermark and upserts them.
+
+    Rows newer than the stored (timestamp, id) mark are inserted. Rows up to
+    late_days older than the mark are re-sent too: a stored row with the same
+    id that differs is replaced, so late-arriving corrections win (even when
+    the correction moves the row to another year's partition). Older rows and
+    every non-INSERT statement are skipped, which keeps database work
+    proportional to the new data rather than to the whole script. Every
+    raw-table INSERT must list id and the timestamp column (or no columns);
+    otherwise RuntimeError sends extract_load() down the full rebuild.
+    """
+
+    def __init__(self, raw_conn, script_name, watermarks, batch_rows=BULK_BATCH_ROWS,
+                 late_days=LATE_ARRIVAL_DAYS):
+        super().__init__(raw_conn, script_name, batch_rows, bulk=True)
+        self.watermarks = watermarks
+        self.late_days = late_days
+        self.new_rows = {}
+        self.late_rows = {}
+        self.earliest = {}          # table -> earliest timestamp touched
+        self.skipped = 0
+
+    def _statement(self, index, end_offset, statement):
+        # Schema and non-raw statements only run on a full rebuild
+        self.skipped += 1
+
+    def _keep_rows(self, table, columns, rows):
+        names = columns.split(', ') if columns else self._all_columns(table)
+        # Rows are matched to stored ones by id (scripts that leave it to SERIAL,
+        # like synthetic.write_setup_script's, can't be upserted)
+        missing = [c for c in ('id', WATERMARK_COLUMNS[table]) if c not in names]
+        if missing:
+            raise RuntimeError(
+                f"INSERT INTO {table} has no {' or '.join(missing)} column; incremental load needs it."
+            )
+        ts_pos = names.index(WATERMARK_COLUMNS[table])
+        id_pos = names.index('id')
+        mark_at, mark_id = self.watermarks[table]
+        cutoff = mark_at - timedelta(days=self.late_days)
+
+        keep = []
+        for row in rows:
+            at = parse_timestamp(row[ts_pos])
+            if at is None or (at, int(row[id_pos])) > (mark_at, mark_id):
+                self.new_rows[table] = self.new_rows.get(table, 0) + 1
+            elif at >= cutoff:
+                self.late_rows[table] = self.late_rows.get(table, 0) + 1
+            else:
+                continue
+            keep.append(row)
+            if at is not None and (table not in self.earliest or at < self.earliest[table]):
+                self.earliest[table] = at
+        return keep
+
+    def _copy(self, cur, table, columns, buf):
+        column_list = columns or ', '.join(self._all_columns(table))
+        staged = ', '.join(f"s.{c}" for c in column_list.split(', '))
+        current = ', '.join(f"t.{c}" for c in column_list.split(', '))
+
+        cur.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS stage_{table} "
+            f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        cur.copy_expert(f"COPY stage_{table} ({column_list}) FROM STDIN", buf)
+        # A unique index on id alone isn't allowed on a partitioned table, so the
+        # upsert is: drop stored versions that changed, then insert what's missing
+        cur.execute(
+            f"""
+            DELETE FROM {table} t
+            USING stage_{table} s
+            WHERE t.id = s.id AND ({current}) IS DISTINCT FROM ({staged})
+            """
+        )
+        cur.execute(
+            f"""
+            INSERT INTO {table} ({column_list})
+            SELECT {column_list} FROM stage_{table} s
+            WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.id = s.id)
+            """
+        )
+        cur.execute(f"TRUNCATE stage_{table}")
+
+    def _copy_failed(self, error):
+        # Replaying plain INSERTs would bypass the upsert, so quarantine the batch instead
+        with self.raw_conn.cursor() as cur:
+            for index, end_offset, statement in self.buffered:
+                self._quarantine(cur, index, end_offset, statement, error)
+
+    def report(self):
+        super().report()
+        for table in WATERMARK_COLUMNS:
+            logger.info(
+                f"Incremental {table}: {self.new_rows.get(table, 0):,} new rows, "
+                f"{self.late_rows.get(table, 0):,} late-window rows upserted."
+            )
+        if self.skipped:
+            logger.info(f"Incremental load skipped {self.skipped} non-row statements.")
+
+
+def load_script(sql_file_path, raw_conn, batch_rows=BULK_BATCH_ROWS, bulk=True, resume=False):
+    """Streams a SQL script into the database, optionally resuming from its checkpoint."""
+    script_name = os.path.basename(sql_file_path)
+    ensure_load_tables(raw_conn)
+    if resume:
+        byte_offset, statement_index = read_checkpoint(raw_conn, script_name)
+        if byte_offset:
+            logger.info(f"Resuming {script_name} at statement {statement_index} (byte {byte_offset:,}).")
+    else:
+        clear_checkpoint(raw_conn, script_name)
+        byte_offset, statement_index = 0, 0
+
+    loader = ScriptLoader(raw_conn, script_name, batch_rows, bulk)
+    with open(sql_file_path, 'rb') as file:
+        file.seek(byte_offset)
+        return loader.run(file, statement_index)
+
+
+def load_incremental(sql_file_path, raw_conn, batch_rows=BULK_BATCH_ROWS, late_days=LATE_ARRIVAL_DAYS):
+    """Streams the script and upserts only rows past the stored watermarks.
+
+    Returns the loader so callers can see which tables and dates were touched.
+    """
+    script_name = os.path.basename(sql_file_path) + '#incremental'
+    ensure_load_tables(raw_conn)
+    watermarks = read_watermarks(raw_conn)
+    missing = [table for table in WATERMARK_COLUMNS if table not in watermarks]
+    if missing:
+        raise RuntimeError(f"No watermark for {', '.join(missing)}; run a full rebuild first.")
+
+    # Tables from before partitioning are converted once; the id index serves the upsert
+    with raw_conn.cursor() as cur:
+        for table in WATERMARK_COLUMNS:
+            ensure_partitioned(cur, table)
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_id_idx ON {table} (id)")
+    raw_conn.commit()
+
+    clear_checkpoint(raw_conn, script_name)
+    loader = IncrementalLoader(raw_conn, script_name, watermarks, batch_rows, late_days)
+    with open(sql_file_path, 'rb') as file:
+        loader.run(file)
+    update_watermarks(raw_conn)
+    return loader
@@ -0,0 +1,324 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event, text
+from utils import get_connection, get_engine, logger
+
+try:
+    from psycopg2.extensions import cursor as _pg_cursor
+except ImportError:  # non-PostgreSQL backends: stage timings only
+    _pg_cursor = None
+
+RUNS_DIR = os.getenv(
+    "PIPELINE_RUNS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'runs'),
+)
+# Distinct statement shapes kept per stage; the rest are pooled under '<other>'
+MAX_STATEMENTS_PER_STAGE = 500
+TOP_STATEMENTS = 20
+
+PIPELINE_RUNS_SQL = """
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    run_id VARCHAR NOT NULL,
+    seq INT NOT NULL,
+    run_name VARCHAR NOT NULL,
+    stage VARCHAR NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    seconds NUMERIC,
+    rows BIGINT,
+    statements INT,
+    checkouts INT,
+    connections_created INT,
+    status VARCHAR,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS pipeline_runs_stage_idx ON pipeline_runs (stage, started_at);
+"""
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SPACE_RE = re.compile(r"\s+")
+
+_current = None
+_instrumented_engines = set()
+# Stages may run concurrently on worker threads (see dag.py)
+_lock = threading.Lock()
+
+
+def statement_key(sql):
+    """Groups statements that differ only in their literals."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    return SPACE_RE.sub(' ', LITERAL_RE.sub('?', sql)).strip()[:200]
+
+
+class StageRecord:
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.started_at = datetime.now()
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = {}
+        self.status = 'running'
+        self.error = None
+        # Counted by the pool listeners for the thread that opened this stage,
+        # so concurrent stages don't see each other's checkouts
+        self.checkouts = 0
+        self.connections_created = 0
+
+    def record_statement(self, sql, seconds, rows, connection=None):
+        key = statement_key(sql)
+        with _lock:
+            if key not in self.statements and len(self.statements) >= MAX_STATEMENTS_PER_STAGE:
+                key = '<other>'
+            calls, total, total_rows, connections = self.statements.get(key, (0, 0.0, 0, set()))
+            if connection is not None:
+                connections.add(connection)
+            self.statements[key] = (calls + 1, total + seconds, total_rows + max(rows, 0), connections)
+            self.rows += max(rows, 0)
+
+    def to_dict(self):
+        top = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:TOP_STATEMENTS]
+        return {
+            "stage": self.name,
+            "started_at": self.started_at.isoformat(),
+            "seconds": round(self.seconds, 4),
+            "rows": self.rows,
+            "statements": sum(calls for calls, _, _, _ in self.statements.values()),
+            "checkouts": self.checkouts,
+            "connections_created": self.connections_created,
+            "status": self.status,
+            "error": self.error,
+            "top_statements": [
+                {"sql": key, "calls": calls, "seconds": round(seconds, 4), "rows": rows,
+                 "connections": len(connections)}
+                for key, (calls, seconds, rows, connections) in top
+            ],
+        }
+
+
+class RunRecord:
+    def __init__(self, name, explain):
+        self.run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.explain = explain
+        self.stages = []
+        self.stacks = {}
+        self.root = None
+        self.plans = {}
+        # DAG outcome per node ('ran', 'skipped', 'failed', 'blocked'), when the run used one
+        self.node_status = {}
+
+    @property
+    def stack(self):
+        """Open stages of the calling thread; worker threads start under the run's root stage."""
+        thread_id = threading.get_ident()
+        if thread_id not in self.stacks:
+            self.stacks[thread_id] = [self.root] if self.root else []
+        return self.stacks[thread_id]
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "run_name": self.name,
+            "nodes": self.node_status,
+            "stages": [stage.to_dict() for stage in self.stages],
+            "plans": self.plans,
+        }
+
+
+if _pg_cursor is not None:
+    class TimedCursor(_pg_cursor):
+        """psycopg2 cursor that reports each statement to the active stage."""
+
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                _record(query, time.perf_counter() - started, self.rowcount, id(self.connection))
+
+        def executemany(self, query, vars_list):
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                _record(query, time.perf_counter() - started, self.rowcount, id(self.connection))
+
+        def copy_expert(self, sql, file, size=8192):
+            started = time.perf_counter()
+            try:
+                return super().copy_expert(sql, file, size)
+            finally:
+                _record(sql, time.perf_counter() - started, self.rowcount, id(self.connection))
+else:
+    TimedCursor = None
+
+
+def _record(sql, seconds, rows, connection=None):
+    if _current is not None and _current.stack:
+        _current.stack[-1].record_statement(sql, seconds, rows, connection)
+
+
+def _count(counter):
+    """Adds one to a pool counter of the calling thread's innermost open stage."""
+    if _current is not None and _current.stack:
+        record = _current.stack[-1]
+        with _lock:
+            setattr(record, counter, getattr(record, counter) + 1)
+
+
+def _instrument_engine(engine):
+    """Attributes checkouts and new connections to the stage that made them, and hands
+    out timed cursors on connections checked out while a run is active."""
+    if id(engine) in _instrumented_engines:
+        return
+    _instrumented_engines.add(id(engine))
+
+    # A new connection is made in the thread that checks it out
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, conn_record):
+        _count("connections_created")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_conn, conn_record, conn_proxy):
+        _count("checkouts")
+        if TimedCursor is not None and _current is not None and hasattr(dbapi_conn, "cursor_factory"):
+            dbapi_conn.cursor_factory = TimedCursor
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_conn, conn_record):
+        if TimedCursor is not None and hasattr(dbapi_conn, "cursor_factory"):
+            dbapi_conn.cursor_factory = None
+
+
+@contextmanager
+def stage(name):
+    """Times a pipeline stage: wall time, rows and statements, pool checkouts.
+
+    Outside pipeline_run() this does nothing. Stages nest; a parent's rows
+    and pool counts include its children's.
+    """
+    if _current is None:
+        yield None
+        return
+
+    stack = _current.stack
+    parent = stack[-1] if stack else None
+    record = StageRecord(f"{parent.name}.{name}" if parent else name, parent)
+    with _lock:
+        _current.stages.append(record)
+        if _current.root is None:
+            _current.root = record
+    stack.append(record)
+    started = time.perf_counter()
+    try:
+        yield record
+        record.status = 'ok'
+    except Exception as e:
+        record.status = 'failed'
+        record.error = str(e)[:500]
+        raise
+    finally:
+        record.seconds = time.perf_counter() - started
+        stack.pop()
+        if parent is not None:
+            with _lock:
+                parent.rows += record.rows
+                parent.checkouts += record.checkouts
+                parent.connections_created += record.connections_created
+        logger.info(f"[stage] {record.name}: {record.seconds:.2f}s, {record.rows:,} rows, "
+                    f"{record.checkouts} checkouts")
+
+
+def explain_enabled():
+    """True inside a pipeline_run() that asked for query plans."""
+    return _current is not None and _current.explain
+
+
+def capture_plan(conn, label, sql, params=None):
+    """Stores EXPLAIN (ANALYZE, BUFFERS) of a read query in the run record when plans are requested.
+
+    ANALYZE executes the query, so only pass SELECTs.
+    """
+    if not explain_enabled():
+        return None
+    try:
+        # Savepoint: a failing EXPLAIN must not abort the caller's transaction
+        with conn.begin_nested():
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params or {}).scalar()
+    except Exception as e:
+        logger.warning(f"Could not capture plan for {label}: {e}")
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    with _lock:
+        _current.plans[label] = plan
+    logger.info(f"[plan] {label}: {plan[0].get('Execution Time', 0):.1f} ms")
+    return plan
+
+
+def _write_run(run):
+    record = run.to_dict()
+    try:
+        os.makedirs(RUNS_DIR, exist_ok=True)
+        path = os.path.join(RUNS_DIR, f"{run.run_id}.json")
+        with open(path, 'w') as f:
+            json.dump(record, f, indent=2, default=str)
+        logger.info(f"Run record written to {path}")
+    except OSError as e:
+        logger.warning(f"Could not write run record: {e}")
+
+    try:
+        with get_connection() as conn:
+            # One statement at a time: SQLite runs no multi-statement strings
+            for statement in PIPELINE_RUNS_SQL.split(';'):
+                if statement.strip():
+                    conn.execute(text(statement))
+            conn.execute(
+                text("""
+                    INSERT INTO pipeline_runs (run_id, seq, run_name, stage, started_at, seconds,
+                                               rows, statements, checkouts, connections_created, status)
+                    VALUES (:run_id, :seq, :run_name, :stage, :started_at, :seconds,
+                            :rows, :statements, :checkouts, :connections_created, :status)
+                """),
+                [
+                    {"run_id": run.run_id, "seq": seq, "run_name": run.name, **{
+                        key: stage[key] for key in (
+                            "stage", "started_at", "seconds", "rows", "statements",
+                            "checkouts", "connections_created", "status",
+                        )
+                    }}
+                    for seq, stage in enumerate(record["stages"])
+                ],
+            )
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Could not store run metrics in pipeline_runs: {e}")
+
+
+@contextmanager
+def pipeline_run(name='run_pipeline', explain=None):
+    """Collects stage metrics for one run and writes them out when it ends.
+
+    The record goes to RUNS_DIR/<run_id>.json and one row per stage to the
+    pipeline_runs table. explain=True (or PIPELINE_EXPLAIN=1) also captures
+    the plans requested with capture_plan().
+    """
+    global _current
+    if explain is None:
+        explain = os.getenv("PIPELINE_EXPLAIN", "").lower() in ("1", "true", "yes")
+    run = RunRecord(name, explain)
+    _instrument_engine(get_engine())
+    _current = run
+    try:
+        with stage(name):
+            yield run
+    finally:
+        _current = None
+        _write_run(run)
@@ -0,0 +1,162 @@
+from utils import logger
+from costing import DEFAULT_COSTING_METHOD, SALES_COST_JOIN, sales_cost_source
+from sqlalchemy import text
+
+GL_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS gl_entries (
+    entry_date DATE NOT NULL,
+    year INT NOT NULL,
+    month INT NOT NULL,
+    account VARCHAR NOT NULL,
+    amount NUMERIC NOT NULL,
+    source_table VARCHAR NOT NULL,
+    source_id INT
+);
+CREATE INDEX IF NOT EXISTS gl_entries_account_year_idx ON gl_entries (account, year);
+CREATE INDEX IF NOT EXISTS gl_entries_year_idx ON gl_entries (year);
+"""
+
+# One statement per source table: each raw row is read once and unpivoted into
+# its postings with a LATERAL VALUES list. A posting whose date or amount is NULL
+# does not apply to that row (e.g. AR for a cash sale) and is dropped.
+# {source_filter} restricts the scan on incremental refreshes; postings land at
+# most one month after the source date (the credit lag), hence the December
+# lower bound of the previous year. Sales are costed through product_cost
+# (see costing.py), selected by {sales_source} and {cost_join}.
+GL_POSTINGS_SQL = {
+    'sales': """
+        SELECT s.id, e.account, e.entry_date, e.amount
+        FROM {sales_source} s
+        -- product_cost ranges do not overlap: exactly one unit cost per sale
+        LEFT JOIN product_cost pc ON {cost_join}
+        CROSS JOIN LATERAL (VALUES
+            ('Revenue', s.sale_at::DATE, s.quantity * s.price),
+            ('Cash', (CASE WHEN s.payment_method = 'cash' THEN s.sale_at ELSE s.sale_at + INTERVAL '1 month' END)::DATE,
+                s.quantity * s.price),
+            ('COGS', s.sale_at::DATE, -(s.quantity * pc.unit_cost)),
+            ('Inventory', s.sale_at::DATE, -(s.quantity * pc.unit_cost)),
+            -- Year-end unpaid sales
+            ('Accounts_Receivable',
+                (CASE WHEN s.payment_method <> 'cash' AND DATE_PART('month', s.payment_at) = 12 THEN s.payment_at END)::DATE,
+                s.price * s.quantity)
+        ) AS e(account, entry_date, amount)
+        {source_filter}
+    """,
+    'purchases': """
+        SELECT p.id, e.account, e.entry_date, e.amount
+        FROM purchases p
+        CROSS JOIN LATERAL (VALUES
+            ('Cash', (CASE WHEN p.payment_method = 'cash' THEN p.purchase_at ELSE p.purchase_at + INTERVAL '1 month' END)::DATE,
+                -(p.quantity * p.amount)),
+            ('Inventory', p.purchase_at::DATE, p.amount * p.quantity)
+        ) AS e(account, entry_date, amount)
+        {source_filter}
+    """,
+    'loans': """
+        SELECT l.id, e.account, e.entry_date, e.amount
+        FROM loans l
+        CROSS JOIN LATERAL (VALUES
+            ('Cash', l.loan_at::DATE, l.value),
+            ('Loan_Principal', l.loan_at::DATE, l.value)
+        ) AS e(account, entry_date, amount)
+        {source_filter}
+    """,
+    'payments': """
+        SELECT p.id, e.account, e.entry_date, e.amount
+        FROM payments p
+        CROSS JOIN LATERAL (VALUES
+            -- Operating cash out (equipment and loan principal excluded)
+            ('Cash', (CASE WHEN p.payment_type IN ('interest', 'wage', 'utility', 'tax', 'rent') THEN p.payment_date END)::DATE,
+                -p.amount),
+            ('Loan_Principal', (CASE WHEN p.payment_type = 'loan' THEN p.payment_date END)::DATE, -p.amount),
+            -- Rent hits the P&L directly
+            ('rent', (CASE WHEN p.payment_type = 'rent' THEN p.payment_date END)::DATE, -p.amount)
+        ) AS e(account, entry_date, amount)
+        {source_filter}
+    """,
+    'expense_accrual_schedule': """
+        SELECT a.id, e.account, e.entry_date, e.amount
+        FROM expense_accrual_schedule a
+        CROSS JOIN LATERAL (VALUES
+            (a.account, a.accrual_date, -a.amount),
+            ('Accounts_Payable', a.accrual_date, a.amount),
+            ('Accounts_Payable', a.cash_payment_date, -a.amount)
+        ) AS e(account, entry_date, amount)
+        {source_filter}
+    """,
+    'equipment_depreciation_schedule': """
+        SELECT d.id, e.account, e.entry_date, e.amount
+        FROM equipment_depreciation_schedule d
+        CROSS JOIN LATERAL (VALUES
+            ('Depr_Exp', MAKE_DATE(d.year, 12, 31), -d.annual_depreciation_expense),
+            ('PPE_Snapshot', MAKE_DATE(d.year, 12, 31), d.gross_val)
+        ) AS e(account, entry_date, amount)
+        {source_filter}
+    """,
+}
+
+# Source-side predicates for a refresh of years >= :since_year. They are plain
+# lower bounds on the partition columns so the planner prunes older partitions;
+# AR is posted on payment_at, so sales keep a year of slack for credit terms.
+GL_SOURCE_FILTERS = {
+    'sales': "s.sale_at >= CAST(:lower_bound AS DATE) - INTERVAL '1 year' "
+             "AND (s.sale_at >= :lower_bound OR s.payment_at >= :lower_bound)",
+    'purchases': "p.purchase_at >= :lower_bound",
+    'loans': "l.loan_at >= :lower_bound",
+    'payments': "p.payment_date >= :lower_bound",
+    'expense_accrual_schedule': "a.accrual_date >= :lower_bound OR a.cash_payment_date >= :lower_bound",
+    'equipment_depreciation_schedule': "d.year >= :since_year",
+}
+
+
+def build_gl_entries(conn, since_year=None, costing_method=DEFAULT_COSTING_METHOD):
+    """Rebuilds gl_entries with one pass per source table.
+
+    since_year=None rebuilds the whole ledger; otherwise only entries dated in
+    years >= since_year are replaced. COGS and inventory relief use
+    product_cost, which must already be refreshed for costing_method.
+    Returns {source_table: rows written}.
+    """
+    conn.execute(text(GL_TABLE_SQL))
+    if since_year is not None and not conn.execute(text("SELECT EXISTS (SELECT 1 FROM gl_entries);")).scalar():
+        since_year = None
+
+    params = {}
+    if since_year is None:
+        conn.execute(text("TRUNCATE TABLE gl_entries;"))
+    else:
+        conn.execute(text("DELETE FROM gl_entries WHERE year >= :since_year;"), {"since_year": since_year})
+        params = {"since_year": since_year, "lower_bound": f"{since_year - 1}-12-01"}
+
+    counts = {}
+    for source_table, postings_sql in GL_POSTINGS_SQL.items():
+        source_filter = "WHERE e.entry_date IS NOT NULL AND e.amount IS NOT NULL"
+        if since_year is not None:
+            source_filter += (
+                f" AND ({GL_SOURCE_FILTERS[source_table]})"
+                " AND e.entry_date >= MAKE_DATE(:since_year, 1, 1)"
+            )
+        sql = f"""
+            INSERT INTO gl_entries (entry_date, year, month, account, amount, source_table, source_id)
+            SELECT
+                entry_date,
+                EXTRACT(YEAR FROM entry_date)::INT,
+                EXTRACT(MONTH FROM entry_date)::INT,
+                account,
+                amount,
+                '{source_table}',
+                id
+            FROM ({postings_sql.format(
+                source_filter=source_filter,
+                sales_source=sales_cost_source(costing_method),
+                cost_join=SALES_COST_JOIN,
+            )}) postings
+        """
+        counts[source_table] = conn.execute(text(sql), params).rowcount
+
+    logger.info(
+        "General ledger rebuilt "
+        f"({'all years' if since_year is None else f'years >= {since_year}'}): "
+        + ", ".join(f"{table} {rows:,}" for table, rows in counts.items())
+    )
+    return counts
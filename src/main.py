@@ -1,20 +1,126 @@
-from pipeline import extract_load, create_custom_financial_tables, create_focus_view
-from utils import logger
+import argparse
+import os
+import costing
+import depreciation
+import ledger
+import rollup
+from pipeline import (
+    extract_load, create_depreciation_schedule, create_accrual_schedule, create_focus_view,
+    affected_since_year, DEFAULT_SQL_FILE, ACCRUAL_SQL,
+)
+from costing import COSTING_METHODS, DEFAULT_COSTING_METHOD
+from depreciation import DEPRECIATION_METHODS, DEFAULT_DEPRECIATION_METHOD, DEFAULT_USEFUL_LIFE
+from dag import Node, run_dag, source_fingerprint, DEFAULT_WORKERS
+from instrumentation import pipeline_run
+from snapshot_cache import stamp_data_version
+from utils import get_backend, logger, log_pool_metrics
 
+RAW_TABLES = ('sales', 'purchases', 'payments', 'loans')
+SCHEDULE_NODES = ('depreciation_schedule', 'accrual_schedule')
 
 
-def run_pipeline():
-    # 1. Build the raw tables from your SQL script (Sales, Purchases, Payments)
-    extract_load()
-    logger.info("--- Raw Tables Created Successfully ---")
+def focus_since_year(results):
+    """First year the focus view must recompute, given the results of the nodes that ran this run.
 
-    # 2. Create the schedules needed for Net Income (Depreciation & Accruals)
-    create_custom_financial_tables()
-    logger.info("--- Custom Financial Tables Created ---")
+    A rebuilt schedule (new --depreciation, --useful-life or ACCRUAL_SQL)
+    can change postings of any year, so it always means all years, as does
+    a skipped or full load. Otherwise only the years the incremental load
+    touched are recomputed.
+    """
+    if any(name in results for name in SCHEDULE_NODES):
+        return None
+    return affected_since_year(results.get('load'))
 
-    # 3. Build the final view for 2021-2022 Flux Analysis
-    create_focus_view()
-    logger.info("--- Flux Analysis View Created Successfully ---")
+
+def pipeline_nodes(resume=False, full_refresh=False, costing_method=DEFAULT_COSTING_METHOD,
+                   depreciation_method=DEFAULT_DEPRECIATION_METHOD, useful_life=DEFAULT_USEFUL_LIFE,
+                   sql_file_path=None):
+    """The pipeline as DAG nodes; dependencies follow from the tables each node reads and writes."""
+    sql_file_path = sql_file_path or DEFAULT_SQL_FILE
+
+    def load(results):
+        if not os.path.exists(sql_file_path):
+            logger.error(f"SQL file not found at path: {sql_file_path}")
+            return False
+        # Loads incrementally past the stored watermarks unless a full rebuild is asked for;
+        # resume=True continues an interrupted full load from its last checkpoint
+        return extract_load(resume=resume, incremental=not (full_refresh or resume),
+                            sql_file_path=sql_file_path)
+
+    def focus_view(results):
+        return create_focus_view(since_year=focus_since_year(results), costing_method=costing_method)
+
+    script = os.stat(sql_file_path) if os.path.exists(sql_file_path) else None
+    return [
+        # 1. Build the raw tables from your SQL script (Sales, Purchases, Payments)
+        Node('load', load, outputs=RAW_TABLES,
+             fingerprint=f"{os.path.abspath(sql_file_path)}:{script and script.st_size}:{script and script.st_mtime_ns}"),
+        # 2. The schedules needed for Net Income only read payments, so they run side by side
+        Node('depreciation_schedule',
+             lambda results: create_depreciation_schedule(depreciation_method, useful_life),
+             inputs=('payments',), outputs=('equipment_depreciation_schedule',),
+             fingerprint=f"{depreciation_method}:{useful_life}\n" + source_fingerprint(depreciation)),
+        Node('accrual_schedule', lambda results: create_accrual_schedule(),
+             inputs=('payments',), outputs=('expense_accrual_schedule',),
+             fingerprint=ACCRUAL_SQL),
+        # 3. The final view for the Flux Analysis; COGS and inventory are valued
+        #    with costing_method through product_cost
+        Node('focus_view', focus_view,
+             inputs=RAW_TABLES + ('equipment_depreciation_schedule', 'expense_accrual_schedule'),
+             outputs=('product_cost', 'gl_entries', 'flux_yearly_movements', 'flux_rollup', 'dashboard_flux_analysis'),
+             fingerprint=f"{costing_method}\n" + source_fingerprint(create_focus_view, ledger, costing, rollup)),
+    ]
+
+
+def run_pipeline(resume=False, full_refresh=False, costing_method=DEFAULT_COSTING_METHOD,
+                 depreciation_method=DEFAULT_DEPRECIATION_METHOD, useful_life=DEFAULT_USEFUL_LIFE,
+                 explain=False, sql_file_path=None, workers=DEFAULT_WORKERS, force=False):
+    # Every stage is timed (wall time, rows, connections, per-statement totals) into
+    # runs/<run_id>.json and the pipeline_runs table; explain=True adds query plans
+    with pipeline_run("run_pipeline", explain=explain) as run:
+        # Independent stages run concurrently; a stage whose input tables and SQL are
+        # unchanged since its last successful run is skipped (full_refresh/resume/force run all)
+        nodes = pipeline_nodes(resume, full_refresh, costing_method, depreciation_method,
+                               useful_life, sql_file_path)
+        if get_backend() == 'sqlite' and workers > 1:
+            # SQLite has a single writer: concurrent stages would only wait on its lock
+            logger.info("SQLite backend: running stages one at a time.")
+            workers = 1
+        run.node_status, _ = run_dag(nodes, max_workers=workers, force=force or full_refresh or resume)
+
+        # Reports read a local columnar snapshot keyed by this version, so they
+        # only go back to the database after a run changed something
+        try:
+            stamp_data_version()
+        except Exception as e:
+            logger.warning(f"Could not stamp the snapshot cache version: {e}")
+
+        # Connection churn for the whole run (should be a handful, not one per statement)
+        log_pool_metrics()
+    return run
 
 if __name__ == "__main__":
-    run_pipeline()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the income statement ELT pipeline.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted load from its last checkpoint")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="drop and reload every raw table instead of loading incrementally")
+    parser.add_argument("--costing", choices=COSTING_METHODS, default=DEFAULT_COSTING_METHOD,
+                        help="unit cost used for COGS and inventory (default: %(default)s)")
+    parser.add_argument("--depreciation", choices=DEPRECIATION_METHODS, default=DEFAULT_DEPRECIATION_METHOD,
+                        help="depreciation method for equipment (default: %(default)s)")
+    parser.add_argument("--useful-life", type=int, default=DEFAULT_USEFUL_LIFE,
+                        help="equipment useful life in years (default: %(default)s)")
+    parser.add_argument("--explain", action="store_true",
+                        help="capture EXPLAIN (ANALYZE, BUFFERS) plans in the run record")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="stages run concurrently (default: %(default)s)")
+    parser.add_argument("--force", action="store_true",
+                        help="run every stage even when its inputs are unchanged")
+    parser.add_argument("--sql-file", default=None,
+                        help="setup script to load (default: data/setup-postgresql.sql)")
+    args = parser.parse_args()
+    run_pipeline(resume=args.resume, full_refresh=args.full_refresh, costing_method=args.costing,
+                 depreciation_method=args.depreciation, useful_life=args.useful_life,
+                 explain=args.explain, sql_file_path=args.sql_file, workers=args.workers,
+                 force=args.force)
\ No newline at end of file
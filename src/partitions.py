@@ -0,0 +1,138 @@
+from utils import logger
+
+# Raw tables are range-partitioned by year on their transaction date
+RAW_DATE_COLUMNS = {
+    'sales': 'sale_at',
+    'purchases': 'purchase_at',
+    'payments': 'payment_date',
+    'loans': 'loan_at',
+}
+
+
+def year_bounds(year):
+    """Half-open [start, end) date range for a year, for predicates the planner can prune on."""
+    return f"{year}-01-01", f"{year + 1}-01-01"
+
+
+def is_partitioned(cur, table):
+    cur.execute(
+        """
+        SELECT c.relkind = 'p'
+        FROM pg_class c
+        WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+        """,
+        (table,),
+    )
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def existing_partition_years(cur, table):
+    cur.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = %s AND parent.relnamespace = current_schema()::regnamespace
+        """,
+        (table,),
+    )
+    prefix = f"{table}_y"
+    return {int(name[len(prefix):]) for (name,) in cur.fetchall() if name.startswith(prefix)}
+
+
+def default_has_rows(cur, table, year):
+    """True when the DEFAULT partition holds rows of the year, which blocks creating its partition."""
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{table}_default",))
+    if not cur.fetchone()[0]:
+        return False
+    column = RAW_DATE_COLUMNS[table]
+    start, end = year_bounds(year)
+    cur.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE {column} >= %s AND {column} < %s)",
+        (start, end),
+    )
+    return cur.fetchone()[0]
+
+
+def split_year_from_default(cur, table, year):
+    """Creates a year's partition when DEFAULT already holds some of its rows.
+
+    Rows INSERTed as plain statements before the partition existed landed in
+    DEFAULT, and PostgreSQL refuses a new partition overlapping rows there.
+    DEFAULT is detached, the partition created, the year's rows moved into
+    it, and DEFAULT re-attached, all in the caller's transaction.
+    """
+    column = RAW_DATE_COLUMNS[table]
+    start, end = year_bounds(year)
+    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {table}_default")
+    cur.execute(
+        f"CREATE TABLE {table}_y{year} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE {column} >= %s AND {column} < %s RETURNING *
+        )
+        INSERT INTO {table}_y{year} SELECT * FROM moved
+        """,
+        (start, end),
+    )
+    moved = cur.rowcount
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {table}_default DEFAULT")
+    logger.info(f"Moved {moved} {table} rows for {year} out of the DEFAULT partition.")
+
+
+def ensure_year_partitions(cur, table, years):
+    """Creates the yearly partitions a batch of rows is about to land in."""
+    missing = set(years) - existing_partition_years(cur, table)
+    for year in sorted(missing):
+        if default_has_rows(cur, table, year):
+            split_year_from_default(cur, table, year)
+            continue
+        start, end = year_bounds(year)
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {table}_y{year} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    if missing:
+        logger.info(f"Created {table} partitions for {', '.join(str(y) for y in sorted(missing))}.")
+
+
+def ensure_partitioned(cur, table):
+    """Turns a plain raw table into a yearly range-partitioned one, keeping its rows.
+
+    Called right after the setup script creates the table, so normally only
+    the empty shell is swapped. Rows whose date is NULL go to the DEFAULT
+    partition. Serial sequences are re-owned by the new table so they survive
+    the old one being dropped.
+    """
+    if is_partitioned(cur, table):
+        return
+    column = RAW_DATE_COLUMNS[table]
+    old = f"{table}_unpartitioned"
+
+    cur.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cur.execute(
+        f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({column})"
+    )
+    cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    cur.execute(
+        """
+        SELECT pg_get_serial_sequence(%s, column_name), column_name
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        """,
+        (old, old),
+    )
+    for sequence, column_name in cur.fetchall():
+        if sequence:
+            cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{column_name}")
+
+    cur.execute(f"SELECT DISTINCT EXTRACT(YEAR FROM {column})::INT FROM {old} WHERE {column} IS NOT NULL")
+    ensure_year_partitions(cur, table, [row[0] for row in cur.fetchall()])
+    cur.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    cur.execute(f"DROP TABLE {old}")
+    logger.info(f"Converted {table} to a partitioned table on {column}.")
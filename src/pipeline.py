@@ -1,13 +1,34 @@
-from utils import get_engine, logger
+from utils import get_backend, get_connection, get_raw_connection, logger
+from ledger import build_gl_entries
+from rollup import build_rollup
+from flux_api import ensure_flux_functions, FLUX_FUNCTIONS_VERSION
+from costing import refresh_product_cost, DEFAULT_COSTING_METHOD
+from depreciation import build_depreciation_schedule, DEFAULT_DEPRECIATION_METHOD, DEFAULT_USEFUL_LIFE
+from instrumentation import stage, capture_plan, explain_enabled
+from ingest import load_script, load_incremental, update_watermarks, BULK_BATCH_ROWS
+import sqlite_backend
 from sqlalchemy import text 
 import os
 
-def extract_load():
-    """Reads the SQL setup file and executes it in the Docker DB."""
-    engine = get_engine()
-    # The path to your SQL script inside the container
-    curr_dir = os.path.dirname(os.path.abspath(__file__))
-    sql_file_path = os.path.join(curr_dir, '..', 'data', 'setup-postgresql.sql')
+# The path to your SQL script inside the container
+DEFAULT_SQL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'setup-postgresql.sql')
+
+def extract_load(bulk=True, batch_rows=BULK_BATCH_ROWS, resume=False, incremental=False, sql_file_path=None):
+    """Reads the SQL setup file and executes it in the Docker DB.
+
+    The script is streamed statement by statement on a single connection and
+    committed every batch_rows rows. With bulk=True the raw-table INSERTs are
+    sent as COPY batches. With resume=True the tables are kept and loading
+    restarts after the last committed checkpoint. With incremental=True only
+    rows past each table's watermark are upserted (falling back to a full
+    rebuild when no watermarks exist yet); the earliest touched timestamp per
+    table is returned. A full rebuild returns None. sql_file_path defaults
+    to data/setup-postgresql.sql. With a SQLite DATABASE_URL the script is
+    loaded with sqlite_backend.extract_load() (always a full rebuild).
+    """
+    sql_file_path = sql_file_path or DEFAULT_SQL_FILE
+    if get_backend() == 'sqlite':
+        return sqlite_backend.extract_load(sql_file_path, batch_rows)
 
     # 1. DROP EXISTING TABLES FIRST
     cleanup_sql = """
@@ -20,304 +41,239 @@ def extract_load():
     DROP TABLE IF EXISTS expense_accrual_schedule CASCADE;
     """
 
-    with engine.connect() as conn:
-        conn.execute(text(cleanup_sql))
-        conn.commit()
-        logger.info("Database cleaned.")
-
-    # 2. Read the big file
     if not os.path.exists(sql_file_path):
         logger.error(f"SQL file not found at path: {sql_file_path}")
         return
 
-    with open(sql_file_path, 'r') as file:
-        commands = file.read().split(';')
+    if incremental:
+        with get_raw_connection() as raw_conn:
+            try:
+                loader = load_incremental(sql_file_path, raw_conn, batch_rows)
+            except RuntimeError as e:
+                raw_conn.rollback()
+                logger.warning(f"{e} Falling back to a full rebuild.")
+            else:
+                logger.info("DONE! Incremental load applied.")
+                return loader.earliest
+
+    if not resume:
+        # An entity's raw tables feed the public consolidated views (entities.py),
+        # which CASCADE drops too: they are rebuilt before the drops commit
+        entity_run = get_db_settings()["schema"] is not None
+        with get_connection() as conn:
+            if entity_run:
+                from entities import lock_consolidated_views, rebuild_consolidated_views
+                lock_consolidated_views(conn)
+            conn.execute(text(cleanup_sql))
+            if entity_run:
+                rebuild_consolidated_views(conn)
+            conn.commit()
+            logger.info("Database cleaned.")
 
-    # 3. Atomic loop
-    logger.info(f"Loading {len(commands)} commands. This might take a minute...")
-    for i, command in enumerate(commands):
-        try:
-            with engine.connect() as conn:
-                conn.execute(text(command))
-                conn.commit()
-        except Exception as e:
-            # log the error but DO NOT 'raise'. must finish the load.
-            if "does not exist" not in str(e) and "already exists" not in str(e):
-                logger.warning(f"Skipped command {i} due to error: {str(e)[:50]}...")
-            continue
+    # 2. Stream the big file
+    logger.info(f"Loading {sql_file_path} in batches of {batch_rows:,} rows...")
+    with get_raw_connection() as raw_conn:
+        load_script(sql_file_path, raw_conn, batch_rows, bulk=bulk, resume=resume)
+        # Incremental runs pick up from here
+        update_watermarks(raw_conn)
 
     logger.info("DONE! Financial data should now be ready for analysis.")
 
-def create_custom_financial_tables():
-    """Creates custom financial tables needed for analysis."""
-    engine = get_engine()
-    with engine.connect() as conn:
-        try:
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS calendar (calendar_at DATE);
-                TRUNCATE TABLE calendar;
-                INSERT INTO calendar (calendar_at) 
-                SELECT generate_series('2020-01-01'::date, '2025-12-31'::date, '1 year'::interval);
-            """))
-            # Drop existing tables if they exist
-            conn.execute(text("CREATE TABLE IF NOT EXISTS equipment_depreciation_schedule (id INT, year INT, gross_val NUMERIC, annual_depreciation_expense NUMERIC);"))
-            conn.execute(text("TRUNCATE TABLE equipment_depreciation_schedule;"))
-
-            depreciation_sql = """
-                INSERT INTO equipment_depreciation_schedule (id, year, gross_val, annual_depreciation_expense)
-                WITH ppe_base AS (
-                SELECT 
-                    id,
-                    EXTRACT(YEAR FROM payment_date)::INT AS start_year,
-                    amount AS cost
-                FROM payments 
-                WHERE payment_type = 'equipment'
-                )
-                SELECT 
-                    p.id,
-                    c.year,
-                    p.cost AS gross_val,
-                    CASE 
-                        WHEN c.year = p.start_year THEN (p.cost / 10.0) * 0.5
-                        WHEN c.year = p.start_year + 10 THEN (p.cost / 10.0) * 0.5
-                        WHEN c.year > p.start_year AND c.year < p.start_year + 10 THEN (p.cost / 10.0)
-                        ELSE 0 
-                    END AS annual_depreciation_expense
-                FROM ppe_base p
-                CROSS JOIN (SELECT DISTINCT EXTRACT(YEAR FROM calendar_at)::INT AS year FROM calendar) c
-                WHERE c.year BETWEEN p.start_year AND p.start_year + 10
-                """
-            conn.execute(text(depreciation_sql))
+def affected_since_year(touched):
+    """Earliest statement year a load can have changed, or None when everything must be rebuilt.
 
-            # 2. Create and populate Accruals
-            conn.execute(text("CREATE TABLE IF NOT EXISTS expense_accrual_schedule (id INT, account VARCHAR, amount NUMERIC, accrual_date DATE, cash_payment_date DATE);"))
-            conn.execute(text("TRUNCATE TABLE expense_accrual_schedule;"))
+    touched maps raw table -> earliest timestamp loaded (see extract_load).
+    One year of slack covers the accrual schedule, which books payments in
+    the month before they were made.
+    """
+    if touched is None:
+        return None
+    if not touched:
+        return 9999
+    return min(ts.year for ts in touched.values()) - 1
+
+ACCRUAL_SQL = """
+    INSERT INTO expense_accrual_schedule (id, account, amount, accrual_date, cash_payment_date)
+    SELECT 
+        id,
+        payment_type AS account,
+        amount,
+        -- The P&L Date: The month PRIOR to the actual payment
+        DATE_TRUNC('month', payment_date - INTERVAL '1 month')::DATE AS accrual_date,
+        -- The Cash Date: When it actually left the bank
+        payment_date AS cash_payment_date
+    FROM payments
+    WHERE 
+    payment_type IN ('wage', 'utility', 'tax')
+    -- Half-open range on the partition key: only the 2021-2023 partitions are read
+    AND payment_date >= '2021-01-01' AND payment_date < '2024-01-01';
+    """
 
-            accrual_sql = """
-                INSERT INTO expense_accrual_schedule (id, account, amount, accrual_date, cash_payment_date)
-                SELECT 
-                    id,
-                    payment_type AS account,
-                    amount,
-                    -- The P&L Date: The month PRIOR to the actual payment
-                    DATE_TRUNC('month', payment_date - INTERVAL '1 month')::DATE AS accrual_date,
-                    -- The Cash Date: When it actually left the bank
-                    payment_date AS cash_payment_date
-                FROM payments
-                WHERE 
-                payment_type IN ('wage', 'utility', 'tax')
-                AND EXTRACT(YEAR FROM payment_date) IN (2021, 2022, 2023);
-                """  
-            conn.execute(text(accrual_sql))
-            conn.commit()
-            logger.info("Custom financial tables created successfully.")
+def create_depreciation_schedule(depreciation_method=DEFAULT_DEPRECIATION_METHOD,
+                                 useful_life=DEFAULT_USEFUL_LIFE, life_overrides=None):
+    """Builds equipment_depreciation_schedule; returns True on success.
 
+    The schedule is computed in Python over the whole equipment register
+    (see depreciation.py) and bulk-loaded, so it runs for each asset's full
+    life.
+    """
+    if get_backend() == 'sqlite':
+        return sqlite_backend.create_depreciation_schedule(depreciation_method, useful_life, life_overrides)
+    with get_raw_connection() as raw_conn:
+        try:
+            # One COPY for every asset and year
+            with stage("depreciation"):
+                build_depreciation_schedule(raw_conn, depreciation_method, useful_life, life_overrides)
+                raw_conn.commit()
+            return True
         except Exception as e:
-            logger.error(f"Error creating custom financial tables: {e}")
-
-def create_focus_view(end_year=2023):  
-    engine = get_engine() 
-    with engine.connect() as conn:
+            raw_conn.rollback()
+            logger.error(f"Error building depreciation schedule: {e}")
+            return False
+
+def create_accrual_schedule():
+    """Builds expense_accrual_schedule; returns True on success."""
+    if get_backend() == 'sqlite':
+        return sqlite_backend.create_accrual_schedule()
+    with get_connection() as conn:
         try:
-            sql = f"""
-            CREATE OR REPLACE VIEW dashboard_flux_analysis AS
-            WITH pl_source AS (
-            -- 1. REVENUE
-                SELECT 
-                    EXTRACT(YEAR FROM sale_at)::INT AS year, 
-                    'Revenue' AS account, 
-                    SUM(quantity * price) AS amt 
-                FROM sales 
-                GROUP BY 1
-                UNION ALL
-
-                -- 2a. CASH INFLOW (Revenue + 1 Month Lag for non-cash)
-                SELECT 
-                    EXTRACT(YEAR FROM (CASE WHEN payment_method = 'cash' THEN sale_at ELSE sale_at + INTERVAL '1 month' END))::INT AS year,
-                    'Cash' AS account, 
-                    SUM(quantity * price) AS amt
-                FROM sales 
-                GROUP BY 1, 2
-                UNION ALL
-
-                -- 2b. CASH INFLOW: LOANS (Initial Principal Received)
-                SELECT 
-                    EXTRACT(YEAR FROM loan_at)::INT AS year, 
-                    'Cash' AS account, 
-                    SUM(value) AS amt 
-                FROM loans 
-                GROUP BY 1
-                UNION ALL
-
-                -- 3. CASH OUTFLOW: PURCHASES (Inventory + 1 Month Lag for non-cash)
-                SELECT 
-                    EXTRACT(
-                        YEAR FROM (CASE WHEN payment_method = 'cash' THEN purchase_at ELSE purchase_at + INTERVAL '1 month' END)
-                    )::INT AS year,
-                    'Cash' AS account, -SUM(quantity * amount) AS amt
-                FROM purchases 
-                GROUP BY 1, 2
-                UNION ALL
-
-                -- 4. CASH OUTFLOW: OPERATING EXPENSES (Payments table)
-
-                SELECT EXTRACT(YEAR FROM payment_date)::INT AS year, 
-                'Cash' AS account, 
-                -SUM(amount) AS amt
-                FROM payments 
-                WHERE payment_type IN ('interest', 'wage', 'utility', 'tax', 'rent') -- excludes equipment and loan 
-                GROUP BY 1
-                UNION ALL
-
-                -- 5. COGS (P&L Impact)
-                SELECT EXTRACT(YEAR FROM s.sale_at)::INT AS year, 
-                'COGS' AS account, 
-                -SUM(pc.amount * s.quantity) 
-                FROM sales s 
-                LEFT JOIN (
-                    SELECT 
-                        DISTINCT product_name, 
-                        amount 
-                        FROM purchases) pc 
-                        ON s.product_name = pc.product_name 
-                GROUP BY 1
-                UNION ALL
-
-                -- 6. DEPRECIATION EXPENSE (P&L Impact)
-                SELECT 
-                year, 
-                'Depr_Exp' AS account, 
-                -SUM(annual_depreciation_expense) AS amt
-                FROM equipment_depreciation_schedule 
-                GROUP BY 1
-                UNION ALL
-
-                -- 7. PPE SNAPSHOT (Balance Sheet Anchor - Flat 31k)
-                SELECT 
-                year, 
-                'PPE_Snapshot' AS account, 
-                SUM(gross_val) AS amt
-                FROM equipment_depreciation_schedule 
-                GROUP BY 1
-                UNION ALL
-
-                -- 8. ACCOUNTS RECEIVABLE (Year-end unpaid sales)
-                SELECT EXTRACT(YEAR FROM payment_at)::INT AS year, 
-                'Accounts_Receivable' AS account, 
-                SUM(price * quantity) AS amt
-                FROM sales WHERE payment_method <> 'cash' AND DATE_PART('month', payment_at) = 12 
-                GROUP BY 1
-                UNION ALL
-
-                -- 9. INVENTORY: Additions (Purchases)
-                SELECT EXTRACT(YEAR FROM purchase_at)::INT AS year, 'Inventory' AS account, SUM(amount * quantity) AS amt
-                FROM purchases GROUP BY 1
-                UNION ALL
-                
-                -- 10. INVENTORY: Deductions (Sales at Cost)
-                SELECT EXTRACT(YEAR FROM sale_at)::INT AS year, 'Inventory' AS account, -SUM(s.quantity * pc.amount) AS amt
-                FROM sales AS s
-                LEFT JOIN (SELECT DISTINCT product_name, amount FROM purchases) AS pc ON s.product_name = pc.product_name
-                GROUP BY 1
-
-                UNION ALL
-                -- 11. LOAN BALANCE (Liability)
-            
-                SELECT 
-                    EXTRACT(YEAR FROM loan_at)::INT AS year, 
-                    'Loan_Principal' AS account, SUM(value) AS amt 
-                FROM loans GROUP BY 1
-                UNION ALL
-
-                -- Principal Payments (Decreases Liability)
-                SELECT 
-                    EXTRACT(YEAR FROM payment_date)::INT AS year, 
-                    'Loan_Principal' AS account, -SUM(amount) AS amt 
-                FROM payments 
-                WHERE payment_type = 'loan' GROUP BY 1
-                UNION ALL
-
-                -- 12a. OPERATIONAL EXPENSES (P&L Accrual - the month incurred)
-                SELECT 
-                    EXTRACT(YEAR FROM accrual_date)::INT AS year, 
-                    account, 
-                    -SUM(amount) AS amt
-                FROM expense_accrual_schedule
-
-                GROUP BY 1, 2
-                UNION ALL
-
-                -- 12b. DIRECT RENT EXPENSE (Pulling directly from payments to the P&L)
-                SELECT 
-                    EXTRACT(YEAR FROM payment_date)::INT AS year, 
-                    'rent' AS account, 
-                    -SUM(amount) AS amt
-                FROM payments 
-                WHERE payment_type = 'rent' -- Hit the P&L directly
-                GROUP BY 1, 2
-                UNION ALL
-
-                -- 13. ACCOUNTS PAYABLE: Increase (When Accrued)
-                SELECT 
-                    EXTRACT(YEAR FROM accrual_date)::INT AS year, 
-                    'Accounts_Payable' AS account, 
-                    SUM(amount) AS amt
-                FROM expense_accrual_schedule 
-                GROUP BY 1, 2         
-
-                UNION ALL
-                -- 14. ACCOUNTS PAYABLE: Decrease (When Paid)
-                SELECT 
-                    EXTRACT(YEAR FROM cash_payment_date)::INT AS year, 
-                    'Accounts_Payable' AS account, 
-                    -SUM(amount) AS amt
-                FROM expense_accrual_schedule 
-                WHERE cash_payment_date IS NOT NULL
-                GROUP BY 1, 2
-                ),
+            conn.execute(text("CREATE TABLE IF NOT EXISTS expense_accrual_schedule (id INT, account VARCHAR, amount NUMERIC, accrual_date DATE, cash_payment_date DATE);"))
+            conn.execute(text("TRUNCATE TABLE expense_accrual_schedule;"))
+            with stage("accruals"):
+                conn.execute(text(ACCRUAL_SQL))
+                conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error creating accrual schedule: {e}")
+            return False
 
-            yearly_summaries AS (
-                SELECT 
-                    year,
-                    account,
-                    SUM(amt) AS annual_movement,
-                    SUM(SUM(amt)) OVER (PARTITION BY account ORDER BY year) AS running_balance
-                FROM pl_source
-                GROUP BY 1, 2
-            )
-            SELECT 
-                year,
-                -- P&L: Includes Revenue, COGS, Depreciation, and Operating Accounts
-                ROUND(COALESCE(MAX(annual_movement) FILTER (WHERE account = 'Revenue'), 0)::numeric, 2) AS revenue,
-                ROUND(SUM(annual_movement) FILTER (
-                    WHERE account IN ('Revenue', 'COGS', 'Depr_Exp', 'interest', 'wage', 'tax', 'rent', 'utility')
-                )::numeric, 2) AS net_income,
-                
-                -- BALANCE SHEET: Current Assets & Liabilities
-                ROUND(COALESCE(MAX(running_balance) FILTER (WHERE account = 'Cash'), 0)::numeric, 2) AS cash,
-                ROUND(COALESCE(MAX(running_balance) FILTER (WHERE account = 'Accounts_Receivable'), 0)::numeric, 2) AS accounts_receivable,
-                ROUND(COALESCE(MAX(running_balance) FILTER (WHERE account = 'Accounts_Payable'), 0)::numeric, 2) AS accounts_payable,
+def create_custom_financial_tables(depreciation_method=DEFAULT_DEPRECIATION_METHOD,
+                                   useful_life=DEFAULT_USEFUL_LIFE, life_overrides=None):
+    """Creates custom financial tables needed for analysis.
 
-                -- Long-Term Liabilities
-                ROUND(COALESCE(MAX(running_balance) FILTER (WHERE account = 'Loan_Principal'), 0)::numeric, 2) AS debt_remaining,
-                
-                -- CURRENT ASSETS
-                ROUND(COALESCE(MAX(running_balance) FILTER (WHERE account = 'Inventory'), 0)::numeric, 2) AS inventory,
+    Runs the two schedule builds one after the other; run_pipeline() runs
+    them as independent DAG nodes instead.
+    """
+    built = create_depreciation_schedule(depreciation_method, useful_life, life_overrides)
+    built = create_accrual_schedule() and built
+    if built:
+        logger.info("Custom financial tables created successfully.")
+    return built
+
+def create_focus_view(end_year=2023, since_year=None, costing_method=DEFAULT_COSTING_METHOD):
+    """Builds dashboard_flux_analysis as a materialized view over yearly account movements.
+
+    since_year=None recomputes the movements for every year. Otherwise only
+    years >= since_year are re-posted to gl_entries and re-aggregated, and the
+    concurrent refresh re-chains the running balances from there.
+    costing_method ('latest', 'weighted_average' or 'fifo') values COGS and
+    inventory; switching it recomputes every year. Returns True on success.
+    On SQLite (see sqlite_backend.py) every year is rebuilt into a plain table.
+    """
+    if get_backend() == 'sqlite':
+        return sqlite_backend.create_focus_view(end_year, costing_method)
+    with get_connection() as conn:
+        try:
+            # 0. Unit costs first: products purchased since since_year are re-costed
+            with stage("product_cost"):
+                if refresh_product_cost(conn, costing_method, since_year):
+                    since_year = None
 
-                -- FIXED ASSETS: Net PPE calculation
-                ROUND(COALESCE(MAX(annual_movement) FILTER (WHERE account = 'PPE_Snapshot'), 0)::numeric, 2) AS gross_ppe,
-                ROUND(GREATEST(0, 
-                    COALESCE(MAX(annual_movement) FILTER (WHERE account = 'PPE_Snapshot'), 0) + 
-                    COALESCE(MAX(running_balance) FILTER (WHERE account = 'Depr_Exp'), 0)
-                )::numeric, 2) AS net_ppe
-            FROM yearly_summaries
-            WHERE year <= {end_year} 
-            GROUP BY year
-            ORDER BY year        
+            # 1. Yearly movement per account, aggregated from the general ledger
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS flux_yearly_movements (
+                    year INT NOT NULL,
+                    account VARCHAR NOT NULL,
+                    annual_movement NUMERIC,
+                    PRIMARY KEY (year, account)
+                );
+            """))
+            if since_year is not None and not conn.execute(
+                text("SELECT EXISTS (SELECT 1 FROM flux_yearly_movements);")
+            ).scalar():
+                # Nothing to build on yet: a partial recompute would leave earlier years empty
+                since_year = None
+
+            if since_year is None:
+                conn.execute(text("TRUNCATE TABLE flux_yearly_movements;"))
+                year_filter = ""
+            else:
+                conn.execute(
+                    text("DELETE FROM flux_yearly_movements WHERE year >= :since_year;"),
+                    {"since_year": since_year},
+                )
+                year_filter = "AND year >= :since_year"
+
+            # Ledger postings first: each raw table is scanned once, not once per account
+            with stage("gl_entries"):
+                build_gl_entries(conn, since_year, costing_method)
+            movements_sql = f"""
+            INSERT INTO flux_yearly_movements (year, account, annual_movement)
+            SELECT year, account, SUM(amount) AS annual_movement
+            FROM gl_entries
+            WHERE TRUE {year_filter}
+            GROUP BY 1, 2
             """
-            conn.execute(text(sql))
-            conn.commit()
+            with stage("movements"):
+                conn.execute(text(movements_sql), {"since_year": since_year})
+            # Month/quarter/year drill-down cube over the same postings
+            with stage("rollup"):
+                build_rollup(conn, since_year)
+
+            # 2. Running balances + statement pivot, materialized with a unique index on year.
+            #    The functions are only replaced when their SQL changed (no DDL on a plain refresh)
+            ensure_flux_functions(conn)
+            existing = conn.execute(text("""
+                SELECT c.relkind, obj_description(c.oid, 'pg_class')
+                FROM pg_class c
+                WHERE c.relname = 'dashboard_flux_analysis'
+                  AND c.relnamespace = current_schema()::regnamespace
+            """)).fetchone()
+            definition = f"end_year={end_year};flux_statement {FLUX_FUNCTIONS_VERSION}"
+
+            if existing and existing[0] == 'm' and existing[1] == definition:
+                conn.commit()
+                with stage("refresh_view"):
+                    conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY dashboard_flux_analysis;"))
+                    conn.commit()
+                logger.info(f"Flux analysis refreshed concurrently (years >= {since_year or 'all'}).")
+                capture_flux_plans(conn)
+                return True
+
+            if existing and existing[0] == 'v':
+                conn.execute(text("DROP VIEW dashboard_flux_analysis;"))
+            elif existing:
+                conn.execute(text("DROP MATERIALIZED VIEW dashboard_flux_analysis;"))
+
+            # The statement logic lives in flux_statement() (see flux_api.py); the view
+            # materializes it for the default horizon
+            sql = f"""
+            CREATE MATERIALIZED VIEW dashboard_flux_analysis AS
+            SELECT * FROM flux_statement(0, {int(end_year)})
+            """
+            with stage("create_view"):
+                conn.execute(text(sql))
+                conn.execute(text("CREATE UNIQUE INDEX dashboard_flux_analysis_year_uidx ON dashboard_flux_analysis (year);"))
+                conn.execute(text(f"COMMENT ON MATERIALIZED VIEW dashboard_flux_analysis IS '{definition}';"))
+                conn.commit()
             logger.info(f"Analytical views refreshed in Docker DB for end_year {end_year}.")
+            capture_flux_plans(conn)
+            return True
 
         except Exception as e:
-            logger.error(f"Error during transformations: {e}") 
\ No newline at end of file
+            logger.error(f"Error during transformations: {e}")
+            return False
+
+def capture_flux_plans(conn):
+    """EXPLAIN (ANALYZE, BUFFERS) of the flux aggregation, view definition and a dashboard read.
+
+    Only does work inside pipeline_run(explain=True).
+    """
+    if not explain_enabled():
+        return
+    capture_plan(conn, "flux_movements", "SELECT year, account, SUM(amount) FROM gl_entries GROUP BY 1, 2")
+    view_sql = conn.execute(text("SELECT pg_get_viewdef('dashboard_flux_analysis'::regclass)")).scalar()
+    if view_sql:
+        capture_plan(conn, "dashboard_flux_analysis_definition", view_sql.rstrip().rstrip(';'))
+    capture_plan(conn, "dashboard_flux_analysis_read", "SELECT * FROM dashboard_flux_analysis WHERE year = 2021")
+    capture_plan(conn, "flux_statement_read", "SELECT * FROM flux_statement(2021, 2022)")
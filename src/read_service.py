@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+import pandas as pd
+from sqlalchemy import text
+import flux_api
+from snapshot_cache import current_version
+from utils import get_backend, get_connection, get_db_settings, logger
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8050
+DEFAULT_END_YEAR = 2023
+CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_ENTRIES", "256"))
+CACHE_TTL_SECONDS = float(os.getenv("READ_CACHE_TTL", "300"))
+# The stamp file is re-read at most this often
+VERSION_CHECK_SECONDS = 1.0
+
+# flux_api.flux_account_balances() for SQLite, which has no SQL functions
+SQLITE_BALANCES_SQL = """
+    SELECT year, account, annual_movement,
+        SUM(annual_movement) OVER (PARTITION BY account ORDER BY year) AS running_balance
+    FROM flux_yearly_movements
+    WHERE year <= :end_year
+    ORDER BY account, year
+"""
+
+
+def read_statement(start_year=0, end_year=DEFAULT_END_YEAR):
+    """The statement rows for [start_year, end_year] (flux_api.flux_statement on PostgreSQL)."""
+    if get_backend() == 'sqlite':
+        # The SQLite statement table is built for the default horizon only
+        with get_connection() as conn:
+            return pd.read_sql_query(text(
+                "SELECT * FROM dashboard_flux_analysis WHERE year BETWEEN :start_year AND :end_year ORDER BY year"
+            ), conn, params={"start_year": start_year, "end_year": end_year})
+    return flux_api.flux_statement(start_year, end_year)
+
+
+def read_balances(start_year=0, end_year=DEFAULT_END_YEAR, accounts=None):
+    """Yearly movement and running balance per account (flux_api.account_balances on PostgreSQL)."""
+    if get_backend() == 'sqlite':
+        with get_connection() as conn:
+            frame = pd.read_sql_query(text(SQLITE_BALANCES_SQL), conn, params={"end_year": end_year})
+        frame = frame[frame['year'] >= start_year]
+        if accounts is not None:
+            frame = frame[frame['account'].isin(accounts)]
+        return frame.reset_index(drop=True)
+    return flux_api.account_balances(start_year, end_year, accounts)
+
+
+def _int_param(query, name, default):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        return int(values[0])
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {values[0]!r}")
+
+
+def _statement_params(query):
+    return {
+        "start_year": _int_param(query, 'start_year', 0),
+        "end_year": _int_param(query, 'end_year', DEFAULT_END_YEAR),
+    }
+
+
+def _balances_params(query):
+    params = _statement_params(query)
+    if query.get('accounts'):
+        # Sorted tuple: the same account set is the same cache entry
+        params["accounts"] = tuple(sorted(a for a in query['accounts'][0].split(',') if a))
+    return params
+
+
+# Path -> (query function, parser from the parsed query string to its keyword arguments)
+READ_QUERIES = {
+    '/flux': (read_statement, _statement_params),
+    '/balances': (read_balances, _balances_params),
+}
+
+
+def encode_rows(frame):
+    """JSON body for a result frame: a list of row objects, NULL/NaN as null."""
+    rows = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    return json.dumps(rows, default=float).encode('utf-8')
+
+
+class ResultCache:
+    """Least-recently-used cache of encoded results that also expires entries after ttl seconds.
+
+    Only touched from the event loop thread, so it needs no lock.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class ReadService:
+    """Serves READ_QUERIES over HTTP from a result cache keyed by query parameters and data version.
+
+    The data version is the stamp run_pipeline() writes after every run
+    (snapshot_cache.stamp_data_version), so a finished run makes every
+    cached entry unreachable without any explicit invalidation. Identical
+    requests arriving while their query runs wait for that query instead
+    of starting their own. Queries run on worker threads, each on a pooled
+    connection, so the event loop never blocks on the database.
+    """
+
+    def __init__(self, queries=None, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS,
+                 workers=None, version=current_version):
+        self.queries = queries or READ_QUERIES
+        self.cache = ResultCache(max_entries, ttl)
+        self.inflight = {}
+        # No more query threads than pooled connections, so no thread waits on a checkout
+        self.executor = ThreadPoolExecutor(workers or get_db_settings()["pool_size"], thread_name_prefix='read')
+        self.version_func = version
+        self.version = None
+        self.version_checked = 0.0
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "query_seconds": 0.0}
+
+    async def data_version(self):
+        if self.version is None or time.monotonic() - self.version_checked > VERSION_CHECK_SECONDS:
+            loop = asyncio.get_running_loop()
+            self.version = await loop.run_in_executor(self.executor, self.version_func)
+            self.version_checked = time.monotonic()
+        return self.version
+
+    def _run_query(self, path, params):
+        started = time.perf_counter()
+        body = encode_rows(self.queries[path][0](**params))
+        self.stats["query_seconds"] += time.perf_counter() - started
+        return body
+
+    async def _query(self, key, path, params):
+        try:
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(self.executor, partial(self._run_query, path, params))
+            self.cache.put(key, body)
+            return body
+        finally:
+            del self.inflight[key]
+
+    async def fetch(self, path, params):
+        """Encoded result and how it was served: 'hit', 'coalesced' (joined a running query) or 'miss'."""
+        version = await self.data_version()
+        key = (path, tuple(sorted(params.items())), version)
+        body = self.cache.get(key)
+        if body is not None:
+            self.stats["hits"] += 1
+            return body, 'hit', version
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(self._query(key, path, params))
+            served = 'miss'
+        else:
+            served = 'coalesced'
+        self.stats["misses" if served == 'miss' else "coalesced"] += 1
+        # A client hanging up must not cancel the query others are waiting on
+        return await asyncio.shield(task), served, version
+
+    async def respond(self, method, target):
+        """(status, body, extra headers) for one request."""
+        self.stats["requests"] += 1
+        if method != 'GET':
+            return 405, b'{"error": "only GET is supported"}', {}
+        url = urlsplit(target)
+        if url.path == '/version':
+            return 200, json.dumps({"data_version": await self.data_version()}).encode('utf-8'), {}
+        if url.path == '/stats':
+            stats = dict(self.stats, cached_entries=len(self.cache.entries), inflight=len(self.inflight))
+            return 200, json.dumps(stats).encode('utf-8'), {}
+        if url.path not in self.queries:
+            return 404, json.dumps({"error": f"unknown path {url.path}", "paths": sorted(self.queries)}).encode('utf-8'), {}
+
+        try:
+            params = self.queries[url.path][1](parse_qs(url.query))
+        except ValueError as e:
+            return 400, json.dumps({"error": str(e)}).encode('utf-8'), {}
+        try:
+            body, served, version = await self.fetch(url.path, params)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"[read_service] {url.path} {params} failed: {e}")
+            return 500, json.dumps({"error": "query failed"}).encode('utf-8'), {}
+        return 200, body, {"X-Cache": served, "X-Data-Version": version}
+
+    async def handle(self, reader, writer):
+        """One HTTP/1.1 exchange per connection (Connection: close)."""
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            try:
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                status, body, headers = 400, b'{"error": "malformed request"}', {}
+            else:
+                status, body, headers = await self.respond(method, target)
+
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}.get(
+                status, 'Internal Server Error')
+            head = [f"HTTP/1.1 {status} {reason}", "Content-Type: application/json",
+                    f"Content-Length: {len(body)}", "Connection: close"]
+            head += [f"{name}: {value}" for name, value in headers.items()]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **options):
+    """Runs the read service until cancelled; options go to ReadService."""
+    service = ReadService(**options)
+    server = await asyncio.start_server(service.handle, host, port)
+    logger.info(f"[read_service] listening on http://{host}:{port} ({', '.join(sorted(service.queries))}, "
+                f"cache {service.cache.max_entries} entries / {service.cache.ttl:.0f}s).")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve cached statement and balance reads over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--cache-entries", type=int, default=CACHE_MAX_ENTRIES)
+    parser.add_argument("--ttl", type=float, default=CACHE_TTL_SECONDS, help="seconds a cached result is served")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, max_entries=args.cache_entries, ttl=args.ttl))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,153 @@
+import argparse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from utils import get_connection, logger
+from costing import DEFAULT_COSTING_METHOD, SALES_COST_JOIN, sales_cost_source
+from dag import DEFAULT_WORKERS
+from instrumentation import pipeline_run, stage
+from ledger import GL_POSTINGS_SQL
+from statements import STATEMENT_COLUMNS, flux_statement
+
+AUDIT_RESULTS_SQL = """
+CREATE TABLE IF NOT EXISTS audit_results (
+    audit_id VARCHAR NOT NULL,
+    audited_at TIMESTAMP NOT NULL,
+    year INT NOT NULL,
+    line VARCHAR NOT NULL,
+    expected NUMERIC,
+    reported NUMERIC,
+    difference NUMERIC,
+    tolerance NUMERIC NOT NULL,
+    status VARCHAR NOT NULL,
+    PRIMARY KEY (audit_id, year, line)
+);
+CREATE INDEX IF NOT EXISTS audit_results_status_idx ON audit_results (status, audited_at);
+"""
+
+DEFAULT_TOLERANCE = 0.01
+STATEMENT_LINES = [column for column in STATEMENT_COLUMNS if column != 'year']
+
+
+def source_movements(source_table, costing_method=DEFAULT_COSTING_METHOD):
+    """Yearly movement per account posted by one source table, recomputed from its raw rows.
+
+    Uses the ledger's posting rules but aggregates in the same statement, so
+    it depends on neither gl_entries nor flux_yearly_movements: one scan and
+    one GROUP BY per source, whatever the number of years and accounts.
+    """
+    postings_sql = GL_POSTINGS_SQL[source_table].format(
+        source_filter="WHERE e.entry_date IS NOT NULL AND e.amount IS NOT NULL",
+        sales_source=sales_cost_source(costing_method),
+        cost_join=SALES_COST_JOIN,
+    )
+    sql = f"""
+        SELECT EXTRACT(YEAR FROM entry_date)::INT AS year, account, SUM(amount) AS amount
+        FROM ({postings_sql}) postings
+        GROUP BY 1, 2
+    """
+    with stage(f"reconcile.{source_table}"):
+        with get_connection() as conn:
+            movements = pd.read_sql_query(text(sql), conn)
+    movements['amount'] = movements['amount'].astype(float)
+    return movements
+
+
+def compare_statements(expected, reported, tolerance=DEFAULT_TOLERANCE, relative_tolerance=0.0):
+    """Line-by-line comparison of two statements with the STATEMENT_COLUMNS layout.
+
+    A line passes when |expected - reported| <= max(tolerance,
+    relative_tolerance * |expected|). Years present on one side only are
+    'missing'. Returns one row per (year, line).
+    """
+    merged = (
+        expected.melt(id_vars='year', value_vars=STATEMENT_LINES, var_name='line', value_name='expected')
+        .merge(
+            reported.melt(id_vars='year', value_vars=STATEMENT_LINES, var_name='line', value_name='reported'),
+            on=['year', 'line'], how='outer', indicator=True,
+        )
+    )
+    merged['expected'] = merged['expected'].astype(float)
+    merged['reported'] = merged['reported'].astype(float)
+    merged['difference'] = merged['reported'] - merged['expected']
+    merged['tolerance'] = np.maximum(tolerance, relative_tolerance * merged['expected'].abs().fillna(0))
+    # NULL on both sides (e.g. net income of a year with no P&L postings) agrees
+    both_null = merged['expected'].isna() & merged['reported'].isna()
+    within = (merged['difference'].abs() <= merged['tolerance']) | both_null
+    merged['status'] = np.select(
+        [merged['_merge'] != 'both', within], ['missing', 'ok'], default='mismatch',
+    )
+    return merged.drop(columns='_merge').sort_values(['year', 'line'], ignore_index=True)
+
+
+def save_audit_results(results, audit_id, audited_at):
+    with get_connection() as conn:
+        conn.execute(text(AUDIT_RESULTS_SQL))
+        rows = results.assign(audit_id=audit_id, audited_at=audited_at)
+        conn.execute(
+            text("""
+                INSERT INTO audit_results (audit_id, audited_at, year, line, expected, reported,
+                                           difference, tolerance, status)
+                VALUES (:audit_id, :audited_at, :year, :line, :expected, :reported,
+                        :difference, :tolerance, :status)
+            """),
+            [
+                {key: (None if isinstance(value, float) and np.isnan(value) else value) for key, value in row.items()}
+                for row in rows.astype(object).to_dict('records')
+            ],
+        )
+        conn.commit()
+
+
+def reconcile(end_year=2023, tolerance=DEFAULT_TOLERANCE, relative_tolerance=0.0,
+              max_workers=DEFAULT_WORKERS, save=True):
+    """Audits every line of dashboard_flux_analysis for every year against the raw data.
+
+    Each source table's yearly movements are rebuilt with one grouped query,
+    the source tables in parallel; the expected statement is derived from
+    them with the same balance rules as the view and compared with the view
+    in one pass. All checked lines go to audit_results (status 'ok',
+    'mismatch' or 'missing') under one audit_id. Returns the comparison.
+    """
+    audit_id = uuid.uuid4().hex[:12]
+    audited_at = datetime.now()
+    with get_connection() as conn:
+        costing_method = conn.execute(text("SELECT MIN(method) FROM product_cost")).scalar() or DEFAULT_COSTING_METHOD
+        reported = pd.read_sql_query(text("SELECT * FROM dashboard_flux_analysis ORDER BY year"), conn)
+
+    # 1. One grouped scan per source table, side by side on the pool
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='reconcile') as pool:
+        movements = list(pool.map(lambda source: source_movements(source, costing_method), GL_POSTINGS_SQL))
+
+    # 2. Expected statement from the raw movements, compared with the view in one pass
+    expected = flux_statement(pd.concat(movements, ignore_index=True), end_year)
+    results = compare_statements(expected, reported[STATEMENT_COLUMNS], tolerance, relative_tolerance)
+
+    if save:
+        save_audit_results(results, audit_id, audited_at)
+    failed = results[results['status'] != 'ok']
+    for row in failed.itertuples():
+        logger.warning(f"[audit {audit_id}] {row.year} {row.line}: {row.status}, expected {row.expected:,.2f}, "
+                       f"view {row.reported:,.2f} (difference {row.difference:,.2f})")
+    logger.info(f"[audit {audit_id}] {len(results)} lines over {results['year'].nunique()} years checked, "
+                f"{len(failed)} discrepancies.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile every year and line of the flux analysis with the raw data.")
+    parser.add_argument("--end-year", type=int, default=2023)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="absolute difference allowed per line (default: %(default)s)")
+    parser.add_argument("--relative-tolerance", type=float, default=0.0,
+                        help="difference allowed as a fraction of the expected value, if larger")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+    with pipeline_run("reconcile"):
+        try:
+            reconcile(args.end_year, args.tolerance, args.relative_tolerance, args.workers)
+        except Exception as e:
+            logger.error(f"Reconciliation failed: {e}")
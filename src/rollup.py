@@ -0,0 +1,148 @@
+import pandas as pd
+from sqlalchemy import text
+from utils import logger
+
+ROLLUP_GRAINS = ('month', 'quarter', 'year')
+
+# Same columns as sql_files/date.sql, created only when missing. The range
+# starts a year before the first posting (accruals land in the December
+# before the first payment) and is extended when older entries appear.
+DATE_DIM_SQL = """
+CREATE TABLE IF NOT EXISTS date_dim (
+    date DATE,
+    day NUMERIC,
+    month NUMERIC,
+    month_name TEXT,
+    year NUMERIC,
+    year_month TEXT,
+    weekday NUMERIC,
+    weekday_name TEXT,
+    quarter TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS date_dim_date_uidx ON date_dim (date);
+"""
+
+DATE_DIM_FILL_SQL = """
+INSERT INTO date_dim (date, day, month, month_name, year, year_month, weekday, weekday_name, quarter)
+SELECT
+    d::DATE,
+    EXTRACT(DAY FROM d),
+    EXTRACT(MONTH FROM d),
+    TO_CHAR(d, 'Month'),
+    EXTRACT(YEAR FROM d),
+    TO_CHAR(d, 'YYYY-MM'),
+    EXTRACT(DOW FROM d),
+    TO_CHAR(d, 'Day'),
+    'Q' || EXTRACT(QUARTER FROM d)
+FROM generate_series(CAST(:first_date AS DATE), CAST(:last_date AS DATE), INTERVAL '1 day') AS d
+WHERE NOT EXISTS (SELECT 1 FROM date_dim x WHERE x.date = d::DATE)
+"""
+
+# One row per account, grain and period. period_start is the first day of the
+# month, quarter or year (a date_dim key); month/quarter are NULL above their grain.
+ROLLUP_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS flux_rollup (
+    account VARCHAR NOT NULL,
+    grain VARCHAR NOT NULL,
+    period_start DATE NOT NULL,
+    year INT NOT NULL,
+    quarter INT,
+    month INT,
+    movement NUMERIC NOT NULL,
+    running_balance NUMERIC,
+    PRIMARY KEY (account, grain, period_start)
+);
+CREATE INDEX IF NOT EXISTS flux_rollup_grain_period_idx ON flux_rollup (grain, period_start);
+"""
+
+# Month, quarter and year totals from a single scan of the ledger
+ROLLUP_MOVEMENTS_SQL = """
+INSERT INTO flux_rollup (account, grain, period_start, year, quarter, month, movement)
+SELECT
+    g.account,
+    CASE WHEN GROUPING(d.month) = 0 THEN 'month'
+         WHEN GROUPING(d.quarter) = 0 THEN 'quarter'
+         ELSE 'year' END,
+    MAKE_DATE(d.year::INT,
+              COALESCE(d.month::INT, (SUBSTRING(d.quarter FROM 2)::INT - 1) * 3 + 1, 1), 1),
+    d.year::INT,
+    SUBSTRING(d.quarter FROM 2)::INT,
+    d.month::INT,
+    SUM(g.amount)
+FROM gl_entries g
+JOIN date_dim d ON d.date = g.entry_date
+WHERE TRUE {year_filter}
+GROUP BY g.account, GROUPING SETS ((d.year, d.quarter, d.month), (d.year, d.quarter), (d.year))
+"""
+
+# Cumulative balance at the end of each period, re-chained from the first changed one
+ROLLUP_BALANCES_SQL = """
+UPDATE flux_rollup r
+SET running_balance = b.running_balance
+FROM (
+    SELECT account, grain, period_start,
+        SUM(movement) OVER (PARTITION BY account, grain ORDER BY period_start) AS running_balance
+    FROM flux_rollup
+) b
+WHERE r.account = b.account AND r.grain = b.grain AND r.period_start = b.period_start
+  AND r.year >= :since_year
+"""
+
+
+def ensure_date_dim(conn):
+    """Creates date_dim if needed and makes sure it covers every ledger date."""
+    conn.execute(text(DATE_DIM_SQL))
+    first, last = conn.execute(text("SELECT MIN(entry_date), MAX(entry_date) FROM gl_entries")).one()
+    if first is None:
+        return 0
+    covered = conn.execute(
+        text("SELECT COUNT(*) FROM date_dim WHERE date BETWEEN :first AND :last"), {"first": first, "last": last},
+    ).scalar()
+    if covered == (last - first).days + 1:
+        return 0
+    added = conn.execute(text(DATE_DIM_FILL_SQL), {
+        "first_date": f"{first.year - 1}-01-01", "last_date": f"{max(last.year, 2050)}-12-31",
+    }).rowcount
+    logger.info(f"date_dim extended by {added:,} days.")
+    return added
+
+
+def build_rollup(conn, since_year=None):
+    """Rebuilds flux_rollup (account x month/quarter/year) from gl_entries.
+
+    since_year=None rebuilds every period; otherwise only periods in years
+    >= since_year are re-aggregated and their running balances re-chained.
+    Returns the number of cube rows written.
+    """
+    conn.execute(text(ROLLUP_TABLE_SQL))
+    ensure_date_dim(conn)
+    if since_year is not None and not conn.execute(text("SELECT EXISTS (SELECT 1 FROM flux_rollup);")).scalar():
+        since_year = None
+
+    if since_year is None:
+        conn.execute(text("TRUNCATE TABLE flux_rollup;"))
+        year_filter = ""
+    else:
+        conn.execute(text("DELETE FROM flux_rollup WHERE year >= :since_year;"), {"since_year": since_year})
+        year_filter = "AND g.year >= :since_year"
+
+    rows = conn.execute(text(ROLLUP_MOVEMENTS_SQL.format(year_filter=year_filter)), {"since_year": since_year}).rowcount
+    conn.execute(text(ROLLUP_BALANCES_SQL), {"since_year": since_year if since_year is not None else -1})
+    logger.info(f"Rollup cube refreshed ({'all years' if since_year is None else f'years >= {since_year}'}): "
+                f"{rows:,} period rows.")
+    return rows
+
+
+def read_rollup(conn, grain='month', accounts=None, year=None):
+    """Movements and running balances at one grain, for drill-down reads (index lookups on the cube)."""
+    if grain not in ROLLUP_GRAINS:
+        raise ValueError(f"Unknown grain {grain}; choose from {ROLLUP_GRAINS}")
+    sql = "SELECT account, period_start, year, quarter, month, movement, running_balance FROM flux_rollup WHERE grain = :grain"
+    params = {"grain": grain}
+    if accounts is not None:
+        sql += " AND account = ANY(:accounts)"
+        params["accounts"] = list(accounts)
+    if year is not None:
+        sql += " AND period_start >= MAKE_DATE(:year, 1, 1) AND period_start < MAKE_DATE(:year + 1, 1, 1)"
+        params["year"] = year
+    return pd.read_sql_query(text(sql + " ORDER BY account, period_start"), conn, params=params)
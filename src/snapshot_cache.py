@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from utils import get_connection, get_raw_connection, logger, table_exists
+from dag import table_fingerprint
+from statements import SNAPSHOT_COLUMNS, normalize_snapshot
+
+CACHE_DIR = os.path.join(
+    os.getenv("SNAPSHOT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'snapshot_cache')),
+    # One cache per entity schema (see entities.py)
+    os.getenv("DB_SCHEMA") or '',
+)
+CACHE_MAX_BYTES = int(os.getenv("SNAPSHOT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+CACHE_MAX_AGE_SECONDS = int(os.getenv("SNAPSHOT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+VERSION_FILE = 'CURRENT'
+
+# Tables and views the cache can serve (None = every column)
+CACHED_TABLES = dict(
+    SNAPSHOT_COLUMNS,
+    dashboard_flux_analysis=None,
+    gl_entries=['year', 'month', 'account', 'amount', 'source_table'],
+)
+NUMERIC_TYPES = ('numeric', 'double', 'real', 'integer', 'bigint', 'smallint')
+
+COLUMN_TYPES_SQL = """
+    SELECT attname, format_type(atttypid, atttypmod)
+    FROM pg_attribute
+    WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped
+    ORDER BY attnum
+"""
+
+
+def data_version(conn):
+    """Fingerprint of the data the pipeline last built.
+
+    The DAG stores an input hash per node after every successful run (and
+    drops it on failure), so the hashes together change exactly when a
+    rerun may have changed a table. Without DAG state the raw tables are
+    fingerprinted directly.
+    """
+    if table_exists(conn, 'dag_node_state'):
+        rows = conn.execute(text("SELECT node, input_hash FROM dag_node_state ORDER BY node")).fetchall()
+        parts = [f"{node}:{digest}" for node, digest in rows]
+    else:
+        parts = [table_fingerprint(conn, table) for table in SNAPSHOT_COLUMNS]
+    return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def stamp_data_version():
+    """Records the database's current data version for readers; run_pipeline() calls it after every run."""
+    with get_connection() as conn:
+        version = data_version(conn)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = os.path.join(CACHE_DIR, f"{VERSION_FILE}.{os.getpid()}")
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(CACHE_DIR, VERSION_FILE))
+    logger.info(f"Snapshot cache: data version {version}.")
+    evict()
+    return version
+
+
+def cache_enabled():
+    """Readers fall back to querying the database when SNAPSHOT_CACHE=0."""
+    return os.getenv("SNAPSHOT_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+def current_version(verify=False):
+    """The stamped data version; asks the database only when there is no stamp or verify=True."""
+    path = os.path.join(CACHE_DIR, VERSION_FILE)
+    if not verify and os.path.exists(path):
+        with open(path) as f:
+            return f.read().strip()
+    return stamp_data_version()
+
+
+def column_types(conn, table, columns=None):
+    """PostgreSQL types of a table's or (materialized) view's columns, in table order."""
+    types = dict(conn.execute(text(COLUMN_TYPES_SQL), {"table": table}).fetchall())
+    if not types:
+        raise ValueError(f"Table {table} does not exist")
+    return {column: types[column] for column in (columns or types)}
+
+
+def _to_array(values, pg_type):
+    """Converts one exported column to a fixed-width array np.load can memory-map, plus its null mask."""
+    nulls = values.isna().to_numpy()
+    if pg_type.startswith(('timestamp', 'date')):
+        dates = pd.to_datetime(values, utc='with time zone' in pg_type)
+        if 'with time zone' in pg_type:
+            dates = dates.dt.tz_localize(None)
+        return dates.to_numpy(dtype='datetime64[ns]'), None
+    if pg_type.startswith(('numeric', 'double', 'real')):
+        return values.to_numpy(dtype=float), None
+    if pg_type in ('integer', 'bigint', 'smallint'):
+        return (values.to_numpy(dtype=float), None) if nulls.any() else (values.to_numpy(dtype=np.int64), None)
+    if pg_type == 'boolean':
+        return values.fillna(False).to_numpy(dtype=bool), (nulls if nulls.any() else None)
+    return values.fillna('').to_numpy(dtype=str), (nulls if nulls.any() else None)
+
+
+def _fetch_table(table):
+    """The cached columns of a table and their PostgreSQL types, read with one COPY."""
+    with get_connection() as conn:
+        types = column_types(conn, table, CACHED_TABLES.get(table))
+    columns = list(types)
+
+    # COPY is several times faster than fetching rows through the cursor
+    with tempfile.TemporaryFile() as spool:
+        with get_raw_connection() as raw_conn:
+            with raw_conn.cursor() as cur:
+                cur.copy_expert(
+                    f"COPY (SELECT {', '.join(columns)} FROM {table}) TO STDOUT WITH (FORMAT csv, HEADER)",
+                    spool,
+                )
+        spool.seek(0)
+        text_columns = [column for column, pg_type in types.items() if not pg_type.startswith(NUMERIC_TYPES)]
+        frame = pd.read_csv(spool, dtype={column: object for column in text_columns}, keep_default_na=False,
+                            na_values={column: [''] for column in columns})
+    return frame, types
+
+
+def write_table(table, frame, types, version):
+    """Stores a frame under CACHE_DIR/<version>/<table>/ as one .npy file per column plus meta.json."""
+    target = os.path.join(CACHE_DIR, version, table)
+    # Written next to the target and renamed, so readers never see half a table
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{table}.", dir=os.path.dirname(target))
+    meta = {"table": table, "rows": len(frame), "columns": [], "created_at": time.time()}
+    for column, pg_type in types.items():
+        values, nulls = _to_array(frame[column], pg_type)
+        np.save(os.path.join(staging, f"{column}.npy"), values)
+        if nulls is not None:
+            np.save(os.path.join(staging, f"{column}.nulls.npy"), nulls)
+        meta["columns"].append({"name": column, "type": pg_type, "nulls": nulls is not None})
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.rename(staging, target)
+    except OSError:
+        # Another process published the same version first
+        shutil.rmtree(staging, ignore_errors=True)
+    return target
+
+
+def export_table(table, version):
+    """Copies a table out of the database into the cache under the given data version."""
+    started = time.perf_counter()
+    frame, types = _fetch_table(table)
+    target = write_table(table, frame, types, version)
+    logger.info(f"Snapshot cache: exported {table} ({len(frame):,} rows) in {time.perf_counter() - started:.2f}s.")
+    evict()
+    return target
+
+
+def read_columns(table, columns=None, version=None):
+    """Memory-mapped column arrays of a cached table, exporting it first on a miss.
+
+    Numeric and date columns are zero-copy views of the files. Returns
+    ({column: array}, {column: null mask}) for the requested columns.
+    """
+    if table not in CACHED_TABLES:
+        raise ValueError(f"Table {table} is not cached; choose from {sorted(CACHED_TABLES)}")
+    version = version or current_version()
+    path = os.path.join(CACHE_DIR, version, table)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        export_table(table, version)
+    # Marks the version as recently used for eviction
+    os.utime(os.path.join(CACHE_DIR, version))
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays, nulls = {}, {}
+    for column in meta["columns"]:
+        name = column["name"]
+        if columns is not None and name not in columns:
+            continue
+        arrays[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+        if column["nulls"]:
+            nulls[name] = np.load(os.path.join(path, f"{name}.nulls.npy"), mmap_mode='r')
+    return arrays, nulls
+
+
+def read_frame(table, columns=None, filters=None, sort_by=None, version=None):
+    """DataFrame from the snapshot cache, for use in place of pd.read_sql_query.
+
+    filters maps a column to the values to keep (like WHERE col IN (...));
+    sort_by is a column or list of columns (like ORDER BY).
+    """
+    needed = None if columns is None else list(columns) + [c for c in (filters or {}) if c not in columns]
+    arrays, nulls = read_columns(table, needed, version)
+    keep = None
+    for column, values in (filters or {}).items():
+        match = np.isin(arrays[column], list(values))
+        keep = match if keep is None else keep & match
+
+    data = {}
+    for name in (columns or list(arrays)):
+        values = arrays[name] if keep is None else arrays[name][keep]
+        if name in nulls:
+            mask = nulls[name] if keep is None else nulls[name][keep]
+            values = pd.Series(values, dtype=object).mask(mask)
+        data[name] = values
+    frame = pd.DataFrame(data, copy=False)
+    if sort_by is not None:
+        frame = frame.sort_values(sort_by, kind='stable', ignore_index=True)
+    return frame
+
+
+def load_snapshot():
+    """The raw-table snapshot statements.compute_flux_statement() takes, read from the cache."""
+    return normalize_snapshot({table: read_frame(table, columns) for table, columns in SNAPSHOT_COLUMNS.items()})
+
+
+def _tree_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files
+    )
+
+
+def evict(max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE_SECONDS):
+    """Drops snapshot versions unused for max_age seconds, then the least recently used ones over max_bytes.
+
+    The stamped current version is never evicted. Returns the versions removed.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    version_path = os.path.join(CACHE_DIR, VERSION_FILE)
+    current = open(version_path).read().strip() if os.path.exists(version_path) else None
+    versions = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if os.path.isdir(path) and name != current:
+            versions.append((os.path.getmtime(path), name, _tree_size(path)))
+    total = _tree_size(CACHE_DIR)
+
+    removed = []
+    now = time.time()
+    for used_at, name, size in sorted(versions):
+        if now - used_at <= max_age and total <= max_bytes:
+            break
+        shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+        total -= size
+        removed.append(name)
+    if removed:
+        logger.info(f"Snapshot cache: evicted {len(removed)} version(s), {total / 1024 ** 2:,.1f} MB kept.")
+    return removed
@@ -0,0 +1,287 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from utils import get_backend, get_connection, logger, table_exists
+from dag import dependencies, DEFAULT_WORKERS
+from ingest import iter_statements
+from instrumentation import pipeline_run, stage
+
+SQL_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sql_files')
+
+ASSET_STATE_SQL = """
+CREATE TABLE IF NOT EXISTS sql_asset_state (
+    asset VARCHAR PRIMARY KEY,
+    kind VARCHAR NOT NULL,
+    sql_hash VARCHAR NOT NULL,
+    source_counters TEXT NOT NULL,
+    action VARCHAR NOT NULL,
+    seconds NUMERIC,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Rows inserted, updated and deleted over a table and all its partitions since
+# the statistics were last reset; TRUNCATE-and-reload still counts its inserts.
+# SUM over bigint is numeric, hence the cast: the counters are stored as JSON
+MODIFICATION_COUNTER_SQL = """
+    SELECT CAST(COALESCE(SUM(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0) AS BIGINT)
+    FROM pg_partition_tree(CAST(:table AS regclass)) t
+    JOIN pg_stat_user_tables s ON s.relid = t.relid
+"""
+
+# REFRESH ... CONCURRENTLY needs a unique index on plain columns, without a predicate
+HAS_UNIQUE_INDEX_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_index i
+        WHERE i.indrelid = to_regclass(:name) AND i.indisunique
+          AND i.indpred IS NULL AND i.indexprs IS NULL
+    )
+"""
+
+MATVIEW_RE = re.compile(r'\bCREATE\s+MATERIALIZED\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:\w+\.)?(\w+)', re.IGNORECASE)
+TABLE_RE = re.compile(r'\bCREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:\w+\.)?(\w+)', re.IGNORECASE)
+# "-- unique: year" in an asset file: the view gets a unique index on those columns
+UNIQUE_RE = re.compile(r'^\s*--\s*unique:\s*([\w, ]+)$', re.IGNORECASE | re.MULTILINE)
+COMMENT_RE = re.compile(r'--[^\n]*')
+# EXTRACT(YEAR FROM x) and SUBSTRING(x FROM n) are not table references
+FUNCTION_FROM_RE = re.compile(r'\b(EXTRACT|SUBSTRING|TRIM)\s*\(\s*[\w.]+\s+FROM\b', re.IGNORECASE)
+CTE_RE = re.compile(r'(?:\bWITH\s+|,\s*)(\w+)\s+AS\s*(?:NOT\s+)?(?:MATERIALIZED\s*)?\(', re.IGNORECASE)
+# A name after FROM/JOIN that isn't a function call such as generate_series(...)
+SOURCE_RE = re.compile(r'\b(?:FROM|JOIN)\s+(?:\w+\.)?([a-z_]\w*)\b(?!\s*\()', re.IGNORECASE)
+
+
+class SqlAsset:
+    """One file of sql_files/: the object it creates and the tables it reads.
+
+    kind is 'materialized_view', 'table' or 'query' (a report with nothing
+    to create, listed but never run). owned means the pipeline builds the
+    table itself; the registry then only creates it when it is missing.
+    """
+
+    def __init__(self, path, kind, name, sources, unique_key=None, owned=False):
+        self.path = path
+        self.kind = kind
+        self.name = name
+        self.sources = tuple(sources)
+        self.unique_key = unique_key
+        self.owned = owned
+        with open(path, 'rb') as f:
+            self.sql_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+
+    # The interface dag.dependencies() reads
+    @property
+    def inputs(self):
+        return self.sources
+
+    @property
+    def outputs(self):
+        return (self.name,)
+
+
+def table_references(sql):
+    """Tables a statement reads (FROM/JOIN targets that are not its own CTEs or functions)."""
+    sql = FUNCTION_FROM_RE.sub(r'\1(', COMMENT_RE.sub('', sql))
+    ctes = {name.lower() for name in CTE_RE.findall(sql)}
+    return sorted({name.lower() for name in SOURCE_RE.findall(sql)} - ctes)
+
+
+def pipeline_tables():
+    """Tables run_pipeline() builds, which the registry must not rebuild with the sql_files versions."""
+    from main import pipeline_nodes
+    tables = {table for node in pipeline_nodes() for table in node.outputs}
+    # rollup.ensure_date_dim() keeps date_dim indexed and extended past date.sql's range
+    return tables | {'date_dim'}
+
+
+def discover(directory=SQL_FILES_DIR):
+    """Every SQL asset in the directory (files with or without a .sql suffix), keyed by object name."""
+    owned = pipeline_tables()
+    assets = {}
+    for file_name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, file_name)
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            sql = f.read()
+        body = COMMENT_RE.sub('', sql)
+        matview, table = MATVIEW_RE.search(body), TABLE_RE.search(body)
+        if matview:
+            kind, name = 'materialized_view', matview.group(1).lower()
+        elif table:
+            kind, name = 'table', table.group(1).lower()
+        else:
+            kind, name = 'query', os.path.splitext(file_name)[0]
+        unique = UNIQUE_RE.search(sql)
+        sources = [source for source in table_references(sql) if source != name]
+        assets[name] = SqlAsset(path, kind, name, sources,
+                                unique_key=unique.group(1).strip() if unique else None,
+                                owned=kind != 'query' and name in owned)
+    return assets
+
+
+def topological_waves(assets):
+    """Assets grouped into waves; every asset comes after the assets producing its sources."""
+    deps = dependencies(assets)
+    done, waves = set(), []
+    while len(done) < len(assets):
+        wave = sorted(name for name in deps if name not in done and deps[name] <= done)
+        if not wave:
+            raise ValueError(f"Dependency cycle among SQL assets {sorted(set(deps) - done)}")
+        waves.append(wave)
+        done.update(wave)
+    return waves
+
+
+def modification_counters(conn, tables):
+    """{table: rows modified so far (int)}, None for a table that doesn't exist."""
+    return {
+        table: int(conn.execute(text(MODIFICATION_COUNTER_SQL), {"table": table}).scalar())
+        if table_exists(conn, table) else None
+        for table in tables
+    }
+
+
+def asset_status(conn, asset, state):
+    """('missing' | 'changed' | 'stale' | 'fresh', current source counters) for one asset.
+
+    changed: the file was edited since the asset was built; stale: one of
+    its source tables was modified since (its counter moved, or statistics
+    were reset).
+    """
+    counters = modification_counters(conn, asset.sources)
+    if not table_exists(conn, asset.name):
+        return 'missing', counters
+    if state is None or state['sql_hash'] != asset.sql_hash:
+        return 'changed', counters
+    if json.loads(state['source_counters']) != counters:
+        return 'stale', counters
+    return 'fresh', counters
+
+
+def _run_file(conn, asset):
+    # The scripts drop and create their own object; statements run one by one
+    with open(asset.path, 'rb') as handle:
+        for _, statement, _ in iter_statements(handle):
+            conn.execute(text(statement))
+    if asset.kind == 'materialized_view' and asset.unique_key:
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {asset.name}_unique_idx "
+                          f"ON {asset.name} ({asset.unique_key})"))
+
+
+def refresh_asset(asset, state=None, force=False):
+    """Creates, rebuilds or refreshes one asset as its status requires; returns (action, seconds).
+
+    Materialized views are refreshed CONCURRENTLY when they have a unique
+    index (readers are never blocked), plainly otherwise; tables are rebuilt
+    by re-running their file. Everything, including the new state row,
+    commits at once.
+    """
+    started = time.perf_counter()
+    with get_connection() as conn, stage(asset.name):
+        status, counters = asset_status(conn, asset, state)
+        if force and status == 'fresh':
+            status = 'stale'
+
+        if status == 'fresh' or (asset.owned and status != 'missing'):
+            action = 'fresh' if status == 'fresh' else 'owned'
+            conn.rollback()
+            return action, 0.0
+        if status == 'missing':
+            action = 'created'
+            _run_file(conn, asset)
+        elif asset.kind == 'materialized_view' and status == 'stale':
+            concurrent = conn.execute(text(HAS_UNIQUE_INDEX_SQL), {"name": asset.name}).scalar()
+            action = 'refreshed_concurrently' if concurrent else 'refreshed'
+            conn.execute(text(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrent else ''}{asset.name}"))
+        else:
+            action = 'rebuilt'
+            if asset.kind == 'materialized_view':
+                conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {asset.name}"))
+            _run_file(conn, asset)
+
+        seconds = time.perf_counter() - started
+        conn.execute(text(ASSET_STATE_SQL))
+        conn.execute(text("""
+            INSERT INTO sql_asset_state (asset, kind, sql_hash, source_counters, action, seconds, refreshed_at)
+            VALUES (:asset, :kind, :sql_hash, :counters, :action, :seconds, CURRENT_TIMESTAMP)
+            ON CONFLICT (asset) DO UPDATE
+            SET kind = EXCLUDED.kind, sql_hash = EXCLUDED.sql_hash, source_counters = EXCLUDED.source_counters,
+                action = EXCLUDED.action, seconds = EXCLUDED.seconds, refreshed_at = EXCLUDED.refreshed_at
+        """), {"asset": asset.name, "kind": asset.kind, "sql_hash": asset.sql_hash,
+               "counters": json.dumps(counters, sort_keys=True), "action": action, "seconds": round(seconds, 3)})
+        conn.commit()
+    return action, seconds
+
+
+def read_state():
+    with get_connection() as conn:
+        conn.execute(text(ASSET_STATE_SQL))
+        conn.commit()
+        rows = conn.execute(text("SELECT asset, sql_hash, source_counters FROM sql_asset_state")).mappings().all()
+    return {row['asset']: dict(row) for row in rows}
+
+
+def refresh_assets(names=None, max_workers=DEFAULT_WORKERS, force=False, directory=SQL_FILES_DIR):
+    """Brings the sql_files objects up to date, wave by wave, each wave's assets on concurrent connections.
+
+    names limits the run to some assets; force refreshes assets that look
+    fresh. An asset whose upstream asset failed is not run. Returns
+    {asset: {'action': ..., 'seconds': ...}}.
+    """
+    if get_backend() == 'sqlite':
+        logger.error("[sql_assets] The sql_files assets are PostgreSQL SQL; nothing to do on SQLite.")
+        return {}
+    assets = {name: asset for name, asset in discover(directory).items()
+              if asset.kind != 'query' and (names is None or name in names)}
+    state = read_state()
+    deps = dependencies(assets.values())
+    results = {}
+
+    started = time.perf_counter()
+    for wave in topological_waves(assets.values()):
+        runnable = []
+        for name in wave:
+            if any(results.get(dep, {}).get('action') in ('failed', 'blocked') for dep in deps[name]):
+                results[name] = {'action': 'blocked', 'seconds': 0.0}
+            else:
+                runnable.append(name)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sql_assets') as pool:
+            futures = {name: pool.submit(refresh_asset, assets[name], state.get(name), force) for name in runnable}
+            for name, future in futures.items():
+                try:
+                    action, seconds = future.result()
+                except Exception as e:
+                    logger.error(f"[sql_assets] {name} failed: {e}")
+                    action, seconds = 'failed', 0.0
+                results[name] = {'action': action, 'seconds': round(seconds, 3)}
+
+    for name, result in results.items():
+        logger.info(f"[sql_assets] {name}: {result['action']} ({result['seconds']:.2f}s)")
+    logger.info(f"[sql_assets] {len(results)} assets in {time.perf_counter() - started:.2f}s.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and refresh the sql_files views and tables.")
+    parser.add_argument("assets", nargs="*", help="asset names (default: all)")
+    parser.add_argument("--list", action="store_true", help="show the assets, their sources and waves")
+    parser.add_argument("--force", action="store_true", help="refresh assets even when they look fresh")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    if args.list:
+        assets = discover()
+        for name, asset in sorted(assets.items()):
+            flags = ' (pipeline-owned)' if asset.owned else ''
+            print(f"{name:28} {asset.kind:18} <- {', '.join(asset.sources) or '-'}{flags}")
+        managed = [asset for asset in assets.values() if asset.kind != 'query']
+        for number, wave in enumerate(topological_waves(managed), 1):
+            print(f"wave {number}: {', '.join(wave)}")
+    else:
+        with pipeline_run("sql_assets"):
+            refresh_assets(args.assets or None, max_workers=args.workers, force=args.force)
@@ -0,0 +1,444 @@
+import os
+import re
+import time
+import pandas as pd
+from sqlalchemy import text
+from utils import get_connection, get_raw_connection, logger
+from costing import COSTING_METHODS, DEFAULT_COSTING_METHOD, PRODUCT_COST_TABLE_SQL, SALES_COST_JOIN, sales_cost_source
+from depreciation import DEFAULT_DEPRECIATION_METHOD, DEFAULT_USEFUL_LIFE, SCHEDULE_TABLE_SQL, depreciation_schedule
+from ingest import INSERT_RE, LEADING_COMMENT_RE, BULK_BATCH_ROWS, iter_statements, parse_values
+from instrumentation import stage
+from ledger import GL_TABLE_SQL
+from rollup import ROLLUP_TABLE_SQL
+
+# The pipeline stages for an embedded SQLite database: the same tables and
+# statement as on PostgreSQL, with the SQL written for SQLite (date()
+# modifiers instead of INTERVAL, UNION ALL instead of LATERAL VALUES and
+# GROUPING SETS, a plain table instead of the materialized view). Every
+# stage rebuilds all years; incremental loads and refreshes are PostgreSQL
+# only.
+
+RAW_TABLES = ('loans', 'sales', 'purchases', 'payments', 'shifts',
+              'equipment_depreciation_schedule', 'expense_accrual_schedule')
+# PostgreSQL column types SQLite can't auto-increment: "id INTEGER PRIMARY KEY" is the rowid
+SERIAL_RE = re.compile(r'\b(BIG|SMALL)?SERIAL\b', re.IGNORECASE)
+CASCADE_RE = re.compile(r'\s+CASCADE\s*$', re.IGNORECASE)
+
+ACCRUAL_TABLE_SQL = ("CREATE TABLE IF NOT EXISTS expense_accrual_schedule "
+                     "(id INT, account VARCHAR, amount NUMERIC, accrual_date DATE, cash_payment_date DATE)")
+
+# pipeline.ACCRUAL_SQL: booked on the first day of the month before the payment
+ACCRUAL_SQL = """
+    INSERT INTO expense_accrual_schedule (id, account, amount, accrual_date, cash_payment_date)
+    SELECT id, payment_type, amount, date(payment_date, 'start of month', '-1 month'), date(payment_date)
+    FROM payments
+    WHERE payment_type IN ('wage', 'utility', 'tax')
+      AND payment_date >= '2021-01-01' AND payment_date < '2024-01-01'
+"""
+
+# costing.DATED_COST_SQL; '0000-01-01' / '9999-12-31' and 9e999 (infinity)
+# stand in for the open ends. CAST AS REAL keeps the average a float division.
+DATED_COST_SQL = """
+INSERT INTO product_cost (product_name, method, valid_from, valid_to, qty_from, qty_to, unit_cost)
+SELECT
+    product_name,
+    :method,
+    CASE WHEN rn = 1 THEN '0000-01-01' ELSE day END,
+    COALESCE(next_day, '9999-12-31'),
+    0,
+    9e999,
+    unit_cost
+FROM (
+    SELECT
+        product_name,
+        day,
+        CASE WHEN :method = 'latest' THEN last_price
+             ELSE SUM(value) OVER w / NULLIF(SUM(qty) OVER w, 0)
+        END AS unit_cost,
+        ROW_NUMBER() OVER w AS rn,
+        LEAD(day) OVER w AS next_day
+    FROM (
+        SELECT
+            product_name,
+            day,
+            MAX(CASE WHEN last_rank = 1 THEN amount END) AS last_price,
+            SUM(quantity) AS qty,
+            SUM(quantity * CAST(amount AS REAL)) AS value
+        FROM (
+            SELECT product_name, date(purchase_at) AS day, quantity, amount,
+                ROW_NUMBER() OVER (PARTITION BY product_name, date(purchase_at)
+                                   ORDER BY purchase_at DESC, id DESC) AS last_rank
+            FROM purchases
+            WHERE purchase_at IS NOT NULL
+        ) ranked
+        GROUP BY product_name, day
+    ) daily
+    WINDOW w AS (PARTITION BY product_name ORDER BY day)
+) priced
+"""
+
+# costing.FIFO_COST_SQL
+FIFO_COST_SQL = """
+INSERT INTO product_cost (product_name, method, valid_from, valid_to, qty_from, qty_to, unit_cost)
+SELECT
+    product_name,
+    'fifo',
+    '0000-01-01',
+    '9999-12-31',
+    qty_from,
+    CASE WHEN rev_rn = 1 THEN 9e999 ELSE qty_to END,
+    unit_cost
+FROM (
+    SELECT
+        product_name,
+        amount AS unit_cost,
+        SUM(quantity) OVER w - quantity AS qty_from,
+        SUM(quantity) OVER w AS qty_to,
+        ROW_NUMBER() OVER (PARTITION BY product_name ORDER BY purchase_at DESC, id DESC) AS rev_rn
+    FROM purchases
+    WINDOW w AS (PARTITION BY product_name ORDER BY purchase_at, id ROWS UNBOUNDED PRECEDING)
+) layers
+"""
+
+# PostgreSQL's "+ INTERVAL '1 month'" clamps to the month's last day (Jan 31 -> Feb 28);
+# SQLite's '+1 month' would roll over into March
+NEXT_MONTH = "MIN(date({column}, '+1 month'), date({column}, 'start of month', '+2 months', '-1 day'))"
+
+# ledger.GL_POSTINGS_SQL, one SELECT per posting. Sales are costed once, in a
+# materialized CTE, and every posting reads that.
+GL_POSTINGS_SQL = {
+    'sales': f"""
+        WITH s AS MATERIALIZED (
+            SELECT s.*, pc.unit_cost
+            FROM {{sales_source}} s
+            LEFT JOIN product_cost pc ON {{cost_join}}
+        )
+        SELECT id, 'Revenue' AS account, date(sale_at) AS entry_date, quantity * price AS amount FROM s
+        UNION ALL
+        SELECT id, 'Cash',
+            CASE WHEN payment_method = 'cash' THEN date(sale_at) ELSE {NEXT_MONTH.format(column='sale_at')} END,
+            quantity * price
+        FROM s
+        UNION ALL
+        SELECT id, 'COGS', date(sale_at), -(quantity * unit_cost) FROM s
+        UNION ALL
+        SELECT id, 'Inventory', date(sale_at), -(quantity * unit_cost) FROM s
+        UNION ALL
+        -- Year-end unpaid sales
+        SELECT id, 'Accounts_Receivable',
+            CASE WHEN payment_method <> 'cash' AND strftime('%m', payment_at) = '12' THEN date(payment_at) END,
+            price * quantity
+        FROM s
+    """,
+    'purchases': f"""
+        SELECT id, 'Cash' AS account,
+            CASE WHEN payment_method = 'cash' THEN date(purchase_at)
+                 ELSE {NEXT_MONTH.format(column='purchase_at')} END AS entry_date,
+            -(quantity * amount) AS amount
+        FROM purchases
+        UNION ALL
+        SELECT id, 'Inventory', date(purchase_at), amount * quantity FROM purchases
+    """,
+    'loans': """
+        SELECT id, 'Cash' AS account, date(loan_at) AS entry_date, value AS amount FROM loans
+        UNION ALL
+        SELECT id, 'Loan_Principal', date(loan_at), value FROM loans
+    """,
+    'payments': """
+        -- Operating cash out (equipment and loan principal excluded)
+        SELECT id, 'Cash' AS account, date(payment_date) AS entry_date, -amount AS amount
+        FROM payments WHERE payment_type IN ('interest', 'wage', 'utility', 'tax', 'rent')
+        UNION ALL
+        SELECT id, 'Loan_Principal', date(payment_date), -amount FROM payments WHERE payment_type = 'loan'
+        UNION ALL
+        -- Rent hits the P&L directly
+        SELECT id, 'rent', date(payment_date), -amount FROM payments WHERE payment_type = 'rent'
+    """,
+    'expense_accrual_schedule': """
+        SELECT id, account, accrual_date AS entry_date, -amount AS amount FROM expense_accrual_schedule
+        UNION ALL
+        SELECT id, 'Accounts_Payable', accrual_date, amount FROM expense_accrual_schedule
+        UNION ALL
+        SELECT id, 'Accounts_Payable', cash_payment_date, -amount FROM expense_accrual_schedule
+    """,
+    'equipment_depreciation_schedule': """
+        SELECT id, 'Depr_Exp' AS account, printf('%04d-12-31', year) AS entry_date,
+            -annual_depreciation_expense AS amount
+        FROM equipment_depreciation_schedule
+        UNION ALL
+        SELECT id, 'PPE_Snapshot', printf('%04d-12-31', year), gross_val FROM equipment_depreciation_schedule
+    """,
+}
+
+GL_INSERT_SQL = """
+    INSERT INTO gl_entries (entry_date, year, month, account, amount, source_table, source_id)
+    SELECT
+        entry_date,
+        CAST(strftime('%Y', entry_date) AS INT),
+        CAST(strftime('%m', entry_date) AS INT),
+        account,
+        amount,
+        '{source_table}',
+        id
+    FROM ({postings}) postings
+    WHERE entry_date IS NOT NULL AND amount IS NOT NULL
+"""
+
+MOVEMENTS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS flux_yearly_movements (
+    year INT NOT NULL,
+    account VARCHAR NOT NULL,
+    annual_movement NUMERIC,
+    PRIMARY KEY (year, account)
+)
+"""
+
+# rollup.ROLLUP_MOVEMENTS_SQL and ROLLUP_BALANCES_SQL: the three grains as a
+# UNION ALL, periods derived from the ledger's year and month (no date_dim)
+ROLLUP_SQL = """
+INSERT INTO flux_rollup (account, grain, period_start, year, quarter, month, movement, running_balance)
+SELECT account, grain, period_start, year, quarter, month, movement,
+    SUM(movement) OVER (PARTITION BY account, grain ORDER BY period_start)
+FROM (
+    SELECT account, 'month' AS grain, printf('%04d-%02d-01', year, month) AS period_start,
+        year, (month + 2) / 3 AS quarter, month, SUM(amount) AS movement
+    FROM gl_entries GROUP BY account, year, month
+    UNION ALL
+    SELECT account, 'quarter', printf('%04d-%02d-01', year, (month - 1) / 3 * 3 + 1),
+        year, (month + 2) / 3, NULL, SUM(amount)
+    FROM gl_entries GROUP BY account, year, (month + 2) / 3
+    UNION ALL
+    SELECT account, 'year', printf('%04d-01-01', year), year, NULL, NULL, SUM(amount)
+    FROM gl_entries GROUP BY account, year
+) periods
+"""
+
+STATEMENT_TABLE_SQL = """
+CREATE TABLE dashboard_flux_analysis (
+    year INT PRIMARY KEY,
+    revenue NUMERIC,
+    net_income NUMERIC,
+    cash NUMERIC,
+    accounts_receivable NUMERIC,
+    accounts_payable NUMERIC,
+    debt_remaining NUMERIC,
+    inventory NUMERIC,
+    gross_ppe NUMERIC,
+    net_ppe NUMERIC
+)
+"""
+
+# flux_api.FLUX_FUNCTIONS_SQL: flux_statement(0, end_year)
+STATEMENT_SQL = """
+INSERT INTO dashboard_flux_analysis
+SELECT
+    y.year,
+    -- P&L: Includes Revenue, COGS, Depreciation, and Operating Accounts
+    ROUND(COALESCE(MAX(y.annual_movement) FILTER (WHERE y.account = 'Revenue'), 0), 2),
+    ROUND(SUM(y.annual_movement) FILTER (
+        WHERE y.account IN ('Revenue', 'COGS', 'Depr_Exp', 'interest', 'wage', 'tax', 'rent', 'utility')
+    ), 2),
+
+    -- BALANCE SHEET: Current Assets & Liabilities
+    ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Cash'), 0), 2),
+    ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Accounts_Receivable'), 0), 2),
+    ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Accounts_Payable'), 0), 2),
+
+    -- Long-Term Liabilities
+    ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Loan_Principal'), 0), 2),
+
+    -- CURRENT ASSETS
+    ROUND(COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Inventory'), 0), 2),
+
+    -- FIXED ASSETS: Net PPE calculation
+    ROUND(COALESCE(MAX(y.annual_movement) FILTER (WHERE y.account = 'PPE_Snapshot'), 0), 2),
+    ROUND(MAX(0,
+        COALESCE(MAX(y.annual_movement) FILTER (WHERE y.account = 'PPE_Snapshot'), 0) +
+        COALESCE(MAX(y.running_balance) FILTER (WHERE y.account = 'Depr_Exp'), 0)
+    ), 2)
+FROM (
+    SELECT year, account, annual_movement,
+        SUM(annual_movement) OVER (PARTITION BY account ORDER BY year) AS running_balance
+    FROM flux_yearly_movements
+    WHERE year <= :end_year
+) y
+GROUP BY y.year
+ORDER BY y.year
+"""
+
+
+def _execute_script(conn, sql):
+    # SQLite runs one statement per execute()
+    for statement in sql.split(';'):
+        if statement.strip():
+            conn.execute(text(statement))
+
+
+def _translate(statement):
+    """Rewrites the PostgreSQL DDL of a setup script that SQLite would reject or mis-read."""
+    statement = SERIAL_RE.sub('INTEGER', statement)
+    if statement.upper().startswith('DROP'):
+        statement = CASCADE_RE.sub('', statement)
+    return statement
+
+
+def load_script(sql_file_path, batch_rows=BULK_BATCH_ROWS):
+    """Streams a setup script into SQLite; row INSERTs are parsed and sent with executemany.
+
+    Statements SQLite can't run (SET, ALTER ... OWNER, sequences and other
+    PostgreSQL-only commands) are skipped and counted. Returns {table: rows}.
+    """
+    stats = {}
+    skipped = 0
+    pending = 0
+    with get_raw_connection() as raw_conn:
+        cur = raw_conn.cursor()
+        with open(sql_file_path, 'rb') as handle:
+            for index, statement, _ in iter_statements(handle):
+                statement = LEADING_COMMENT_RE.sub('', statement)
+                match = INSERT_RE.match(statement)
+                rows = None
+                if match:
+                    try:
+                        rows = parse_values(match.group(3))
+                    except ValueError:
+                        rows = None
+                try:
+                    if rows:
+                        table, columns = match.group(1).lower(), match.group(2)
+                        target = f"{table} ({columns})" if columns else table
+                        placeholders = ', '.join(['?'] * len(rows[0]))
+                        cur.executemany(f"INSERT INTO {target} VALUES ({placeholders})", rows)
+                        stats[table] = stats.get(table, 0) + len(rows)
+                        pending += len(rows)
+                    else:
+                        cur.execute(_translate(statement))
+                        pending += 1
+                except Exception as e:
+                    skipped += 1
+                    logger.debug(f"Skipped statement {index} on SQLite: {e}")
+                if pending >= batch_rows:
+                    raw_conn.commit()
+                    pending = 0
+        raw_conn.commit()
+    logger.info("SQLite load: " + ", ".join(f"{table} {rows:,}" for table, rows in sorted(stats.items()))
+                + f"; {skipped} statements skipped.")
+    return stats
+
+
+def extract_load(sql_file_path, batch_rows=BULK_BATCH_ROWS):
+    """pipeline.extract_load() on SQLite: always a full rebuild, so it returns None."""
+    if not os.path.exists(sql_file_path):
+        logger.error(f"SQL file not found at path: {sql_file_path}")
+        return
+    with get_connection() as conn:
+        for table in RAW_TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.commit()
+        logger.info("Database cleaned.")
+    started = time.perf_counter()
+    load_script(sql_file_path, batch_rows)
+    logger.info(f"DONE! SQLite database loaded in {time.perf_counter() - started:.2f}s.")
+
+
+def create_depreciation_schedule(depreciation_method=DEFAULT_DEPRECIATION_METHOD,
+                                 useful_life=DEFAULT_USEFUL_LIFE, life_overrides=None):
+    """Builds equipment_depreciation_schedule with depreciation_schedule(); returns True on success."""
+    with get_connection() as conn:
+        try:
+            with stage("depreciation"):
+                assets = pd.read_sql_query(text(
+                    "SELECT id, payment_date, amount FROM payments "
+                    "WHERE payment_type = 'equipment' AND payment_date IS NOT NULL ORDER BY id"
+                ), conn)
+                lives = [(life_overrides or {}).get(asset_id, useful_life) for asset_id in assets['id'].tolist()]
+                schedule = depreciation_schedule(
+                    assets['id'].to_numpy(), assets['amount'].to_numpy(dtype=float),
+                    pd.to_datetime(assets['payment_date']), depreciation_method, lives,
+                )
+                _execute_script(conn, SCHEDULE_TABLE_SQL)
+                conn.execute(text("DELETE FROM equipment_depreciation_schedule"))
+                if len(schedule):
+                    conn.execute(text(
+                        "INSERT INTO equipment_depreciation_schedule (id, year, gross_val, annual_depreciation_expense) "
+                        "VALUES (:id, :year, :gross_val, :annual_depreciation_expense)"
+                    ), schedule.to_dict('records'))
+                conn.commit()
+            logger.info(f"Depreciation schedule ({depreciation_method}): {len(assets):,} assets, "
+                        f"{len(schedule):,} rows.")
+            return True
+        except Exception as e:
+            logger.error(f"Error building depreciation schedule: {e}")
+            return False
+
+
+def create_accrual_schedule():
+    """Builds expense_accrual_schedule; returns True on success."""
+    with get_connection() as conn:
+        try:
+            conn.execute(text(ACCRUAL_TABLE_SQL))
+            conn.execute(text("DELETE FROM expense_accrual_schedule"))
+            with stage("accruals"):
+                conn.execute(text(ACCRUAL_SQL))
+                conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error creating accrual schedule: {e}")
+            return False
+
+
+def build_gl_entries(conn, costing_method=DEFAULT_COSTING_METHOD):
+    """Rebuilds gl_entries from every source table; returns {source_table: rows written}."""
+    _execute_script(conn, GL_TABLE_SQL)
+    conn.execute(text("DELETE FROM gl_entries"))
+    counts = {}
+    for source_table, postings_sql in GL_POSTINGS_SQL.items():
+        postings = postings_sql.format(sales_source=sales_cost_source(costing_method), cost_join=SALES_COST_JOIN)
+        sql = GL_INSERT_SQL.format(source_table=source_table, postings=postings)
+        counts[source_table] = conn.execute(text(sql)).rowcount
+    logger.info("General ledger rebuilt (all years): "
+                + ", ".join(f"{table} {rows:,}" for table, rows in counts.items()))
+    return counts
+
+
+def create_focus_view(end_year=2023, costing_method=DEFAULT_COSTING_METHOD):
+    """pipeline.create_focus_view() on SQLite: every year is rebuilt and the statement is a table.
+
+    Readers keep seeing the previous statement until the single commit at
+    the end. Returns True on success.
+    """
+    if costing_method not in COSTING_METHODS:
+        raise ValueError(f"Unknown costing method {costing_method!r}; expected one of {COSTING_METHODS}")
+
+    with get_connection() as conn:
+        try:
+            with stage("product_cost"):
+                _execute_script(conn, PRODUCT_COST_TABLE_SQL)
+                conn.execute(text("DELETE FROM product_cost"))
+                cost_sql = FIFO_COST_SQL if costing_method == 'fifo' else DATED_COST_SQL
+                conn.execute(text(cost_sql), {"method": costing_method})
+
+            with stage("gl_entries"):
+                build_gl_entries(conn, costing_method)
+            with stage("movements"):
+                conn.execute(text(MOVEMENTS_TABLE_SQL))
+                conn.execute(text("DELETE FROM flux_yearly_movements"))
+                conn.execute(text("""
+                    INSERT INTO flux_yearly_movements (year, account, annual_movement)
+                    SELECT year, account, SUM(amount) FROM gl_entries GROUP BY 1, 2
+                """))
+            with stage("rollup"):
+                _execute_script(conn, ROLLUP_TABLE_SQL)
+                conn.execute(text("DELETE FROM flux_rollup"))
+                conn.execute(text(ROLLUP_SQL))
+
+            with stage("create_view"):
+                conn.execute(text("DROP TABLE IF EXISTS dashboard_flux_analysis"))
+                conn.execute(text(STATEMENT_TABLE_SQL))
+                conn.execute(text(STATEMENT_SQL), {"end_year": int(end_year)})
+                conn.commit()
+            logger.info(f"Flux analysis rebuilt in SQLite for end_year {end_year}.")
+            return True
+        except Exception as e:
+            logger.error(f"Error during transformations: {e}")
+            return False
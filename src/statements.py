@@ -0,0 +1,211 @@
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from utils import logger
+from costing import DEFAULT_COSTING_METHOD
+from depreciation import DEFAULT_DEPRECIATION_METHOD, DEFAULT_USEFUL_LIFE, depreciation_schedule
+
+# Columns each raw table contributes to the statements
+SNAPSHOT_COLUMNS = {
+    'sales': ['id', 'sale_at', 'product_name', 'quantity', 'price', 'payment_method', 'payment_at'],
+    'purchases': ['id', 'purchase_at', 'product_name', 'quantity', 'amount', 'payment_method'],
+    'payments': ['id', 'payment_date', 'payment_type', 'amount'],
+    'loans': ['id', 'loan_at', 'value'],
+}
+DATE_COLUMNS = ('sale_at', 'payment_at', 'purchase_at', 'payment_date', 'loan_at')
+NUMERIC_COLUMNS = ('quantity', 'price', 'amount', 'value')
+
+OPERATING_CASH_TYPES = ('interest', 'wage', 'utility', 'tax', 'rent')
+ACCRUED_TYPES = ('wage', 'utility', 'tax')
+ACCRUAL_START, ACCRUAL_END = pd.Timestamp('2021-01-01'), pd.Timestamp('2024-01-01')
+NET_INCOME_ACCOUNTS = ('Revenue', 'COGS', 'Depr_Exp', 'interest', 'wage', 'tax', 'rent', 'utility')
+STATEMENT_COLUMNS = [
+    'year', 'revenue', 'net_income', 'cash', 'accounts_receivable', 'accounts_payable',
+    'debt_remaining', 'inventory', 'gross_ppe', 'net_ppe',
+]
+
+
+def normalize_snapshot(snapshot):
+    """Coerces a {table: DataFrame} snapshot to the dtypes the engine works on."""
+    tables = {}
+    for table, columns in SNAPSHOT_COLUMNS.items():
+        frame = snapshot[table][columns].copy()
+        for column in columns:
+            if column in DATE_COLUMNS:
+                frame[column] = pd.to_datetime(frame[column])
+            elif column in NUMERIC_COLUMNS:
+                frame[column] = pd.to_numeric(frame[column]).astype(float)
+        tables[table] = frame
+    return tables
+
+
+def load_snapshot(conn):
+    """Reads the columns the statements need from the raw tables into DataFrames."""
+    return normalize_snapshot({
+        table: pd.read_sql_query(text(f"SELECT {', '.join(columns)} FROM {table}"), conn)
+        for table, columns in SNAPSHOT_COLUMNS.items()
+    })
+
+
+def _lag_year(at, lagged):
+    # Year of at + 1 month: only December rolls into the next year
+    return at.dt.year + (lagged & (at.dt.month == 12)).astype(int)
+
+
+def _dated_unit_cost(sales, purchases, method):
+    # Cost in effect on each sale's date (see costing.DATED_COST_SQL); sales
+    # before a product's first purchase take its first cost
+    p = purchases.dropna(subset=['purchase_at']).sort_values(['purchase_at', 'id'])
+    p = p.assign(day=p['purchase_at'].dt.normalize(), value=p['quantity'] * p['amount'])
+    daily = p.groupby(['product_name', 'day'], sort=True).agg(
+        last_price=('amount', 'last'), qty=('quantity', 'sum'), value=('value', 'sum'),
+    ).reset_index()
+    if method == 'latest':
+        daily['unit_cost'] = daily['last_price']
+    else:
+        grouped = daily.groupby('product_name')
+        daily['unit_cost'] = grouped['value'].cumsum() / grouped['qty'].cumsum().replace(0, np.nan)
+
+    keyed = sales[['sale_at', 'product_name']].reset_index()
+    known = keyed.dropna(subset=['sale_at']).sort_values('sale_at')
+    costs = daily[['day', 'product_name', 'unit_cost']].sort_values('day')
+    matched = pd.merge_asof(known, costs, left_on='sale_at', right_on='day', by='product_name')
+    first = daily.groupby('product_name')['unit_cost'].first()
+    matched['unit_cost'] = matched['unit_cost'].fillna(matched['product_name'].map(first))
+    return matched.set_index('index')['unit_cost'].reindex(sales.index)
+
+
+def _fifo_unit_cost(sales, purchases):
+    # Layer covering the product's cumulative quantity sold before each sale
+    # (see costing.FIFO_COST_SQL); the last layer is open-ended
+    p = purchases.sort_values(['purchase_at', 'id'])
+    p = p.assign(qty_from=p.groupby('product_name')['quantity'].cumsum() - p['quantity'])
+    s = sales.sort_values(['sale_at', 'id'])
+    s = s.assign(position=s.groupby('product_name')['quantity'].cumsum() - s['quantity'])
+
+    keyed = s[['position', 'product_name']].reset_index().sort_values('position')
+    layers = p[['qty_from', 'product_name', 'amount']].sort_values('qty_from')
+    matched = pd.merge_asof(keyed, layers, left_on='position', right_on='qty_from', by='product_name')
+    return matched.set_index('index')['amount'].reindex(sales.index)
+
+
+def unit_costs(sales, purchases, method=DEFAULT_COSTING_METHOD):
+    """Unit cost of every sale under the given costing method (NaN when the product was never purchased)."""
+    if method == 'fifo':
+        return _fifo_unit_cost(sales, purchases)
+    return _dated_unit_cost(sales, purchases, method)
+
+
+def _postings(year, account, amount):
+    frame = pd.DataFrame({'year': year, 'account': account, 'amount': amount})
+    return frame.dropna()
+
+
+def gl_postings(tables, costing_method=DEFAULT_COSTING_METHOD,
+                depreciation_method=DEFAULT_DEPRECIATION_METHOD, useful_life=DEFAULT_USEFUL_LIFE):
+    """The ledger postings of ledger.GL_POSTINGS_SQL as (year, account, amount) rows."""
+    sales, purchases = tables['sales'], tables['purchases']
+    payments, loans = tables['payments'], tables['loans']
+    frames = []
+
+    # Sales: revenue, cash (credit paid a month later), cost of sales, year-end AR
+    revenue = sales['quantity'] * sales['price']
+    cost = sales['quantity'] * unit_costs(sales, purchases, costing_method)
+    sale_year = sales['sale_at'].dt.year
+    on_credit = sales['payment_method'].ne('cash')
+    year_end_unpaid = sales['payment_method'].notna() & on_credit & (sales['payment_at'].dt.month == 12)
+    frames += [
+        _postings(sale_year, 'Revenue', revenue),
+        _postings(_lag_year(sales['sale_at'], on_credit), 'Cash', revenue),
+        _postings(sale_year, 'COGS', -cost),
+        _postings(sale_year, 'Inventory', -cost),
+        _postings(sales['payment_at'].dt.year[year_end_unpaid], 'Accounts_Receivable', revenue[year_end_unpaid]),
+    ]
+
+    # Purchases: cash out (credit a month later), inventory in
+    bought = purchases['quantity'] * purchases['amount']
+    frames += [
+        _postings(_lag_year(purchases['purchase_at'], purchases['payment_method'].ne('cash')), 'Cash', -bought),
+        _postings(purchases['purchase_at'].dt.year, 'Inventory', bought),
+    ]
+
+    frames += [
+        _postings(loans['loan_at'].dt.year, 'Cash', loans['value']),
+        _postings(loans['loan_at'].dt.year, 'Loan_Principal', loans['value']),
+    ]
+
+    kind = payments['payment_type']
+    paid_year = payments['payment_date'].dt.year
+    frames += [
+        _postings(paid_year[kind.isin(OPERATING_CASH_TYPES)], 'Cash', -payments['amount'][kind.isin(OPERATING_CASH_TYPES)]),
+        _postings(paid_year[kind == 'loan'], 'Loan_Principal', -payments['amount'][kind == 'loan']),
+        _postings(paid_year[kind == 'rent'], 'rent', -payments['amount'][kind == 'rent']),
+    ]
+
+    # Accruals: expensed in the month before payment, through accounts payable
+    accrued = payments[
+        kind.isin(ACCRUED_TYPES)
+        & (payments['payment_date'] >= ACCRUAL_START) & (payments['payment_date'] < ACCRUAL_END)
+    ]
+    accrual_year = (accrued['payment_date'] - pd.DateOffset(months=1)).dt.year
+    frames += [
+        _postings(accrual_year, accrued['payment_type'], -accrued['amount']),
+        _postings(accrual_year, 'Accounts_Payable', accrued['amount']),
+        _postings(accrued['payment_date'].dt.year, 'Accounts_Payable', -accrued['amount']),
+    ]
+
+    equipment = payments[(kind == 'equipment') & payments['payment_date'].notna()]
+    schedule = depreciation_schedule(
+        equipment['id'].to_numpy(), equipment['amount'].to_numpy(),
+        equipment['payment_date'].to_numpy(), depreciation_method, useful_life,
+    )
+    frames += [
+        _postings(schedule['year'], 'Depr_Exp', -schedule['annual_depreciation_expense']),
+        _postings(schedule['year'], 'PPE_Snapshot', schedule['gross_val']),
+    ]
+    postings = pd.concat(frames, ignore_index=True)
+    postings['year'] = postings['year'].astype(int)
+    return postings
+
+
+def flux_statement(postings, end_year=2023):
+    """The dashboard_flux_analysis columns from ledger postings: yearly movements, running balances, pivot."""
+    movements = postings.groupby(['year', 'account'], sort=True)['amount'].sum().unstack('account')
+    balances = movements.fillna(0).cumsum().where(movements.notna())
+
+    def column(frame, account):
+        return frame[account] if account in frame else pd.Series(np.nan, index=frame.index)
+
+    income = movements[[a for a in NET_INCOME_ACCOUNTS if a in movements]]
+    ppe = column(movements, 'PPE_Snapshot').fillna(0)
+    statement = pd.DataFrame({
+        'revenue': column(movements, 'Revenue').fillna(0),
+        # NULL in SQL when a year has none of the P&L accounts
+        'net_income': income.sum(axis=1, min_count=1),
+        'cash': column(balances, 'Cash').fillna(0),
+        'accounts_receivable': column(balances, 'Accounts_Receivable').fillna(0),
+        'accounts_payable': column(balances, 'Accounts_Payable').fillna(0),
+        'debt_remaining': column(balances, 'Loan_Principal').fillna(0),
+        'inventory': column(balances, 'Inventory').fillna(0),
+        'gross_ppe': ppe,
+        'net_ppe': (ppe + column(balances, 'Depr_Exp').fillna(0)).clip(lower=0),
+    })
+    statement = statement[statement.index <= end_year].round(2)
+    return statement.rename_axis('year').reset_index()[STATEMENT_COLUMNS]
+
+
+def compute_flux_statement(snapshot, end_year=2023, costing_method=DEFAULT_COSTING_METHOD,
+                           depreciation_method=DEFAULT_DEPRECIATION_METHOD, useful_life=DEFAULT_USEFUL_LIFE):
+    """Offline equivalent of dashboard_flux_analysis, computed from a raw-table snapshot with pandas.
+
+    snapshot maps sales/purchases/payments/loans to DataFrames (see
+    load_snapshot). No database is needed.
+    """
+    started = time.perf_counter()
+    tables = normalize_snapshot(snapshot)
+    statement = flux_statement(
+        gl_postings(tables, costing_method, depreciation_method, useful_life), end_year,
+    )
+    logger.info(f"Offline flux statement: {len(statement)} years in {time.perf_counter() - started:.3f}s.")
+    return statement
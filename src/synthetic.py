@@ -0,0 +1,205 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from utils import logger
+
+# Seasonality of sales and restocks by calendar month (peaks before the holidays)
+MONTH_WEIGHTS = np.array([0.8, 0.75, 0.9, 0.95, 1.0, 1.0, 0.95, 0.95, 1.05, 1.1, 1.25, 1.4])
+PAYMENT_METHODS = ('cash', 'credit', 'transfer')
+PAYMENT_METHOD_WEIGHTS = (0.4, 0.45, 0.15)
+# Recurring monthly expenses and their typical size relative to monthly revenue
+EXPENSE_SHARES = {'wage': 0.18, 'rent': 0.05, 'utility': 0.02, 'tax': 0.04, 'interest': 0.01}
+ROWS_PER_INSERT = 1000
+
+RAW_TABLES_SQL = """
+CREATE TABLE sales (
+    id SERIAL PRIMARY KEY,
+    sale_at TIMESTAMP NOT NULL,
+    product_name VARCHAR NOT NULL,
+    quantity INT NOT NULL,
+    price NUMERIC NOT NULL,
+    payment_method VARCHAR NOT NULL,
+    payment_at TIMESTAMP
+);
+CREATE TABLE purchases (
+    id SERIAL PRIMARY KEY,
+    purchase_at TIMESTAMP NOT NULL,
+    product_name VARCHAR NOT NULL,
+    quantity INT NOT NULL,
+    amount NUMERIC NOT NULL,
+    payment_method VARCHAR NOT NULL
+);
+CREATE TABLE payments (
+    id SERIAL PRIMARY KEY,
+    payment_date DATE NOT NULL,
+    payment_type VARCHAR NOT NULL,
+    amount NUMERIC NOT NULL
+);
+CREATE TABLE loans (
+    id SERIAL PRIMARY KEY,
+    loan_at TIMESTAMP NOT NULL,
+    value NUMERIC NOT NULL
+);
+"""
+
+
+class SyntheticData:
+    """Seeded generator for the raw tables, sized by the number of sales rows.
+
+    Products follow a Zipf-like popularity curve with log-normal unit costs
+    and a per-product markup; sale dates follow MONTH_WEIGHTS with fewer
+    sales on weekends; credit and transfer sales are paid 0-60 days later.
+    Purchases restock the same products at a drifting unit cost, payments
+    cover recurring expenses, loan repayments and equipment, and a few loans
+    are drawn each year. The same seed and size always give the same rows.
+    """
+
+    def __init__(self, sales_rows, seed=42, start_year=2021, years=3):
+        self.sales_rows = int(sales_rows)
+        self.seed = seed
+        self.start_year = start_year
+        self.years = years
+        self.rng = np.random.default_rng(seed)
+
+        n_products = int(min(5000, max(50, np.sqrt(self.sales_rows))))
+        self.products = np.array([f"product_{i:04d}" for i in range(n_products)])
+        popularity = 1.0 / np.arange(1, n_products + 1) ** 1.1
+        self.popularity = popularity / popularity.sum()
+        self.unit_cost = np.round(self.rng.lognormal(mean=3.0, sigma=0.8, size=n_products), 2)
+        self.markup = self.rng.uniform(1.2, 1.8, size=n_products)
+
+        start = np.datetime64(f"{start_year}-01-01")
+        days = np.arange(start, np.datetime64(f"{start_year + years}-01-01"))
+        month = days.astype('datetime64[M]').astype(int) % 12
+        weekday = (days.astype(int) + 3) % 7  # 0 = Monday
+        weights = MONTH_WEIGHTS[month] * np.where(weekday >= 5, 0.6, 1.0)
+        self.days = days
+        self.day_weights = weights / weights.sum()
+
+    def _timestamps(self, n):
+        day = self.rng.choice(self.days, size=n, p=self.day_weights)
+        seconds = self.rng.integers(8 * 3600, 20 * 3600, size=n)
+        return day.astype('datetime64[s]') + seconds
+
+    def sales(self, n):
+        product = self.rng.choice(len(self.products), size=n, p=self.popularity)
+        sale_at = np.sort(self._timestamps(n))
+        method = self.rng.choice(len(PAYMENT_METHODS), size=n, p=PAYMENT_METHOD_WEIGHTS)
+        delay = np.where(method == 0, 0, self.rng.integers(0, 61, size=n)).astype('timedelta64[D]')
+        return pd.DataFrame({
+            'sale_at': sale_at,
+            'product_name': self.products[product],
+            'quantity': self.rng.integers(1, 11, size=n),
+            'price': np.round(self.unit_cost[product] * self.markup[product], 2),
+            'payment_method': np.array(PAYMENT_METHODS)[method],
+            'payment_at': sale_at + delay,
+        })
+
+    def purchases(self, n):
+        product = self.rng.choice(len(self.products), size=n, p=self.popularity)
+        purchase_at = np.sort(self._timestamps(n))
+        # Supplier prices drift up to ~3% a year around the base cost
+        years_in = (purchase_at - purchase_at[0]).astype('timedelta64[D]').astype(float) / 365.0
+        drift = 1 + 0.03 * years_in + self.rng.normal(0, 0.05, size=n)
+        return pd.DataFrame({
+            'purchase_at': purchase_at,
+            'product_name': self.products[product],
+            'quantity': self.rng.integers(10, 101, size=n),
+            'amount': np.round(self.unit_cost[product] * np.clip(drift, 0.5, None), 2),
+            'payment_method': np.where(self.rng.random(n) < 0.3, 'cash', 'credit'),
+        })
+
+    def payments(self, monthly_revenue):
+        months = np.arange(
+            np.datetime64(f"{self.start_year}-01"), np.datetime64(f"{self.start_year + self.years}-01")
+        )
+        frames = []
+        for payment_type, share in EXPENSE_SHARES.items():
+            noise = self.rng.normal(1.0, 0.05, size=len(months))
+            frames.append(pd.DataFrame({
+                'payment_date': months.astype('datetime64[D]') + self.rng.integers(0, 28, size=len(months)),
+                'payment_type': payment_type,
+                'amount': np.round(monthly_revenue * share * noise, 2),
+            }))
+        # Loan repayments and a handful of equipment purchases per year
+        frames.append(pd.DataFrame({
+            'payment_date': months.astype('datetime64[D]') + 14,
+            'payment_type': 'loan',
+            'amount': np.round(np.full(len(months), monthly_revenue * 0.03), 2),
+        }))
+        n_equipment = self.years * max(2, int(np.log10(max(self.sales_rows, 10))))
+        frames.append(pd.DataFrame({
+            'payment_date': self.rng.choice(self.days, size=n_equipment),
+            'payment_type': 'equipment',
+            'amount': np.round(self.rng.uniform(0.2, 1.5, size=n_equipment) * monthly_revenue, 2),
+        }))
+        return pd.concat(frames, ignore_index=True).sort_values('payment_date', kind='stable')
+
+    def loans(self, monthly_revenue):
+        n = self.years * 2
+        return pd.DataFrame({
+            'loan_at': np.sort(self._timestamps(n)),
+            'value': np.round(self.rng.uniform(2, 8, size=n) * monthly_revenue, 2),
+        })
+
+
+def _sql_literals(frame):
+    """One '(v1, v2, ...)' VALUES tuple per row, built column-wise."""
+    parts = []
+    for column in frame.columns:
+        values = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            text = "'" + values.dt.strftime('%Y-%m-%d %H:%M:%S') + "'"
+        elif pd.api.types.is_numeric_dtype(values):
+            text = values.astype(str)
+        else:
+            text = "'" + values.astype(str) + "'"
+        parts.append(text)
+    row = parts[0]
+    for part in parts[1:]:
+        row = row + ", " + part
+    return ("(" + row + ")").tolist()
+
+
+def _write_inserts(handle, table, frame):
+    columns = ', '.join(frame.columns)
+    tuples = _sql_literals(frame)
+    for start in range(0, len(tuples), ROWS_PER_INSERT):
+        handle.write(f"INSERT INTO {table} ({columns}) VALUES\n")
+        handle.write(",\n".join(tuples[start:start + ROWS_PER_INSERT]))
+        handle.write(";\n")
+
+
+def write_setup_script(path, sales_rows, seed=42, start_year=2021, years=3, chunk_rows=1_000_000):
+    """Writes a setup script in the format extract_load() reads.
+
+    Rows are generated and written chunk_rows at a time, so memory stays flat
+    at any scale. Returns {table: rows written}.
+    """
+    started = time.perf_counter()
+    data = SyntheticData(sales_rows, seed, start_year, years)
+    mean_price = float(np.dot(data.popularity, data.unit_cost * data.markup))
+    monthly_revenue = sales_rows * 5.5 * mean_price / (12 * years)
+    counts = {}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as handle:
+        handle.write(f"-- Synthetic data: {sales_rows:,} sales rows, seed {seed}\n")
+        handle.write(RAW_TABLES_SQL)
+        for table, total in (('sales', sales_rows), ('purchases', max(1, sales_rows // 4))):
+            generate = data.sales if table == 'sales' else data.purchases
+            for offset in range(0, total, chunk_rows):
+                frame = generate(min(chunk_rows, total - offset))
+                _write_inserts(handle, table, frame)
+            counts[table] = total
+        for table, frame in (('payments', data.payments(monthly_revenue)), ('loans', data.loans(monthly_revenue))):
+            _write_inserts(handle, table, frame)
+            counts[table] = len(frame)
+
+    logger.info(
+        f"Synthetic script {path}: "
+        + ", ".join(f"{table} {rows:,}" for table, rows in counts.items())
+        + f" in {time.perf_counter() - started:.1f}s."
+    )
+    return counts
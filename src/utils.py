@@ -1,6 +1,9 @@
 import logging
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
 
 # logging setup
 logging.basicConfig(
@@ -15,19 +18,173 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- DATABASE CONNECTION ---
+# Defaults match the docker-compose 'db' service; override them via environment.
+def get_db_settings():
+    """Reads connection and pool settings from the environment."""
+    return {
+        "url": os.getenv("DATABASE_URL"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "postgres"),
+        "host": os.getenv("DB_HOST", "db"),
+        "port": os.getenv("DB_PORT", "5432"),
+        "db": os.getenv("DB_NAME", "postgres"),
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        # Schema every unqualified table lives in (one per entity, see entities.py)
+        "schema": os.getenv("DB_SCHEMA"),
+    }
+
+
+# Seconds a SQLite connection waits for another writer before giving up
+SQLITE_BUSY_TIMEOUT = 30
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+pool_metrics = {
+    "connections_created": 0,
+    "checkouts": 0,
+    "checkins": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+}
+# Pool events fire on every thread that checks out a connection
+_metrics_lock = threading.Lock()
+
+
+def _add_metric(name, value=1):
+    with _metrics_lock:
+        pool_metrics[name] += value
+
+
+def _register_pool_events(engine):
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, conn_record):
+        _add_metric("connections_created")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_conn, conn_record, conn_proxy):
+        _add_metric("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_conn, conn_record):
+        _add_metric("checkins")
+
+
 def get_engine():
-        user = "postgres"
-        password = "postgres"  
-        host = "db"     
-        port = "5432"
-        db = "postgres"
+    """Returns the process-wide pooled engine, creating it on first use."""
+    global _engine, _engine_pid
+    # A forked worker must not reuse the parent's sockets
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+
+    with _engine_lock:
+        if _engine is not None and _engine_pid == os.getpid():
+            return _engine
 
+        settings = get_db_settings()
+        url = settings["url"] or (
+            f"postgresql://{settings['user']}:{settings['password']}"
+            f"@{settings['host']}:{settings['port']}/{settings['db']}"
+        )
         try:
-            engine = create_engine(
-                f"postgresql://{user}:{password}@{host}:{port}/{db}"
-            )
-            logger.info("Successfully connected to the PostgreSQL database.")
-            return engine
-        except Exception as e:  
+            if url.startswith("sqlite"):
+                # Embedded backend (see sqlite_backend.py): one file, no server. Writers
+                # wait for each other's lock instead of failing right away
+                engine = create_engine(url, connect_args={"timeout": SQLITE_BUSY_TIMEOUT})
+            else:
+                connect_args = {}
+                if settings["schema"]:
+                    connect_args["options"] = f"-csearch_path={settings['schema']}"
+                engine = create_engine(
+                    url,
+                    pool_size=settings["pool_size"],
+                    max_overflow=settings["max_overflow"],
+                    pool_timeout=settings["pool_timeout"],
+                    pool_recycle=settings["pool_recycle"],
+                    pool_pre_ping=settings["pool_pre_ping"],
+                    connect_args=connect_args,
+                )
+        except Exception as e:
             logger.error(f"Error connecting to the PostgreSQL database: {e}")
-            raise
\ No newline at end of file
+            raise
+
+        _register_pool_events(engine)
+        _engine, _engine_pid = engine, os.getpid()
+        logger.info(
+            f"Created pooled engine for {engine.url.host or engine.url.database} "
+            f"(schema={settings['schema'] or 'default'}, "
+            f"pool_size={settings['pool_size']}, max_overflow={settings['max_overflow']})."
+        )
+        return _engine
+
+
+def get_backend():
+    """Dialect of the configured database: 'postgresql' or 'sqlite'."""
+    return get_engine().dialect.name
+
+
+def dispose_engine():
+    """Closes the pooled engine; the next get_engine() builds a new one from the environment."""
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine, _engine_pid = None, None
+
+
+def table_exists(conn, table):
+    """True when a table or view of that name is visible to conn."""
+    if conn.dialect.name == 'sqlite':
+        sql = "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = :table"
+    else:
+        sql = "SELECT to_regclass(:table)"
+    return conn.execute(text(sql), {"table": table}).scalar() is not None
+
+
+def _record_wait(started):
+    waited = time.perf_counter() - started
+    with _metrics_lock:
+        pool_metrics["wait_seconds"] += waited
+        pool_metrics["max_wait_seconds"] = max(pool_metrics["max_wait_seconds"], waited)
+
+
+@contextmanager
+def get_connection():
+    """Checks a SQLAlchemy connection out of the shared pool for a with-block."""
+    started = time.perf_counter()
+    conn = get_engine().connect()
+    _record_wait(started)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def get_raw_connection():
+    """Checks a raw DBAPI (psycopg2) connection out of the shared pool for a with-block."""
+    started = time.perf_counter()
+    conn = get_engine().raw_connection()
+    _record_wait(started)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def log_pool_metrics():
+    """Logs connection churn and pool wait time collected so far."""
+    with _metrics_lock:
+        metrics = dict(pool_metrics)
+    logger.info(
+        f"Pool metrics: {metrics['connections_created']} connections created, "
+        f"{metrics['checkouts']} checkouts, "
+        f"{metrics['wait_seconds']:.3f}s total wait "
+        f"(max {metrics['max_wait_seconds']:.3f}s)."
+    )
+    return metrics